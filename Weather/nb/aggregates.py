@@ -0,0 +1,217 @@
+from cassandra import ConsistencyLevel, InvalidRequest
+from backends import Writer, MAX_IN_FLIGHT
+
+# station_aggregates holds the running extremes, station_counts the running totals;
+# Cassandra won't mix counter and regular columns in one table
+CREATE_AGGREGATES = """CREATE TABLE IF NOT EXISTS station_aggregates (id text PRIMARY KEY, tmax int, tmin int, spread_min int, spread_max int)"""
+# station_aggregates tables made before the spread columns existed get them added; rows
+# already there keep null spread bounds until a backfill fills them
+SPREAD_COLUMNS = ('spread_min', 'spread_max')
+CREATE_COUNTS = """CREATE TABLE IF NOT EXISTS station_counts (id text PRIMARY KEY, records counter, tmax_sum counter, tmin_sum counter)"""
+# the reading each station-day was counted with. Counter increments aren't idempotent,
+# so station_counts only moves by what a conditional write here says is new: a first
+# reading adds itself, a changed one the difference, and a replayed one nothing
+CREATE_COUNTED = """CREATE TABLE IF NOT EXISTS station_counted (id text, date date, tmin int, tmax int, PRIMARY KEY (id, date))"""
+
+# the extremes kept in station_aggregates, as (column, summary index, True if it only
+# rises). Overwriting a reading can take an extreme back inward, which a conditional
+# raise can't; the bound is unset instead (null, unknown, like a bound from before the
+# spread columns) and readers go to the readings for it until a backfill sets it again
+EXTREMES = (('tmin', 0, False), ('tmax', 1, True), ('spread_min', 5, False), ('spread_max', 6, True))
+
+def summarize(tmins, tmaxs):
+    # (tmin, tmax, count, tmax_sum, tmin_sum, spread_min, spread_max) for one station's
+    # rows, spread being tmax - tmin of a day
+    spreads = [hi - lo for lo, hi in zip(tmins, tmaxs)]
+    return (min(tmins), max(tmaxs), len(tmaxs), sum(tmaxs), sum(tmins), min(spreads), max(spreads))
+
+def merge(a, b):
+    if a is None:
+        return b
+    return (min(a[0], b[0]), max(a[1], b[1]), a[2] + b[2], a[3] + b[3], a[4] + b[4], min(a[5], b[5]), max(a[6], b[6]))
+
+def spread_stats(extremes, counts):
+    # (count, mean spread, min spread, max spread) from a station_aggregates row and a
+    # station_counts row; the mean is (sum of tmax - sum of tmin) / count. None when the
+    # row's spread bounds are unknown (null, from before they were kept)
+    if not counts or not counts.records:
+        return (0, 0.0, 0, 0)
+    if extremes and (extremes.spread_min is None or extremes.spread_max is None):
+        return None
+    mean = (counts.tmax_sum - counts.tmin_sum) / counts.records
+    return (counts.records, mean, extremes.spread_min if extremes else 0, extremes.spread_max if extremes else 0)
+
+def scan_stats(rows):
+    # the same from (tmin, tmax) rows, for when there are no aggregates to read
+    count = total = 0
+    lo = hi = None
+    for tmin, tmax in rows:
+        if tmin is None or tmax is None:
+            continue
+        spread = tmax - tmin
+        count += 1
+        total += spread
+        lo = spread if lo is None else min(lo, spread)
+        hi = spread if hi is None else max(hi, spread)
+    return (count, total / count, lo, hi) if count else (0, 0.0, 0, 0)
+
+class StationAggregates:
+    def __init__(self, cass):
+        self.cass = cass
+        cass.execute(CREATE_AGGREGATES)
+        for column in SPREAD_COLUMNS:
+            try:
+                cass.execute("ALTER TABLE station_aggregates ADD %s int" % column)
+            except InvalidRequest:
+                # already there
+                pass
+        cass.execute(CREATE_COUNTS)
+        cass.execute(CREATE_COUNTED)
+        self.create_statement = cass.prepare("""INSERT INTO station_aggregates (id, tmin, tmax, spread_min, spread_max) VALUES(?,?,?,?,?) IF NOT EXISTS""")
+        self.extreme_statements = [cass.prepare("""UPDATE station_aggregates SET %s = ? WHERE id = ? IF %s %s ?"""
+                                                % (column, column, '<' if rises else '>'))
+                                   for column, index, rises in EXTREMES]
+        self.fill_statements = [cass.prepare("""UPDATE station_aggregates SET %s = ? WHERE id = ? IF %s = null""" % (column, column))
+                                for column, index, rises in EXTREMES]
+        # only while the stored bound is still no further out than the overwritten value,
+        # i.e. nothing since has taken it past that reading
+        self.unset_statements = [cass.prepare("""UPDATE station_aggregates SET %s = null WHERE id = ? IF %s %s ?"""
+                                              % (column, column, '<=' if rises else '>='))
+                                 for column, index, rises in EXTREMES]
+        self.count_statement = cass.prepare("""UPDATE station_counts SET records = records + ?, tmax_sum = tmax_sum + ?, tmin_sum = tmin_sum + ? WHERE id = ?""")
+        self.count_statement.consistency_level = ConsistencyLevel.ONE
+        self.counted_statement = cass.prepare("""INSERT INTO station_counted (id, date, tmin, tmax) VALUES(?,?,?,?) IF NOT EXISTS""")
+        self.recount_statement = cass.prepare("""UPDATE station_counted SET tmin = ?, tmax = ? WHERE id = ? AND date = ? IF tmin = ? AND tmax = ?""")
+        self.counted_write_statement = cass.prepare("""INSERT INTO station_counted (id, date, tmin, tmax) VALUES(?,?,?,?)""")
+        self.max_statement = cass.prepare("""SELECT tmax FROM station_aggregates WHERE id = ?""")
+        self.max_statement.consistency_level = ConsistencyLevel.THREE
+        self.max_statement.is_idempotent = True
+        self.extremes_statement = cass.prepare("""SELECT spread_min, spread_max FROM station_aggregates WHERE id = ?""")
+        self.totals_statement = cass.prepare("""SELECT records, tmax_sum, tmin_sum FROM station_counts WHERE id = ?""")
+        # every station's tmax, a row each, for ranking stations without touching readings
+        self.tmaxes_statement = cass.prepare("""SELECT id, tmax FROM station_aggregates""")
+        for statement in (self.extremes_statement, self.totals_statement, self.tmaxes_statement):
+            statement.consistency_level = ConsistencyLevel.ONE
+            statement.is_idempotent = True
+        # extremes this process has already seen stored, per station. The stored tmax only
+        # ever rises (and tmin only falls, and so on) or is unset, so a reading inside
+        # these bounds can't change the row and skips the Paxos round entirely
+        self.known = {}
+
+    def count_steps(self, station, readings):
+        # the (records, tmax_sum, tmin_sum) readings, (date, tmin, tmax) tuples, add to
+        # station_counts once station_counted has taken them, and the (old tmin, old tmax,
+        # tmin, tmax) of each reading they overwrote. Yields lists of queries like
+        # merge_steps, MAX_IN_FLIGHT at a time
+        records = tmax_sum = tmin_sum = 0
+        replaced = []
+        for start in range(0, len(readings), MAX_IN_FLIGHT):
+            chunk = readings[start:start + MAX_IN_FLIGHT]
+            results = yield [(self.counted_statement, (station, date, tmin, tmax)) for date, tmin, tmax in chunk]
+            changed = []
+            for (date, tmin, tmax), rows in zip(chunk, results):
+                if rows[0][0]:
+                    records, tmax_sum, tmin_sum = records + 1, tmax_sum + tmax, tmin_sum + tmin
+                else:
+                    changed.append((date, tmin, tmax, rows[0].tmin, rows[0].tmax))
+            # an update only lands if the counted reading is still the one it replaces;
+            # losing that race hands back the newer one to try again from
+            while True:
+                changed = [c for c in changed if c[1:3] != c[3:5]]
+                if not changed:
+                    break
+                results = yield [(self.recount_statement, (tmin, tmax, station, date, old_tmin, old_tmax))
+                                 for date, tmin, tmax, old_tmin, old_tmax in changed]
+                again = []
+                for (date, tmin, tmax, old_tmin, old_tmax), rows in zip(changed, results):
+                    if rows[0][0]:
+                        tmax_sum, tmin_sum = tmax_sum + tmax - old_tmax, tmin_sum + tmin - old_tmin
+                        replaced.append((old_tmin, old_tmax, tmin, tmax))
+                    else:
+                        again.append((date, tmin, tmax, rows[0].tmin, rows[0].tmax))
+                changed = again
+        return (records, tmax_sum, tmin_sum), replaced
+
+    def merge_steps(self, station, summary, readings=None, complete=False):
+        # yields lists of (statement, params) and is sent back each one's result rows;
+        # run it with run() here or with the async driver in server.py. The counters move
+        # by what count_steps finds new in readings; without readings (backfill, which
+        # works out the exact difference itself) by the summary's counts. A stored bound
+        # that is null is unknown: only a summary of every reading the station has
+        # (complete, as backfill passes) can fill it, and other writes leave it alone.
+        # Readings that overwrite others may unset bounds (see EXTREMES)
+        known = self.known.get(station)
+        if known is None:
+            values = [summary[index] for column, index, rises in EXTREMES]
+            row = (yield [(self.create_statement, (station, *values))])[0][0]
+            known = values if row[0] else [getattr(row, column) for column, index, rises in EXTREMES]
+        known = list(known)
+        for i, (column, index, rises) in enumerate(EXTREMES):
+            value = summary[index]
+            if known[i] is None:
+                if not complete:
+                    continue
+                row = (yield [(self.fill_statements[i], (value, station))])[0][0]
+                known[i] = value if row[0] else getattr(row, column)
+            if value <= known[i] if rises else value >= known[i]:
+                continue
+            # a failed condition hands back the stored value, which is already the better bound
+            row = (yield [(self.extreme_statements[i], (value, station, value))])[0][0]
+            known[i] = value if row[0] else getattr(row, column)
+        counts, replaced = (summary[2:5], []) if readings is None else (yield from self.count_steps(station, readings))
+        if any(counts):
+            yield [(self.count_statement, (*counts, station))]
+        # per bound, the furthest out of the overwritten values it moved inward from; one
+        # that doesn't reach the bound as known here can't be what is stored
+        unset = {}
+        for old_tmin, old_tmax, tmin, tmax in replaced:
+            old, new = summarize([old_tmin], [old_tmax]), summarize([tmin], [tmax])
+            for i, (column, index, rises) in enumerate(EXTREMES):
+                if known[i] is None or (new[index] >= old[index] if rises else new[index] <= old[index]):
+                    continue
+                if old[index] >= known[i] if rises else old[index] <= known[i]:
+                    unset[i] = old[index] if i not in unset else (max if rises else min)(unset[i], old[index])
+        if unset:
+            indexes = sorted(unset)
+            results = yield [(self.unset_statements[i], (station, unset[i])) for i in indexes]
+            for i, rows in zip(indexes, results):
+                known[i] = None if rows[0][0] else getattr(rows[0], EXTREMES[i][0])
+        self.known[station] = known
+
+    def run(self, steps):
+        try:
+            queries = next(steps)
+            while True:
+                futures = [self.cass.execute_async(statement, params) for statement, params in queries]
+                queries = steps.send([future.result().current_rows for future in futures])
+        except StopIteration:
+            pass
+
+    def update(self, station, summary, readings=None, complete=False):
+        self.run(self.merge_steps(station, summary, readings, complete))
+
+    def backfill(self):
+        # rebuild the tables from the stations partitions; run it with ingest paused,
+        # since counters can only be moved by a delta from their current value. CQL can't
+        # aggregate tmax - tmin, so each partition's rows are summarized here. Every
+        # reading is also recorded in station_counted, which is also how a keyspace from
+        # before station_counted existed gets its readings in there
+        rows = self.cass.prepare("""SELECT date, record.tmin, record.tmax FROM stations WHERE id = ?""")
+        self.known.clear()
+        writer = Writer(self.cass)
+        stations = [row.id for row in self.cass.execute("SELECT DISTINCT id FROM stations")]
+        for station in stations:
+            readings = [r for r in self.cass.execute(rows, (station,)) if r[0] is not None and r[1] is not None and r[2] is not None]
+            if not readings:
+                continue
+            for date, tmin, tmax in readings:
+                writer.send(self.counted_write_statement, (station, date, tmin, tmax))
+            tmin, tmax, count, tmax_sum, tmin_sum, spread_min, spread_max = summarize([r[1] for r in readings], [r[2] for r in readings])
+            have = self.cass.execute(self.totals_statement, (station,)).one() or (0, 0, 0)
+            have = [v or 0 for v in have]
+            summary = (tmin, tmax, count - have[0], tmax_sum - have[1], tmin_sum - have[2], spread_min, spread_max)
+            self.update(station, summary, complete=True)
+        writer.drain()
+        if writer.errors:
+            raise writer.errors[0]
+        return len(stations)
@@ -0,0 +1,60 @@
+from cassandra import ConsistencyLevel
+from cassandra.query import BatchStatement, BatchType
+from collections import deque
+from cassandra_session import connect
+
+# rows per single-partition UNLOGGED batch, and batches in flight at once, for every
+# bulk write: the servicer's batch RPCs and the loaders alike
+BATCH_ROWS = 50
+MAX_IN_FLIGHT = 64
+
+class StorageBackend:
+    # what StationServicer needs from storage: a (cluster, session) pair whose session
+    # speaks the driver's prepare/execute/execute_async API, and a factory for the
+    # single-partition write batches
+    def connect(self, keyspace):
+        raise NotImplementedError
+
+    def batch(self):
+        raise NotImplementedError
+
+class CassandraBackend(StorageBackend):
+    def __init__(self, **options):
+        self.options = options
+
+    def connect(self, keyspace):
+        return connect(keyspace, **self.options)
+
+    def batch(self):
+        return BatchStatement(batch_type=BatchType.UNLOGGED, consistency_level=ConsistencyLevel.ONE)
+
+class Writer:
+    # writes with at most in_flight outstanding: send() starts one and, once the limit
+    # is reached, waits for the oldest. written counts the rows of the ones that
+    # succeeded and errors keeps the exceptions of the rest; done(tag, error), if
+    # given, hears about each as it is collected
+    def __init__(self, cass, in_flight=MAX_IN_FLIGHT, done=None):
+        self.cass = cass
+        self.in_flight = in_flight
+        self.done = done
+        self.pending = deque()
+        self.written = 0
+        self.errors = []
+
+    def send(self, statement, params=None, rows=1, tag=None):
+        self.pending.append((self.cass.execute_async(statement, params), rows, tag))
+        self.drain(self.in_flight)
+
+    def drain(self, limit=0):
+        while len(self.pending) > limit:
+            future, rows, tag = self.pending.popleft()
+            try:
+                future.result()
+            except Exception as e:
+                self.errors.append(e)
+                if self.done:
+                    self.done(tag, e)
+                continue
+            self.written += rows
+            if self.done:
+                self.done(tag, None)
@@ -0,0 +1,173 @@
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+import grpc
+import station_pb2
+import station_pb2_grpc
+from records import temperature_table, date_string, RECORDS
+
+# requests per op in a "record=8,max=2" style mix
+DEFAULT_MIX = "record=8,max=2"
+BATCH_SIZE = 100
+MANY_SIZE = 4
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        op, _, weight = part.partition('=')
+        mix[op.strip()] = float(weight or 1)
+    unknown = set(mix) - set(OPS)
+    if unknown:
+        raise SystemExit("unknown ops in mix: " + ", ".join(sorted(unknown)))
+    return mix
+
+def percentile(ordered, q):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class Workload:
+    # replays records.parquet forever, cycling through the rows in file order
+    def __init__(self, path):
+        table = temperature_table(path)
+        self.rows = list(zip(table['station'].to_pylist(), table['days'].to_pylist(),
+                             table['tmin'].to_pylist(), table['tmax'].to_pylist()))
+        self.stations = sorted(set(r[0] for r in self.rows))
+        self.cursor = itertools.cycle(range(len(self.rows)))
+
+    def next_rows(self, n):
+        return [self.rows[next(self.cursor)] for _ in range(n)]
+
+async def op_record(stub, work):
+    station, days, tmin, tmax = work.next_rows(1)[0]
+    reply = await stub.RecordTemps(station_pb2.RecordTempsRequest(station=station, date=date_string(days), tmin=tmin, tmax=tmax))
+    return reply.error
+
+async def op_batch(stub, work):
+    rows = work.next_rows(BATCH_SIZE)
+    station = rows[0][0]
+    rows = [r for r in rows if r[0] == station]
+    reply = await stub.RecordTempsColumnar(station_pb2.RecordTempsColumns(
+        station=station, days=[r[1] for r in rows], tmin=[r[2] for r in rows], tmax=[r[3] for r in rows]))
+    return reply.errors[0].error if reply.errors else ""
+
+async def op_max(stub, work):
+    reply = await stub.StationMax(station_pb2.StationMaxRequest(station=random.choice(work.stations)))
+    return reply.error
+
+async def op_many(stub, work):
+    reply = await stub.StationMaxMany(station_pb2.StationMaxManyRequest(stations=random.sample(work.stations, min(MANY_SIZE, len(work.stations)))))
+    return next(iter(reply.errors.values()), "")
+
+async def op_range(stub, work):
+    error = ""
+    async for page in stub.StationRange(station_pb2.StationRangeRequest(station=random.choice(work.stations))):
+        error = error or page.error
+    return error
+
+async def op_stats(stub, work):
+    reply = await stub.StationStats(station_pb2.StationStatsRequest(station=random.choice(work.stations)))
+    return reply.error
+
+async def op_top(stub, work):
+    reply = await stub.TopStations(station_pb2.TopStationsRequest())
+    return reply.error
+
+OPS = {"record": op_record, "batch": op_batch, "max": op_max, "many": op_many, "range": op_range, "stats": op_stats,
+       "top": op_top}
+
+class Recorder:
+    def __init__(self):
+        self.latency = {}
+        self.errors = {}
+
+    async def call(self, op, stub, work, start=None):
+        # open loop passes the scheduled start so queueing delay counts against the server
+        start = time.perf_counter() if start is None else start
+        try:
+            error = await OPS[op](stub, work)
+        except grpc.RpcError as e:
+            error = e.code().name
+        self.latency.setdefault(op, []).append(time.perf_counter() - start)
+        if error:
+            self.errors[op] = self.errors.get(op, 0) + 1
+
+    def report(self, elapsed):
+        ops = {}
+        for op, samples in sorted(self.latency.items()):
+            ordered = sorted(samples)
+            ops[op] = {"requests": len(ordered), "errors": self.errors.get(op, 0),
+                       "throughput": len(ordered) / elapsed,
+                       **{name: 1000 * percentile(ordered, q) for name, q in
+                          [("p50_ms", .50), ("p95_ms", .95), ("p99_ms", .99), ("p999_ms", .999)]}}
+        total = sum(len(s) for s in self.latency.values())
+        return {"elapsed_s": elapsed, "requests": total, "throughput": total / elapsed, "ops": ops}
+
+async def closed_loop(stub, work, recorder, mix, concurrency, deadline):
+    # concurrency clients, each sending its next request as soon as the last returns
+    ops, weights = list(mix), list(mix.values())
+
+    async def client():
+        while time.perf_counter() < deadline:
+            await recorder.call(random.choices(ops, weights)[0], stub, work)
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+
+async def open_loop(stub, work, recorder, mix, rate, deadline):
+    # Poisson arrivals at rate per second no matter how the server keeps up
+    ops, weights = list(mix), list(mix.values())
+    tasks = set()
+    due = time.perf_counter()
+    while due < deadline:
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.ensure_future(recorder.call(random.choices(ops, weights)[0], stub, work, start=due))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        due += random.expovariate(rate)
+    await asyncio.gather(*tasks)
+
+async def run(args):
+    work = Workload(args.records)
+    mix = parse_mix(args.mix)
+    async with grpc.aio.insecure_channel(args.target) as channel:
+        stub = station_pb2_grpc.StationStub(channel)
+        await channel.channel_ready()
+        if args.warmup:
+            await closed_loop(stub, work, Recorder(), mix, args.concurrency, time.perf_counter() + args.warmup)
+        recorder = Recorder()
+        start = time.perf_counter()
+        if args.loop == "open":
+            await open_loop(stub, work, recorder, mix, args.rate, start + args.duration)
+        else:
+            await closed_loop(stub, work, recorder, mix, args.concurrency, start + args.duration)
+        report = recorder.report(time.perf_counter() - start)
+    report.update(label=args.label, target=args.target, loop=args.loop, mix=mix,
+                  concurrency=args.concurrency if args.loop == "closed" else None,
+                  rate=args.rate if args.loop == "open" else None)
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="replay records.parquet against the Station service and report latency as JSON")
+    parser.add_argument("--target", default="localhost:5440")
+    parser.add_argument("--records", default=RECORDS, help="directory of records.parquet parts")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="op weights, from " + ", ".join(OPS))
+    parser.add_argument("--loop", choices=["closed", "open"], default="closed")
+    parser.add_argument("--concurrency", type=int, default=16, help="clients in flight (closed loop)")
+    parser.add_argument("--rate", type=float, default=500.0, help="requests per second (open loop)")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to measure")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds to run before measuring")
+    parser.add_argument("--label", default="", help="free-form tag copied into the report, e.g. server mode")
+    parser.add_argument("--out", help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
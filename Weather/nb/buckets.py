@@ -0,0 +1,148 @@
+from cassandra import ConsistencyLevel
+from cassandra.cqltypes import SimpleDateType
+import argparse
+import datetime
+import time
+from backends import CassandraBackend, Writer, BATCH_ROWS, MAX_IN_FLIGHT
+from memory_backend import MemoryBackend
+
+# the same readings as stations, but one partition per station and year, so a partition
+# stops growing at 366 rows and a read touches only the years it needs. station_years
+# lists the buckets each station has, which is what the reads fan out over
+CREATE_BUCKETS = """CREATE TABLE IF NOT EXISTS stations_by_year (id text, year int, date date, record station_record, PRIMARY KEY ((id, year), date)) WITH CLUSTERING ORDER BY (date ASC)"""
+CREATE_YEARS = """CREATE TABLE IF NOT EXISTS station_years (id text, year int, PRIMARY KEY (id, year))"""
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+def year_of(date):
+    # 'YYYY-MM-DD' from RecordTemps; anything else is left for the insert to reject
+    return int(date[:4]) if date[:4].isdigit() else 0
+
+def year_of_day(days):
+    # days counted from 1970-01-01; the open ends of a range clamp to years 1 and 9999
+    ordinal = min(max(EPOCH_ORDINAL + days, 1), datetime.date.max.toordinal())
+    return datetime.date.fromordinal(ordinal).year
+
+def year_runs(days):
+    # [year, start, end] for each run of consecutive entries of days (counted from
+    # 1970-01-01) that fall in the same year; sorted input gives one run per year
+    runs = []
+    first = last = None
+    for i, d in enumerate(days):
+        if first is not None and first <= d < last:
+            runs[-1][2] = i + 1
+            continue
+        year = year_of_day(d)
+        first = datetime.date(year, 1, 1).toordinal() - EPOCH_ORDINAL
+        last = (datetime.date(year + 1, 1, 1).toordinal() if year < datetime.MAXYEAR else datetime.date.max.toordinal() + 1) - EPOCH_ORDINAL
+        runs.append([year, i, i + 1])
+    return runs
+
+def day_string(days):
+    # days from 1970-01-01 -> 'YYYY-MM-DD', the form RecordTemps takes
+    return datetime.date.fromordinal(EPOCH_ORDINAL + days).isoformat()
+
+def day_number(value):
+    # a StationRange bound (YYYY-MM-DD or a driver day number) -> days from 1970-01-01
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value).toordinal() - EPOCH_ORDINAL
+    return value - SimpleDateType.EPOCH_OFFSET_DAYS
+
+class BucketedLayout:
+    # statements for stations_by_year. Writes add a station_years row to every batch,
+    # one small extra partition, so a bucket is listed no later than its readings are
+    # acknowledged; reads list the buckets, then query them all at once and merge
+    def __init__(self, cass):
+        self.cass = cass
+        cass.execute(CREATE_BUCKETS)
+        cass.execute(CREATE_YEARS)
+        self.insert_statement = cass.prepare("""INSERT INTO stations_by_year (id, year, date, record) VALUES(?,?,?,?) """)
+        self.insert_columns_statement = cass.prepare("""INSERT INTO stations_by_year (id, year, date, record) VALUES(?,?,?,{tmin: ?, tmax: ?}) """)
+        self.year_statement = cass.prepare("""INSERT INTO station_years (id, year) VALUES(?,?) """)
+        for statement in (self.insert_statement, self.insert_columns_statement, self.year_statement):
+            statement.consistency_level = ConsistencyLevel.ONE
+        self.years_statement = cass.prepare("""SELECT year FROM station_years WHERE id = ? """)
+        self.max_statement = cass.prepare("""SELECT MAX(record.tmax) FROM stations_by_year WHERE id = ? AND year = ? """)
+        self.range_statement = cass.prepare("""SELECT date, record.tmin, record.tmax FROM stations_by_year WHERE id = ? AND year = ? AND date >= ? AND date <= ? """)
+        self.scan_statement = cass.prepare("""SELECT record.tmin, record.tmax FROM stations_by_year WHERE id = ? AND year = ? """)
+        self.series_statement = cass.prepare("""SELECT date, record.tmin, record.tmax FROM stations_by_year WHERE id = ? AND year = ? """)
+        for statement in (self.years_statement, self.range_statement, self.scan_statement, self.series_statement):
+            statement.consistency_level = ConsistencyLevel.ONE
+        self.max_statement.consistency_level = ConsistencyLevel.THREE
+        for statement in (self.years_statement, self.max_statement, self.range_statement, self.scan_statement,
+                          self.series_statement):
+            statement.is_idempotent = True
+
+    def mark(self, batch, station, year):
+        batch.add(self.year_statement, (station, year))
+
+    def years(self, station, consistency=ConsistencyLevel.ONE):
+        # StationMax reads the bucket list with the same THREE replicas as the buckets
+        bound = self.years_statement.bind((station,))
+        bound.consistency_level = consistency
+        return bound
+
+    # the read steps below yield a list of (statement, params) to run in parallel and are
+    # sent back the list of their rows; the generator's return value is the answer
+
+    def max_steps(self, station):
+        years = [r[0] for r in (yield [(self.years(station, ConsistencyLevel.THREE), None)])[0]]
+        results = yield [(self.max_statement, (station, year)) for year in years]
+        maxes = [rows[0][0] for rows in results if rows and rows[0][0] is not None]
+        return max(maxes) if maxes else None
+
+    def scan_steps(self, station, statement=None):
+        years = [r[0] for r in (yield [(self.years(station), None)])[0]]
+        results = yield [(statement or self.scan_statement, (station, year)) for year in years]
+        return [row for rows in results for row in rows]
+
+    def series_steps(self, station):
+        # every (date, tmin, tmax) of the station, for the series cache
+        return self.scan_steps(station, self.series_statement)
+
+    def range_queries(self, station, years, start, end, fetch_size):
+        # one bound query per bucket that overlaps [start, end], in date order
+        first, last = year_of_day(day_number(start)), year_of_day(day_number(end))
+        queries = []
+        for year in sorted(y for y in years if first <= y <= last):
+            bound = self.range_statement.bind((station, year, start, end))
+            bound.fetch_size = fetch_size
+            queries.append(bound)
+        return queries
+
+def migrate(backend, in_flight=MAX_IN_FLIGHT):
+    # copies every reading in stations into stations_by_year, a partition at a time;
+    # safe to run again (inserts are idempotent), and best run with ingest paused
+    cluster, cass = backend.connect('weather')
+    layout = BucketedLayout(cass)
+    rows = cass.prepare("""SELECT date, record.tmin, record.tmax FROM stations WHERE id = ? """)
+    stations = [row.id for row in cass.execute("SELECT DISTINCT id FROM stations")]
+    writer = Writer(cass, in_flight)
+    for station in stations:
+        buckets = {}
+        for date, tmin, tmax in cass.execute(rows, (station,)):
+            if date is not None:
+                buckets.setdefault(date.date().year, []).append((date.days_from_epoch, tmin, tmax))
+        for year, readings in buckets.items():
+            for start in range(0, len(readings), BATCH_ROWS):
+                chunk = readings[start:start + BATCH_ROWS]
+                batch = backend.batch()
+                layout.mark(batch, station, year)
+                for days, tmin, tmax in chunk:
+                    batch.add(layout.insert_columns_statement, (station, year, days + SimpleDateType.EPOCH_OFFSET_DAYS, tmin, tmax))
+                writer.send(batch, rows=len(chunk))
+    writer.drain()
+    return len(stations), writer.written, writer.errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="copy weather.stations into the year-bucketed stations_by_year layout")
+    parser.add_argument("--backend", choices=["cassandra", "memory"], default="cassandra")
+    parser.add_argument("--in-flight", type=int, default=MAX_IN_FLIGHT, help="batches outstanding at once")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    backend = MemoryBackend() if args.backend == "memory" else CassandraBackend()
+    stations, copied, errors = migrate(backend, args.in_flight)
+    print("copied %d readings of %d stations in %.3fs, %d failed batches"
+          % (copied, stations, time.perf_counter() - start, len(errors)), flush = True)
+    for e in errors[:5]:
+        print(e)
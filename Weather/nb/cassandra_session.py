@@ -0,0 +1,157 @@
+from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT
+from cassandra.policies import ConstantSpeculativeExecutionPolicy, DCAwareRoundRobinPolicy, TokenAwarePolicy, WrapperPolicy
+import argparse
+import json
+import threading
+import time
+
+HOSTS = ['p6-db-1', 'p6-db-2', 'p6-db-3']
+
+def host_key(host):
+    # coordinator_host and the metadata replicas don't always hand back the same object
+    return str(getattr(host, 'endpoint', host))
+
+class LatencyAwarePolicy(WrapperPolicy):
+    # the python driver has no latency-aware policy, so this keeps an EWMA of response
+    # time per coordinator and moves hosts much slower than the fastest one to the back
+    # of the child's plan. A host's score is forgotten after retry_period without new
+    # samples, so a slow node that recovers gets traffic back
+    def __init__(self, child_policy, exclusion_threshold=2.0, scale=0.1, min_samples=50, retry_period=10.0):
+        super().__init__(child_policy)
+        self.exclusion_threshold = exclusion_threshold
+        self.scale = scale
+        self.min_samples = min_samples
+        self.retry_period = retry_period
+        self.latency = {}
+        self.lock = threading.Lock()
+
+    def attach(self, session):
+        session.add_request_init_listener(self._on_request)
+
+    def _on_request(self, future):
+        start = time.monotonic()
+
+        def done(_):
+            self.record(future.coordinator_host, time.monotonic() - start)
+
+        future.add_callbacks(done, done)
+
+    def record(self, host, elapsed):
+        if host is None:
+            return
+        with self.lock:
+            average, samples, _ = self.latency.get(host_key(host), (elapsed, 0, 0))
+            average += self.scale * (elapsed - average)
+            self.latency[host_key(host)] = (average, samples + 1, time.monotonic())
+
+    def make_query_plan(self, working_keyspace=None, query=None):
+        plan = list(self._child_policy.make_query_plan(working_keyspace, query))
+        now = time.monotonic()
+        with self.lock:
+            scores = {}
+            for host in plan:
+                average, samples, updated = self.latency.get(host_key(host), (0, 0, 0))
+                if samples >= self.min_samples and now - updated < self.retry_period:
+                    scores[host_key(host)] = average
+        if not scores:
+            return iter(plan)
+        limit = min(scores.values()) * self.exclusion_threshold
+        fast = [h for h in plan if scores.get(host_key(h), 0) <= limit]
+        slow = [h for h in plan if scores.get(host_key(h), 0) > limit]
+        return iter(fast + slow)
+
+class HedgeMetrics:
+    # per-RPC counts of reads, reads that went to more than one coordinator, and reads
+    # answered by a later attempt rather than the first host tried. A retry after an
+    # error also shows up as an extra attempt
+    def __init__(self):
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def watch(self, rpc, future):
+        # counts future's read once it is answered. The driver calls callbacks again for
+        # every page, and only the first page is a read the hedge could have raced
+        seen = []
+
+        def done(_):
+            if not seen:
+                seen.append(True)
+                self.observe(rpc, future)
+
+        future.add_callbacks(done, done)
+
+    def observe(self, rpc, future):
+        attempted = future.attempted_hosts
+        hedged = len(attempted) > 1
+        won = hedged and host_key(future.coordinator_host) != host_key(attempted[0])
+        with self.lock:
+            counts = self.counts.setdefault(rpc, [0, 0, 0])
+            counts[0] += 1
+            counts[1] += hedged
+            counts[2] += won
+
+    def stats(self):
+        with self.lock:
+            return {rpc: {"reads": c[0], "hedged": c[1], "hedge_won": c[2]} for rpc, c in self.counts.items()}
+
+def load_balancing(token_aware=True, latency_aware=False):
+    policy = DCAwareRoundRobinPolicy()
+    if token_aware:
+        # replicas for the statement's routing key come first, so single-partition
+        # reads and writes skip the coordinator hop
+        policy = TokenAwarePolicy(policy)
+    if latency_aware:
+        policy = LatencyAwarePolicy(policy)
+    return policy
+
+def connect(keyspace=None, token_aware=True, latency_aware=False, hedge_delay=None, hedge_attempts=1, hosts=HOSTS):
+    # prepared statements bound with the whole partition key carry their routing key,
+    # and UNLOGGED batches take it from their first statement
+    policy = load_balancing(token_aware, latency_aware)
+    profile = ExecutionProfile(load_balancing_policy=policy)
+    if hedge_delay is not None:
+        # after hedge_delay seconds without an answer, send the same query to the next
+        # host in the plan, up to hedge_attempts extra times. The driver only does this
+        # for statements marked is_idempotent. A hedge only changes the coordinator, which
+        # still waits on as many replicas as the consistency level needs: StationMax reads
+        # at THREE, every replica, so a slow replica slows it however it is hedged
+        profile.speculative_execution_policy = ConstantSpeculativeExecutionPolicy(hedge_delay, hedge_attempts)
+    cluster = Cluster(hosts, execution_profiles={EXEC_PROFILE_DEFAULT: profile})
+    session = cluster.connect(keyspace)
+    if isinstance(policy, LatencyAwarePolicy):
+        policy.attach(session)
+    return cluster, session
+
+def routing_report(cluster, session, statement, stations):
+    # how often the coordinator that answered was itself a replica of the partition
+    hits = 0
+    elapsed = 0.0
+    for station in stations:
+        bound = statement.bind((station,))
+        start = time.monotonic()
+        future = session.execute_async(bound)
+        future.result()
+        elapsed += time.monotonic() - start
+        replicas = {host_key(h) for h in cluster.metadata.get_replicas(statement.keyspace, bound.routing_key)}
+        if host_key(future.coordinator_host) in replicas:
+            hits += 1
+    return {"queries": len(stations), "replica_coordinator": hits,
+            "hit_rate": hits / max(len(stations), 1),
+            "mean_ms": 1000 * elapsed / max(len(stations), 1)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="count coordinator-is-replica hits per load balancing setup")
+    parser.add_argument("--stations", type=int, default=200, help="how many station partitions to read")
+    parser.add_argument("--rounds", type=int, default=5, help="times to read each station")
+    args = parser.parse_args()
+
+    report = {}
+    for name, token_aware, latency_aware in [("round-robin", False, False),
+                                             ("token-aware", True, False),
+                                             ("token-aware+latency", True, True)]:
+        cluster, session = connect('weather', token_aware, latency_aware)
+        stations = [row.id for row in session.execute("SELECT DISTINCT id FROM stations LIMIT %d" % args.stations)]
+        statement = session.prepare("""SELECT MAX(record.tmax) FROM stations WHERE id = ? """)
+        report[name] = routing_report(cluster, session, statement, stations * args.rounds)
+        cluster.shutdown()
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,362 @@
+import asyncio
+import itertools
+import random
+import re
+import threading
+import time
+import grpc
+import station_pb2
+import station_pb2_grpc
+from write_behind import WriteBehind
+
+TARGET = 'localhost:5440'
+CHANNELS = 4
+LINGER = 0.005
+MAX_BATCH = 500
+ATTEMPTS = 5
+BACKOFF = 0.05
+MAX_BACKOFF = 2.0
+TIMEOUT = 10.0
+
+# the server down or restarting, and the limiter shedding load; both are worth another try
+RETRY_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.RESOURCE_EXHAUSTED)
+# cassandra.Unavailable as the server's format_error words it
+UNAVAILABLE = re.compile(r'need \d+ replicas, but only have \d+')
+
+def retryable(error):
+    return bool(error) and UNAVAILABLE.search(error) is not None
+
+def backoff(attempt, base=BACKOFF, cap=MAX_BACKOFF):
+    # "full jitter": anywhere up to the exponential bound, so clients that failed
+    # together don't all come back together
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def record_request(station, date, tmin, tmax):
+    return station_pb2.RecordTempsRequest(station=station, date=str(date), tmin=tmin, tmax=tmax)
+
+def batch_errors(reply, n):
+    # {index: error} of a RecordTempsBatchReply for a batch of n records
+    return {e.index: e.error for e in reply.errors if 0 <= e.index < n}
+
+class ChannelPool:
+    # a few channels to one target, handed out round robin. Each channel gets its own
+    # subchannel pool, so they are separate HTTP/2 connections rather than one shared
+    # under the hood, and concurrent callers aren't all serialized on one socket
+    def __init__(self, target=TARGET, size=CHANNELS, aio=False):
+        make = grpc.aio.insecure_channel if aio else grpc.insecure_channel
+        self.channels = [make(target, options=[('grpc.use_local_subchannel_pool', 1)]) for _ in range(size)]
+        self.stubs = [station_pb2_grpc.StationStub(channel) for channel in self.channels]
+        self.turn = itertools.count()
+
+    def stub(self):
+        return self.stubs[next(self.turn) % len(self.stubs)]
+
+    def close(self):
+        # for an aio pool this returns a coroutine per channel to await
+        return [channel.close() for channel in self.channels]
+
+SHARED = {}
+SHARED_LOCK = threading.Lock()
+
+def shared_pool(target=TARGET, size=CHANNELS):
+    # one pool per target for the whole process, so every StationClient shares connections
+    with SHARED_LOCK:
+        pool = SHARED.get(target)
+        if pool is None:
+            pool = SHARED[target] = ChannelPool(target, size)
+        return pool
+
+class StationClient:
+    # blocking client for the Station service. record() calls from any number of threads
+    # are queued and sent every linger seconds (or every max_batch rows) as one
+    # RecordTempsStream batch; each call returns its own row's error, "" once written.
+    # Calls that fail with UNAVAILABLE/RESOURCE_EXHAUSTED, or whose reply says Cassandra
+    # was Unavailable, are retried with jittered exponential backoff up to attempts times;
+    # a batch retries only its failed rows. Other replies come back as the server sent them
+    def __init__(self, target=TARGET, pool=None, linger=LINGER, max_batch=MAX_BATCH, attempts=ATTEMPTS,
+                 timeout=TIMEOUT, max_queued=10000):
+        self.pool = pool or shared_pool(target)
+        self.attempts = attempts
+        self.timeout = timeout
+        self.retries = 0
+        self.batcher = WriteBehind(self._send_batch, max_rows=max_queued, max_flush=max_batch, linger=linger)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # sends whatever is still queued; the channels belong to the pool
+        self.batcher.close()
+
+    def _sleep(self, attempt):
+        self.retries += 1
+        time.sleep(backoff(attempt))
+
+    def _call(self, method, request):
+        for attempt in range(self.attempts):
+            last = attempt + 1 == self.attempts
+            try:
+                reply = getattr(self.pool.stub(), method)(request, timeout=self.timeout)
+            except grpc.RpcError as e:
+                if e.code() not in RETRY_CODES or last:
+                    raise
+            else:
+                if not retryable(getattr(reply, 'error', '')) or last:
+                    return reply
+            self._sleep(attempt)
+
+    def _send_batch(self, requests):
+        # one RPC for the lot, then again for just the rows that failed retryably
+        errors = {}
+        todo = list(range(len(requests)))
+        for attempt in range(self.attempts):
+            batch = station_pb2.RecordTempsBatch(records=[requests[i] for i in todo])
+            try:
+                failed = batch_errors(self.pool.stub().RecordTempsStream(iter([batch]), timeout=self.timeout), len(todo))
+                again = [i for i, error in sorted(failed.items()) if retryable(error)]
+            except grpc.RpcError as e:
+                if e.code() not in RETRY_CODES:
+                    raise
+                failed = dict.fromkeys(range(len(todo)), "%s: %s" % (e.code().name, e.details()))
+                again = list(range(len(todo)))
+            errors.update({todo[i]: error for i, error in failed.items()})
+            todo = [todo[i] for i in again]
+            if not todo or attempt + 1 == self.attempts:
+                break
+            self._sleep(attempt)
+            for i in todo:
+                del errors[i]
+        return errors
+
+    def submit(self, station, date, tmin, tmax, timeout=None):
+        # a Future of the row's error; raises write_behind.BufferFull if the queue stays
+        # full for timeout seconds
+        return self.batcher.submit(record_request(station, date, tmin, tmax), timeout)
+
+    def record(self, station, date, tmin, tmax):
+        return self.submit(station, date, tmin, tmax).result()
+
+    def station_max(self, station):
+        return self._call('StationMax', station_pb2.StationMaxRequest(station=station))
+
+    def station_max_many(self, stations):
+        reply = self._call('StationMaxMany', station_pb2.StationMaxManyRequest(stations=stations))
+        for attempt in range(self.attempts - 1):
+            # the stations whose lookup hit an unavailable replica set get asked again
+            again = [s for s, error in reply.errors.items() if retryable(error)]
+            if not again:
+                break
+            self._sleep(attempt)
+            retry = self._call('StationMaxMany', station_pb2.StationMaxManyRequest(stations=again))
+            for s in again:
+                del reply.errors[s]
+            reply.tmax.update(retry.tmax)
+            reply.errors.update(retry.errors)
+        return reply
+
+    def station_range(self, station, start="", end="", fetch_size=0):
+        # yields the pages; retried only until the first page arrives, since a stream
+        # that broke halfway can't be resumed without repeating rows
+        request = station_pb2.StationRangeRequest(station=station, start=str(start or ""), end=str(end or ""), fetch_size=fetch_size)
+        for attempt in range(self.attempts):
+            last = attempt + 1 == self.attempts
+            pages = self.pool.stub().StationRange(request, timeout=self.timeout)
+            try:
+                first = next(pages, None)
+            except grpc.RpcError as e:
+                if e.code() not in RETRY_CODES or last:
+                    raise
+                self._sleep(attempt)
+                continue
+            if first is not None and retryable(first.error) and not last:
+                pages.cancel()
+                self._sleep(attempt)
+                continue
+            if first is not None:
+                yield first
+                yield from pages
+            return
+
+    def station_stats(self, station):
+        return self._call('StationStats', station_pb2.StationStatsRequest(station=station))
+
+    def station_quantiles(self, station, element="tmax", quantiles=()):
+        return self._call('StationQuantiles', station_pb2.StationQuantilesRequest(station=station, element=element, quantiles=quantiles))
+
+    def top_stations(self, k=0):
+        return self._call('TopStations', station_pb2.TopStationsRequest(k=k))
+
+    def stats(self):
+        return dict(self.batcher.stats(), retries=self.retries)
+
+class AsyncBatcher:
+    # the asyncio side of WriteBehind: submit() returns a future of the row's error, and
+    # the rows submitted within linger seconds go out together through flush(items),
+    # which returns {index in items: error}. Batches are sent as tasks, so a slow one
+    # doesn't hold up the next
+    def __init__(self, flush, linger=LINGER, max_batch=MAX_BATCH):
+        self.flush = flush
+        self.linger = linger
+        self.max_batch = max_batch
+        self.items = []
+        self.timer = None
+        self.tasks = set()
+        self.flushes = 0
+        self.flushed = 0
+
+    def submit(self, item):
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self.items.append((item, waiter))
+        if len(self.items) >= self.max_batch:
+            self.send()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.linger, self.send)
+        return waiter
+
+    def send(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        taken, self.items = self.items, []
+        if taken:
+            task = asyncio.ensure_future(self.run(taken))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run(self, taken):
+        try:
+            errors = await self.flush([item for item, waiter in taken])
+        except Exception as e:
+            errors = dict.fromkeys(range(len(taken)), str(e))
+        for i, (item, waiter) in enumerate(taken):
+            if not waiter.done():
+                waiter.set_result(errors.get(i, ""))
+        self.flushes += 1
+        self.flushed += len(taken)
+
+    async def close(self):
+        self.send()
+        await asyncio.gather(*self.tasks)
+
+    def stats(self):
+        return {"depth": len(self.items), "in_flight": len(self.tasks), "flushes": self.flushes, "flushed_rows": self.flushed}
+
+class AsyncStationClient:
+    # StationClient for asyncio code, with the same batching and retries. aio channels
+    # belong to an event loop, so the client owns its pool; create it inside the loop
+    # (async with AsyncStationClient() as client: ...) and share it between tasks
+    def __init__(self, target=TARGET, channels=CHANNELS, linger=LINGER, max_batch=MAX_BATCH, attempts=ATTEMPTS, timeout=TIMEOUT):
+        self.pool = ChannelPool(target, channels, aio=True)
+        self.attempts = attempts
+        self.timeout = timeout
+        self.retries = 0
+        self.batcher = AsyncBatcher(self._send_batch, linger, max_batch)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        await self.batcher.close()
+        await asyncio.gather(*self.pool.close())
+
+    async def _sleep(self, attempt):
+        self.retries += 1
+        await asyncio.sleep(backoff(attempt))
+
+    async def _call(self, method, request):
+        for attempt in range(self.attempts):
+            last = attempt + 1 == self.attempts
+            try:
+                reply = await getattr(self.pool.stub(), method)(request, timeout=self.timeout)
+            except grpc.RpcError as e:
+                if e.code() not in RETRY_CODES or last:
+                    raise
+            else:
+                if not retryable(getattr(reply, 'error', '')) or last:
+                    return reply
+            await self._sleep(attempt)
+
+    async def _send_batch(self, requests):
+        errors = {}
+        todo = list(range(len(requests)))
+        for attempt in range(self.attempts):
+            batch = station_pb2.RecordTempsBatch(records=[requests[i] for i in todo])
+            try:
+                failed = batch_errors(await self.pool.stub().RecordTempsStream(iter([batch]), timeout=self.timeout), len(todo))
+                again = [i for i, error in sorted(failed.items()) if retryable(error)]
+            except grpc.RpcError as e:
+                if e.code() not in RETRY_CODES:
+                    raise
+                failed = dict.fromkeys(range(len(todo)), "%s: %s" % (e.code().name, e.details()))
+                again = list(range(len(todo)))
+            errors.update({todo[i]: error for i, error in failed.items()})
+            todo = [todo[i] for i in again]
+            if not todo or attempt + 1 == self.attempts:
+                break
+            await self._sleep(attempt)
+            for i in todo:
+                del errors[i]
+        return errors
+
+    async def record(self, station, date, tmin, tmax):
+        return await self.batcher.submit(record_request(station, date, tmin, tmax))
+
+    async def station_max(self, station):
+        return await self._call('StationMax', station_pb2.StationMaxRequest(station=station))
+
+    async def station_max_many(self, stations):
+        reply = await self._call('StationMaxMany', station_pb2.StationMaxManyRequest(stations=stations))
+        for attempt in range(self.attempts - 1):
+            again = [s for s, error in reply.errors.items() if retryable(error)]
+            if not again:
+                break
+            await self._sleep(attempt)
+            retry = await self._call('StationMaxMany', station_pb2.StationMaxManyRequest(stations=again))
+            for s in again:
+                del reply.errors[s]
+            reply.tmax.update(retry.tmax)
+            reply.errors.update(retry.errors)
+        return reply
+
+    async def station_range(self, station, start="", end="", fetch_size=0):
+        request = station_pb2.StationRangeRequest(station=station, start=str(start or ""), end=str(end or ""), fetch_size=fetch_size)
+        for attempt in range(self.attempts):
+            last = attempt + 1 == self.attempts
+            call = self.pool.stub().StationRange(request, timeout=self.timeout)
+            pages = call.__aiter__()
+            try:
+                first = await pages.__anext__()
+            except StopAsyncIteration:
+                return
+            except grpc.RpcError as e:
+                if e.code() not in RETRY_CODES or last:
+                    raise
+                await self._sleep(attempt)
+                continue
+            if retryable(first.error) and not last:
+                call.cancel()
+                await self._sleep(attempt)
+                continue
+            yield first
+            async for page in pages:
+                yield page
+            return
+
+    async def station_stats(self, station):
+        return await self._call('StationStats', station_pb2.StationStatsRequest(station=station))
+
+    async def station_quantiles(self, station, element="tmax", quantiles=()):
+        return await self._call('StationQuantiles', station_pb2.StationQuantilesRequest(station=station, element=element, quantiles=quantiles))
+
+    async def top_stations(self, k=0):
+        return await self._call('TopStations', station_pb2.TopStationsRequest(k=k))
+
+    def stats(self):
+        return dict(self.batcher.stats(), retries=self.retries)
@@ -0,0 +1,197 @@
+from cassandra import ConsistencyLevel
+from cassandra.cqltypes import SimpleDateType
+import argparse
+import json
+import random
+import re
+import shutil
+import subprocess
+import time
+import numpy as np
+from backends import CassandraBackend, Writer, BATCH_ROWS, MAX_IN_FLIGHT
+from memory_backend import MemoryBackend
+# records and load_records need pyarrow, which the server doesn't have; they are only
+# imported by the bench command, so `from layouts import record` stays cheap
+
+READS = 500
+
+class record:
+    def __init__(self,tmin,tmax):
+        self.tmin = tmin
+        self.tmax = tmax
+
+class Layout:
+    # the statements the service runs against one way of storing a station-day; the
+    # subclasses only differ in the schema and in how tmin and tmax are addressed
+    CREATE = None
+    TMIN = TMAX = None
+
+    def __init__(self, cluster, cass, table):
+        self.table = table
+        cass.execute(self.CREATE.format(table=table))
+        self.insert_statement = cass.prepare(self.INSERT.format(table=table))
+        self.name_statement = cass.prepare("""INSERT INTO {table} (id, name) VALUES(?,?) """.format(table=table))
+        self.max_statement = cass.prepare("""SELECT MAX({tmax}) FROM {table} WHERE id = ? """.format(tmax=self.TMAX, table=table))
+        self.range_statement = cass.prepare("""SELECT date, {tmin}, {tmax} FROM {table} WHERE id = ? AND date >= ? AND date <= ? """
+                                            .format(tmin=self.TMIN, tmax=self.TMAX, table=table))
+        self.scan_statement = cass.prepare("""SELECT date, {tmin}, {tmax} FROM {table} WHERE id = ? """
+                                           .format(tmin=self.TMIN, tmax=self.TMAX, table=table))
+        self.stations_statement = cass.prepare("""SELECT DISTINCT id, name FROM {table}""".format(table=table))
+        for statement in (self.insert_statement, self.name_statement, self.max_statement, self.range_statement,
+                          self.scan_statement, self.stations_statement):
+            statement.consistency_level = ConsistencyLevel.ONE
+        for statement in (self.max_statement, self.range_statement, self.scan_statement, self.stations_statement):
+            statement.is_idempotent = True
+
+class RecordLayout(Layout):
+    # the notebook's schema: a frozen station_record UDT the driver serializes on every
+    # write, read back a field at a time (record.tmax)
+    CREATE = """CREATE TABLE IF NOT EXISTS {table} (id text, name text static, date date, record station_record, PRIMARY KEY (id, date)) WITH CLUSTERING ORDER BY (date ASC)"""
+    INSERT = """INSERT INTO {table} (id, date, record) VALUES(?,?,?) """
+    TMIN, TMAX = 'record.tmin', 'record.tmax'
+
+    def __init__(self, cluster, cass, table='stations'):
+        cluster.register_user_type('weather', 'station_record', record)
+        super().__init__(cluster, cass, table)
+
+    def values(self, station, day, tmin, tmax):
+        return (station, day, record(tmin, tmax))
+
+class ColumnsLayout(Layout):
+    # tmin and tmax as plain int columns, like Weather/server.py
+    CREATE = """CREATE TABLE IF NOT EXISTS {table} (id text, name text static, date date, tmin int, tmax int, PRIMARY KEY (id, date)) WITH CLUSTERING ORDER BY (date ASC)"""
+    INSERT = """INSERT INTO {table} (id, date, tmin, tmax) VALUES(?,?,?,?) """
+    TMIN, TMAX = 'tmin', 'tmax'
+
+    def __init__(self, cluster, cass, table='stations_columns'):
+        super().__init__(cluster, cass, table)
+
+    def values(self, station, day, tmin, tmax):
+        return (station, day, tmin, tmax)
+
+LAYOUTS = {"record": RecordLayout, "columns": ColumnsLayout}
+
+def convert(backend, source, target, in_flight=MAX_IN_FLIGHT):
+    # copies every station (name and readings) from one layout's table into the other's;
+    # inserts are idempotent, so it is safe to run again, and best run with ingest paused
+    cluster, cass = backend.connect('weather')
+    source, target = LAYOUTS[source](cluster, cass), LAYOUTS[target](cluster, cass)
+    writer = Writer(cass, in_flight)
+    stations = list(cass.execute(source.stations_statement))
+    for station, name in stations:
+        if name is not None:
+            batch = backend.batch()
+            batch.add(target.name_statement, (station, name))
+            writer.send(batch, rows=0)
+        batch, rows = backend.batch(), 0
+        for date, tmin, tmax in cass.execute(source.scan_statement, (station,)):
+            if date is None:
+                # a station with only its static name set has no readings to copy
+                continue
+            batch.add(target.insert_statement, target.values(station, date.days_from_epoch + SimpleDateType.EPOCH_OFFSET_DAYS, tmin, tmax))
+            rows += 1
+            if rows == BATCH_ROWS:
+                writer.send(batch, rows=rows)
+                batch, rows = backend.batch(), 0
+        if rows:
+            writer.send(batch, rows=rows)
+    writer.drain()
+    return len(stations), writer.written, writer.errors
+
+def summary(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+    pick = lambda q: 1000 * ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {"requests": len(ordered), "p50_ms": pick(.50), "p95_ms": pick(.95), "p99_ms": pick(.99)}
+
+def disk_bytes(table, nodetool):
+    # flushes the memtable, then asks this node for the table's live SSTable bytes. Only
+    # the local replica is counted, which is enough to compare two tables written alike
+    if not nodetool or not shutil.which(nodetool):
+        return None
+    subprocess.run([nodetool, 'flush', 'weather', table], check=True, capture_output=True)
+    out = subprocess.run([nodetool, 'tablestats', 'weather.' + table], check=True, capture_output=True, text=True).stdout
+    m = re.search(r'Space used \(live\): (\d+)', out)
+    return int(m.group(1)) if m else None
+
+def bench_layout(backend, cluster, cass, name, table, reads, in_flight, nodetool):
+    # writes records.parquet into a fresh bench_<name> table, then times MAX, one-year
+    # range and whole-station reads one at a time. cpu_s is this process's CPU, i.e. the
+    # driver's cost of serializing and parsing the layout
+    from load_records import station_runs
+    cass.execute("DROP TABLE IF EXISTS bench_" + name)
+    layout = LAYOUTS[name](cluster, cass, 'bench_' + name)
+    days = (table['days'].to_numpy().astype(np.int64) + SimpleDateType.EPOCH_OFFSET_DAYS).tolist()
+    tmin, tmax = table['tmin'].to_pylist(), table['tmax'].to_pylist()
+    runs = station_runs(table)
+
+    writer = Writer(cass, in_flight)
+    start, cpu = time.perf_counter(), time.process_time()
+    for station, lo, hi in runs:
+        for first in range(lo, hi, BATCH_ROWS):
+            last = min(first + BATCH_ROWS, hi)
+            batch = backend.batch()
+            for i in range(first, last):
+                batch.add(layout.insert_statement, layout.values(station, days[i], tmin[i], tmax[i]))
+            writer.send(batch, rows=last - first)
+    writer.drain()
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+    report = {"write": {"rows": writer.written, "errors": len(writer.errors), "elapsed_s": elapsed,
+                        "rows_per_s": writer.written / elapsed, "cpu_us_per_row": 1e6 * cpu / max(writer.written, 1)}}
+
+    # the same stations and ranges for every layout
+    rng = random.Random(0)
+    picks = [rng.choice(runs) for _ in range(reads)]
+    queries = {
+        "max": lambda station, lo, hi: cass.execute(layout.max_statement, (station,)),
+        "range": lambda station, lo, hi: cass.execute(layout.range_statement, (station, days[lo], min(days[lo] + 365, days[hi - 1]))).all(),
+        "scan": lambda station, lo, hi: cass.execute(layout.scan_statement, (station,)).all(),
+    }
+    for op, query in queries.items():
+        samples = []
+        cpu = time.process_time()
+        for station, lo, hi in picks:
+            began = time.perf_counter()
+            query(station, lo, hi)
+            samples.append(time.perf_counter() - began)
+        report[op] = dict(summary(samples), cpu_s=time.process_time() - cpu)
+    report["disk_bytes"] = disk_bytes(layout.table, nodetool)
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="convert weather.stations between the UDT record layout and plain "
+                                                 "tmin/tmax columns, or benchmark the two")
+    parser.add_argument("command", choices=["convert", "bench"])
+    parser.add_argument("--backend", choices=["cassandra", "memory"], default="cassandra")
+    parser.add_argument("--from", dest="source", choices=list(LAYOUTS), default="record", help="convert: layout to read")
+    parser.add_argument("--to", dest="target", choices=list(LAYOUTS), default="columns", help="convert: layout to write")
+    parser.add_argument("--in-flight", type=int, default=MAX_IN_FLIGHT, help="batches outstanding at once")
+    parser.add_argument("--records", help="bench: directory of records.parquet parts (default records.parquet)")
+    parser.add_argument("--layouts", default=",".join(LAYOUTS), help="bench: layouts to compare")
+    parser.add_argument("--reads", type=int, default=READS, help="bench: queries timed per read op")
+    parser.add_argument("--nodetool", default="nodetool", help="bench: nodetool to measure table size with ('' to skip)")
+    parser.add_argument("--out", help="bench: also write the report to this file")
+    args = parser.parse_args()
+
+    backend = MemoryBackend() if args.backend == "memory" else CassandraBackend()
+    if args.command == "convert":
+        if args.source == args.target:
+            raise SystemExit("--from and --to are the same layout")
+        start = time.perf_counter()
+        stations, copied, errors = convert(backend, args.source, args.target, args.in_flight)
+        print("copied %d readings of %d stations from %s to %s in %.3fs, %d failed batches"
+              % (copied, stations, args.source, args.target, time.perf_counter() - start, len(errors)), flush = True)
+        for e in errors[:5]:
+            print(e)
+    else:
+        from records import temperature_table, RECORDS
+        table = temperature_table(args.records or RECORDS)
+        cluster, cass = backend.connect('weather')
+        report = {name: bench_layout(backend, cluster, cass, name, table, args.reads, args.in_flight, args.nodetool)
+                  for name in args.layouts.split(',')}
+        text = json.dumps(report, indent=2)
+        print(text)
+        if args.out:
+            with open(args.out, "w") as f:
+                f.write(text + "\n")
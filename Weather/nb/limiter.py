@@ -0,0 +1,139 @@
+import inspect
+import math
+import threading
+import cassandra
+import cassandra.cluster
+import grpc
+from metrics import wrap_handler
+
+# errors that mean the cluster is struggling rather than the request being bad
+OVERLOAD = (cassandra.Unavailable, cassandra.Timeout, cassandra.OperationTimedOut, cassandra.cluster.NoHostAvailable)
+
+class GradientLimiter:
+    # adaptive cap on RPCs in flight, after the gradient limit in Netflix's
+    # concurrency-limits. short is a fast average of Cassandra query latency and long a
+    # slow one, standing in for the latency of an unloaded cluster; while short stays
+    # within tolerance of long the limit grows by about sqrt(limit), and as queries slow
+    # down it shrinks in proportion. overload errors cut it by backoff straight away,
+    # since Unavailable comes back fast and would otherwise look like a healthy cluster
+    SHORT_ALPHA = 0.1
+    LONG_ALPHA = 0.002
+
+    def __init__(self, initial=16, min_limit=4, max_limit=256, tolerance=1.5, smoothing=0.05, backoff=0.9):
+        self.lock = threading.Lock()
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.backoff = backoff
+        self.in_flight = 0
+        self.short = None
+        self.long = None
+        self.admitted = 0
+        self.rejected = 0
+
+    def try_acquire(self):
+        with self.lock:
+            if self.in_flight >= int(self.limit):
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def sample(self, seconds, error=None):
+        with self.lock:
+            if isinstance(error, OVERLOAD):
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                return
+            if self.short is None:
+                self.short = self.long = seconds
+            self.short += self.SHORT_ALPHA * (seconds - self.short)
+            self.long += self.LONG_ALPHA * (self.short - self.long)
+            if self.long > 2 * self.short:
+                # latency dropped for good (a slow node came back); let long follow it down
+                self.long *= 0.95
+            if self.in_flight < self.limit / 2:
+                # nowhere near the limit, so these samples say nothing about raising it
+                return
+            gradient = max(0.5, min(1.0, self.tolerance * self.long / self.short))
+            target = self.limit * gradient + math.sqrt(self.limit)
+            self.limit = self.limit * (1 - self.smoothing) + target * self.smoothing
+            self.limit = max(self.min_limit, min(self.max_limit, self.limit))
+
+    def stats(self):
+        return {"station_limit": int(self.limit), "station_limit_in_flight": self.in_flight,
+                "station_limit_admitted": self.admitted, "station_limit_rejected": self.rejected,
+                "station_limit_latency_short": round(self.short or 0.0, 6),
+                "station_limit_latency_long": round(self.long or 0.0, 6)}
+
+REJECTED = "server is over its concurrency limit, retry later"
+
+class LimitInterceptor(grpc.ServerInterceptor):
+    # admits an RPC only while the limiter has room and fails the rest at once with
+    # RESOURCE_EXHAUSTED, so they never wait behind the worker pool
+    def __init__(self, limiter):
+        self.limiter = limiter
+
+    def intercept_service(self, continuation, handler_call_details):
+        def wrap_unary(behavior):
+            def limited(request, context):
+                if not self.limiter.try_acquire():
+                    context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, REJECTED)
+                try:
+                    return behavior(request, context)
+                finally:
+                    self.limiter.release()
+            return limited
+
+        def wrap_stream(behavior):
+            def limited(request, context):
+                if not self.limiter.try_acquire():
+                    context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, REJECTED)
+                try:
+                    yield from behavior(request, context)
+                finally:
+                    self.limiter.release()
+            return limited
+
+        return wrap_handler(continuation(handler_call_details), wrap_unary, wrap_stream)
+
+class AsyncLimitInterceptor(grpc.aio.ServerInterceptor):
+    # the same for grpc.aio.server; behaviors may be coroutines or plain functions
+    def __init__(self, limiter):
+        self.limiter = limiter
+
+    async def intercept_service(self, continuation, handler_call_details):
+        def wrap_unary(behavior):
+            async def limited(request, context):
+                if not self.limiter.try_acquire():
+                    await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, REJECTED)
+                try:
+                    reply = behavior(request, context)
+                    return await reply if inspect.isawaitable(reply) else reply
+                finally:
+                    self.limiter.release()
+            return limited
+
+        def wrap_stream(behavior):
+            async def limited(request, context):
+                if not self.limiter.try_acquire():
+                    await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, REJECTED)
+                try:
+                    replies = behavior(request, context)
+                    if inspect.isasyncgen(replies):
+                        async for reply in replies:
+                            yield reply
+                    else:
+                        for reply in replies:
+                            yield reply
+                finally:
+                    self.limiter.release()
+            return limited
+
+        return wrap_handler(await continuation(handler_call_details), wrap_unary, wrap_stream)
@@ -0,0 +1,70 @@
+from cassandra import ConsistencyLevel
+from cassandra.cqltypes import SimpleDateType
+import argparse
+import numpy as np
+import time
+from aggregates import StationAggregates
+from backends import CassandraBackend, Writer, BATCH_ROWS, MAX_IN_FLIGHT
+from memory_backend import MemoryBackend
+from records import temperature_table, RECORDS
+
+def station_runs(table):
+    # table is sorted by station, so each station is one contiguous run of rows
+    codes = table['station'].dictionary_encode().combine_chunks()
+    indices = codes.indices.to_numpy(zero_copy_only=False)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(indices)) + 1))
+    ends = np.append(starts[1:], len(indices))
+    names = codes.dictionary.to_pylist()
+    return [(names[indices[s]], int(s), int(e)) for s, e in zip(starts, ends)]
+
+def load(backend, table, in_flight=MAX_IN_FLIGHT, aggregates=False):
+    cluster, cass = backend.connect('weather')
+    insert = cass.prepare("""INSERT INTO stations (id, date, record) VALUES(?,?,{tmin: ?, tmax: ?}) """)
+    insert.consistency_level = ConsistencyLevel.ONE
+    days = (table['days'].to_numpy().astype(np.int64) + SimpleDateType.EPOCH_OFFSET_DAYS).tolist()
+    tmin = table['tmin'].to_pylist()
+    tmax = table['tmax'].to_pylist()
+
+    # same shape as the servicer's batch writes: single-partition UNLOGGED batches, a
+    # bounded number in flight
+    writer = Writer(cass, in_flight)
+    runs = station_runs(table)
+    for station, start, end in runs:
+        for lo in range(start, end, BATCH_ROWS):
+            hi = min(lo + BATCH_ROWS, end)
+            batch = backend.batch()
+            for i in range(lo, hi):
+                batch.add(insert, (station, days[i], tmin[i], tmax[i]))
+            writer.send(batch, rows=hi - lo)
+    writer.drain()
+
+    if aggregates:
+        store = StationAggregates(cass)
+        # converted once; each station's run is then a view of these
+        all_lows, all_highs = table['tmin'].to_numpy(), table['tmax'].to_numpy()
+        for station, start, end in runs:
+            lows, highs = all_lows[start:end], all_highs[start:end]
+            spreads = highs - lows
+            # the readings too, so loading the same records again doesn't count them twice
+            store.update(station, (int(lows.min()), int(highs.max()), end - start, int(highs.sum()), int(lows.sum()),
+                                   int(spreads.min()), int(spreads.max())),
+                         list(zip(days[start:end], tmin[start:end], tmax[start:end])))
+    return writer.written, writer.errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="load records.parquet into weather.stations without Spark")
+    parser.add_argument("--records", default=RECORDS, help="directory of records.parquet parts")
+    parser.add_argument("--backend", choices=["cassandra", "memory"], default="cassandra")
+    parser.add_argument("--in-flight", type=int, default=MAX_IN_FLIGHT, help="batches outstanding at once")
+    parser.add_argument("--aggregates", action="store_true", help="also merge the rows into station_aggregates")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    table = temperature_table(args.records)
+    read = time.perf_counter() - start
+    backend = MemoryBackend() if args.backend == "memory" else CassandraBackend()
+    written, errors = load(backend, table, args.in_flight, args.aggregates)
+    print("read %d station-days in %.3fs, wrote %d in %.3fs total, %d failed batches"
+          % (table.num_rows, read, written, time.perf_counter() - start, len(errors)), flush = True)
+    for e in errors[:5]:
+        print(e)
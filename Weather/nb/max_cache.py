@@ -0,0 +1,55 @@
+from collections import OrderedDict
+import threading
+import time
+
+MISS = object()
+
+class MaxCache:
+    # LRU of station -> max tmax with a TTL. Writes that go through this process raise
+    # entries in place, so the TTL only bounds staleness from writers elsewhere. As in
+    # SeriesCache, a read that began before such a write carries the old version and
+    # put() turns it away, so it can't cache the max from before the write
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, station):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(station)
+            if entry is None or entry[1] < now:
+                self.misses += 1
+                return MISS
+            self.entries.move_to_end(station)
+            self.hits += 1
+            return entry[0]
+
+    def version(self, station):
+        with self.lock:
+            return self.versions.get(station, 0)
+
+    def put(self, station, tmax, version):
+        with self.lock:
+            if self.versions.get(station, 0) != version:
+                return
+            self.entries[station] = (tmax, time.monotonic() + self.ttl)
+            self.entries.move_to_end(station)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def raise_to(self, station, tmax):
+        with self.lock:
+            self.versions[station] = self.versions.get(station, 0) + 1
+            entry = self.entries.get(station)
+            if entry is not None and (entry[0] is None or tmax > entry[0]):
+                self.entries[station] = (tmax, entry[1])
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,592 @@
+from cassandra import InvalidRequest
+from cassandra.query import named_tuple_factory
+from cassandra.util import Date
+from backends import StorageBackend
+import bisect
+import datetime
+import heapq
+import itertools
+import re
+import threading
+import time
+
+# the schema p6.ipynb creates, so the fake starts where the notebook leaves the cluster
+NOTEBOOK_SCHEMA = [
+    """CREATE TYPE station_record ( tmin int, tmax int)""",
+    """CREATE TABLE stations(id text, name text static, date date, record station_record, PRIMARY KEY (id, date)) WITH CLUSTERING ORDER BY (date ASC)""",
+]
+
+EPOCH = datetime.date(1970, 1, 1)
+# the driver sends dates as unsigned day numbers centred on the epoch
+DATE_OFFSET = 2**31
+DEFAULT_FETCH_SIZE = 5000
+HOST = 'memory'
+
+def split_top(text, sep=','):
+    # split on sep outside of (), {} and quotes
+    parts, depth, quote, start = [], 0, None, 0
+    for i, c in enumerate(text):
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in "'\"":
+            quote = c
+        elif c in '({':
+            depth += 1
+        elif c in ')}':
+            depth -= 1
+        elif c == sep and depth == 0:
+            parts.append(text[start:i].strip())
+            start = i + 1
+    parts.append(text[start:].strip())
+    return [p for p in parts if p]
+
+def literal(text):
+    if text.startswith("'"):
+        return text[1:-1]
+    if text.lower() == 'null':
+        return None
+    if text.lower() in ('true', 'false'):
+        return text.lower() == 'true'
+    return int(text)
+
+class Clock(threading.Thread):
+    # one thread completes every delayed call, so injected latency doesn't cost a
+    # thread per in-flight request
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.heap = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.start()
+
+    def later(self, delay, fn):
+        with self.cond:
+            heapq.heappush(self.heap, (time.monotonic() + delay, next(self.seq), fn))
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.heap or self.heap[0][0] > time.monotonic():
+                    self.cond.wait(self.heap[0][0] - time.monotonic() if self.heap else None)
+                _, _, fn = heapq.heappop(self.heap)
+            fn()
+
+class MemoryFuture:
+    # the parts of ResponseFuture the servicer uses: callbacks (called again for every
+    # page), result(), paging, and the host bookkeeping the hedge metrics read
+    def __init__(self, session, pages=None, error=None):
+        self.session = session
+        self.pages = pages or [[]]
+        self.page = 0
+        self.error = error
+        self.callbacks = []
+        self.errbacks = []
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        self.attempted_hosts = [HOST]
+        self.coordinator_host = HOST
+
+    @property
+    def has_more_pages(self):
+        return self.page + 1 < len(self.pages)
+
+    def _complete(self):
+        with self.lock:
+            self.done.set()
+            callbacks = list(self.errbacks if self.error else self.callbacks)
+        arg = self.error if self.error else self.pages[self.page]
+        for fn, args, kwargs in callbacks:
+            fn(arg, *args, **kwargs)
+
+    def start_fetching_next_page(self):
+        if not self.has_more_pages:
+            raise Exception("no more pages")
+        with self.lock:
+            self.done.clear()
+            self.page += 1
+        self.session.finish(self)
+
+    def add_callback(self, fn, *args, **kwargs):
+        with self.lock:
+            self.callbacks.append((fn, args, kwargs))
+            ready = self.done.is_set() and not self.error
+        if ready:
+            fn(self.pages[self.page], *args, **kwargs)
+        return self
+
+    def add_errback(self, fn, *args, **kwargs):
+        with self.lock:
+            self.errbacks.append((fn, args, kwargs))
+            ready = self.done.is_set() and self.error
+        if ready:
+            fn(self.error, *args, **kwargs)
+        return self
+
+    def add_callbacks(self, callback, errback, callback_args=(), callback_kwargs=None,
+                      errback_args=(), errback_kwargs=None):
+        self.add_callback(callback, *callback_args, **(callback_kwargs or {}))
+        self.add_errback(errback, *errback_args, **(errback_kwargs or {}))
+
+    def result(self):
+        self.done.wait()
+        if self.error:
+            raise self.error
+        return MemoryResultSet(self)
+
+class MemoryResultSet:
+    def __init__(self, future):
+        self.future = future
+        self.current_rows = future.pages[future.page]
+
+    @property
+    def has_more_pages(self):
+        return self.future.has_more_pages
+
+    def fetch_next_page(self):
+        self.future.start_fetching_next_page()
+        self.current_rows = self.future.result().current_rows
+
+    def one(self):
+        return self.current_rows[0] if self.current_rows else None
+
+    def all(self):
+        return list(self)
+
+    def __iter__(self):
+        while True:
+            yield from self.current_rows
+            if not self.has_more_pages:
+                break
+            self.fetch_next_page()
+
+class MemoryPrepared:
+    def __init__(self, query, op):
+        self.query_string = query
+        self.op = op
+        self.keyspace = None
+        self.consistency_level = None
+        self.is_idempotent = False
+        self.fetch_size = DEFAULT_FETCH_SIZE
+
+    def bind(self, params):
+        # like the driver, binding converts every value to its column's type, so a bad
+        # value fails here rather than when the statement runs
+        check = getattr(self.op, 'check', None)
+        if check:
+            check(Params(params))
+        return MemoryBound(self, params)
+
+class MemoryBound:
+    def __init__(self, prepared, params):
+        self.prepared = prepared
+        self.params = tuple(params)
+        self.fetch_size = prepared.fetch_size
+        self.consistency_level = prepared.consistency_level
+        self.is_idempotent = prepared.is_idempotent
+
+class MemoryBatch:
+    def __init__(self, consistency_level=None):
+        self.statements = []
+        self.consistency_level = consistency_level
+
+    def add(self, statement, params=()):
+        # the driver's BatchStatement binds prepared statements as they are added
+        if isinstance(statement, MemoryPrepared):
+            statement, params = statement.bind(params), ()
+        self.statements.append((statement, params))
+
+class Params:
+    def __init__(self, values):
+        self.values = iter(values)
+
+    def next(self):
+        return next(self.values)
+
+class Table:
+    def __init__(self, name, columns, partition, clustering, static):
+        self.name = name
+        self.columns = columns
+        self.partition = partition
+        self.clustering = clustering
+        self.static = static
+        self.partitions = {}
+
+    def get(self, pk, create=False):
+        part = self.partitions.get(pk)
+        if part is None and create:
+            part = self.partitions[pk] = {'static': {}, 'rows': {}, 'keys': []}
+        return part
+
+    def row(self, part, ck, create=False):
+        row = part['rows'].get(ck)
+        if row is None and create:
+            row = part['rows'][ck] = {}
+            bisect.insort(part['keys'], ck)
+        return row
+
+class MemorySession:
+    # a single-keyspace, single-node stand-in for a cassandra Session. It understands
+    # the small CQL dialect this service speaks: CREATE TYPE/TABLE, INSERT (with UDT
+    # literals and IF NOT EXISTS), UPDATE (with counters and IF conditions) and SELECT
+    # over one partition or the whole table, with MIN/MAX/SUM/COUNT and UDT fields
+    def __init__(self, backend):
+        self.backend = backend
+        self.types = {}
+        self.tables = {}
+        self.user_types = {}
+        self.compiled = {}
+        self.lock = threading.RLock()
+
+    # ---- session API ----
+
+    def prepare(self, query):
+        return MemoryPrepared(query, self._compile(query))
+
+    def execute(self, statement, parameters=None, **kwargs):
+        return self.execute_async(statement, parameters).result()
+
+    def execute_async(self, statement, parameters=None, **kwargs):
+        fetch_size = DEFAULT_FETCH_SIZE
+        try:
+            with self.lock:
+                if isinstance(statement, MemoryBatch):
+                    for s, p in statement.statements:
+                        self._run(s, p)
+                    rows = []
+                else:
+                    rows = self._run(statement, parameters)
+                    fetch_size = getattr(statement, 'fetch_size', None) or DEFAULT_FETCH_SIZE
+            pages = [rows[i:i + fetch_size] for i in range(0, len(rows), fetch_size)] or [[]]
+            future = MemoryFuture(self, pages)
+        except Exception as e:
+            future = MemoryFuture(self, error=e)
+        self.finish(future)
+        return future
+
+    def finish(self, future):
+        if self.backend.latency:
+            self.backend.clock.later(self.backend.latency, future._complete)
+        else:
+            future._complete()
+
+    def add_request_init_listener(self, fn):
+        pass
+
+    # ---- statements ----
+
+    def _run(self, statement, params):
+        if isinstance(statement, MemoryBound):
+            statement, params = statement.prepared, statement.params
+        op = statement.op if isinstance(statement, MemoryPrepared) else self._compile(statement)
+        return op(Params(params or ()))
+
+    def _compile(self, query):
+        op = self.compiled.get(query)
+        if op is None:
+            text = ' '.join(query.split()).rstrip(';').replace('weather.', '')
+            verb = text.split(' ', 1)[0].upper()
+            compile_verb = {'CREATE': self._create, 'INSERT': self._insert, 'UPDATE': self._update,
+                            'SELECT': self._select, 'USE': lambda t: lambda p: [],
+                            'DROP': self._drop, 'ALTER': self._alter}.get(verb)
+            if compile_verb is None:
+                raise ValueError("memory backend can't run: " + query)
+            op = self.compiled[query] = compile_verb(text)
+        return op
+
+    def _create(self, text):
+        # table options (clustering order, compaction, ...) don't matter here
+        text = re.sub(r'\)\s*WITH\s.*$', ')', text, flags=re.I)
+        m = re.match(r'CREATE (TYPE|TABLE|KEYSPACE) (?:IF NOT EXISTS )?(\w+)\s*(?:\((.*)\))?', text, re.I)
+        kind, name, body = m.group(1).upper(), m.group(2), m.group(3)
+        if kind == 'KEYSPACE':
+            return lambda p: []
+        if kind == 'TYPE':
+            fields = [f.split()[0] for f in split_top(body)]
+
+            def create_type(p):
+                self.types.setdefault(name, fields)
+                return []
+            return create_type
+
+        columns, partition, clustering, static = {}, [], [], set()
+        for part in split_top(body):
+            words = part.split()
+            if part.upper().startswith('PRIMARY KEY'):
+                keys = split_top(part[part.index('(') + 1:part.rindex(')')])
+                first = keys[0].strip('() ')
+                partition = [k.strip() for k in first.split(',')] if keys[0].startswith('(') else [first]
+                clustering = keys[1:]
+                continue
+            col, ctype = words[0], ' '.join(words[1:])
+            ctype = re.sub(r'frozen<(\w+)>', r'\1', ctype.replace(' ', ''), flags=re.I)
+            if ctype.lower().endswith('static'):
+                ctype = ctype[:-len('static')]
+                static.add(col)
+            if ctype.upper().endswith('PRIMARYKEY'):
+                ctype = ctype[:-len('PRIMARYKEY')]
+                partition = [col]
+            columns[col] = ctype.lower()
+
+        def create_table(p):
+            self.tables.setdefault(name, Table(name, columns, partition, clustering, static))
+            return []
+        return create_table
+
+    def _alter(self, text):
+        # only ALTER TABLE ... ADD column type, which Cassandra refuses for an existing column
+        m = re.match(r'ALTER TABLE (\w+) ADD (\w+) (\w+)$', text, re.I)
+        name, col, ctype = m.groups()
+
+        def alter(p):
+            table = self.tables[name]
+            if col in table.columns:
+                raise InvalidRequest("Invalid column name %s because it conflicts with an existing column" % col)
+            table.columns[col] = ctype.lower()
+            return []
+        return alter
+
+    def _drop(self, text):
+        name = text.split()[-1]
+
+        def drop(p):
+            self.tables.pop(name, None)
+            return []
+        return drop
+
+    def _value(self, expr):
+        # returns fn(params) -> value for ?, literals and {field: expr} UDT literals
+        expr = expr.strip()
+        if expr == '?':
+            return lambda p: p.next()
+        if expr.startswith('{'):
+            fields = [(f.split(':', 1)[0].strip(), self._value(f.split(':', 1)[1])) for f in split_top(expr[1:-1])]
+            return lambda p: {f: fn(p) for f, fn in fields}
+        value = literal(expr)
+        return lambda p: value
+
+    def _store(self, table, col, value):
+        ctype = table.columns[col]
+        if value is None:
+            return None
+        if ctype == 'date':
+            if isinstance(value, int):
+                return value - DATE_OFFSET
+            if isinstance(value, str):
+                return (datetime.date.fromisoformat(value) - EPOCH).days
+            if isinstance(value, Date):
+                return value.days_from_epoch
+            return (value - EPOCH).days
+        if ctype in self.types:
+            if isinstance(value, dict):
+                return dict(value)
+            if isinstance(value, tuple):
+                return dict(zip(self.types[ctype], value))
+            return {f: getattr(value, f, None) for f in self.types[ctype]}
+        return value
+
+    def _load(self, table, col, value):
+        ctype = table.columns.get(col)
+        if value is None:
+            return None
+        if ctype == 'date':
+            return Date(value)
+        if ctype in self.types:
+            klass = self.user_types.get(ctype)
+            return klass(**value) if klass else dict(value)
+        return value
+
+    def _result(self, names, rows):
+        return named_tuple_factory(names, rows)
+
+    def _insert(self, text):
+        m = re.match(r'INSERT INTO (\w+)\s*\(([^)]*)\)\s*VALUES\s*\((.*)\)\s*(IF NOT EXISTS)?$', text, re.I)
+        name, cols, exprs, if_not_exists = m.group(1), [c.strip() for c in m.group(2).split(',')], m.group(3), m.group(4)
+        values = [self._value(e) for e in split_top(exprs)]
+
+        def insert(p):
+            table = self.tables[name]
+            given = dict(zip(cols, (fn(p) for fn in values)))
+            row = {c: self._store(table, c, v) for c, v in given.items()}
+            pk = tuple(row[c] for c in table.partition)
+            part = table.get(pk, create=True)
+            ck = tuple(row.get(c) for c in table.clustering)
+            if if_not_exists:
+                existing = table.row(part, ck)
+                if existing is not None:
+                    names = ['[applied]'] + table.partition + table.clustering + sorted(c for c in table.columns if c not in table.partition + table.clustering)
+                    merged = dict(zip(table.partition, pk), **dict(zip(table.clustering, ck)), **existing)
+                    return self._result(names, [tuple([False] + [self._load(table, c, merged.get(c)) for c in names[1:]])])
+            for c in table.static:
+                if c in row:
+                    part['static'][c] = row[c]
+            if not table.clustering or all(v is not None for v in ck):
+                target = table.row(part, ck, create=True)
+                target.update({c: v for c, v in row.items() if c not in table.static and c not in table.partition and c not in table.clustering})
+            return self._result(['[applied]'], [(True,)]) if if_not_exists else []
+
+        def check(p):
+            table = self.tables[name]
+            for c, fn in zip(cols, values):
+                self._store(table, c, fn(p))
+        insert.check = check
+        return insert
+
+    def _update(self, text):
+        m = re.match(r'UPDATE (\w+) SET (.*?) WHERE (.*?)(?: IF (.*))?$', text, re.I)
+        name, sets, where, cond = m.groups()
+        assignments = []
+        for a in split_top(sets):
+            col, expr = [x.strip() for x in a.split('=', 1)]
+            counter = re.match(r'(\w+)\s*([+-])\s*(.*)', expr)
+            if counter:
+                sign = 1 if counter.group(2) == '+' else -1
+                assignments.append((col, sign, self._value(counter.group(3))))
+            else:
+                assignments.append((col, 0, self._value(expr)))
+        keys = [(c.split('=')[0].strip(), self._value(c.split('=')[1])) for c in re.split(r' AND ', where, flags=re.I)]
+        conditions = []
+        for c in re.split(r' AND ', cond or '', flags=re.I):
+            if c:
+                col, op, expr = re.match(r'(\w+)\s*(<=|>=|!=|<|>|=)\s*(.*)', c).groups()
+                conditions.append((col, op, self._value(expr)))
+
+        def update(p):
+            table = self.tables[name]
+            changes = [(col, sign, fn(p)) for col, sign, fn in assignments]
+            key = {col: self._store(table, col, fn(p)) for col, fn in keys}
+            checks = [(col, op, fn(p)) for col, op, fn in conditions]
+            pk = tuple(key[c] for c in table.partition)
+            ck = tuple(key.get(c) for c in table.clustering)
+            part = table.get(pk, create=not checks)
+            row = table.row(part, ck, create=not checks) if part else None
+            if checks:
+                if row is None:
+                    return self._result(['[applied]'], [(False,)])
+                failed = [c for c, op, v in checks if not compare(row.get(c), op, v)]
+                if failed:
+                    names = ['[applied]'] + [c for c, op, v in checks]
+                    return self._result(names, [tuple([False] + [self._load(table, c, row.get(c)) for c in names[1:]])])
+            for col, sign, value in changes:
+                if sign:
+                    row[col] = (row.get(col) or 0) + sign * value
+                elif col in table.static:
+                    part['static'][col] = self._store(table, col, value)
+                else:
+                    row[col] = self._store(table, col, value)
+            return self._result(['[applied]'], [(True,)]) if checks else []
+        return update
+
+    def _select(self, text):
+        m = re.match(r'SELECT (DISTINCT )?(.*?) FROM (\w+)(?: WHERE (.*?))?(?: LIMIT (\d+))?$', text, re.I)
+        distinct, selectors, name, where, limit = m.groups()
+        selectors = split_top(selectors)
+        parsed = []
+        for s in selectors:
+            fn = re.match(r'(\w+)\((.*)\)$', s)
+            if fn:
+                parsed.append((fn.group(1).upper(), fn.group(2).strip()))
+            else:
+                parsed.append((None, s))
+        aggregate = any(fn for fn, _ in parsed)
+        conditions = []
+        for c in re.split(r' AND ', where or '', flags=re.I):
+            if c:
+                col, op, expr = re.match(r'(\w+)\s*(<=|>=|!=|<|>|=)\s*(.*)', c).groups()
+                conditions.append((col, op, self._value(expr)))
+
+        def select(p):
+            table = self.tables[name]
+            checks = [(col, op, self._store(table, col, fn(p))) for col, op, fn in conditions]
+            pk_checks = {col: v for col, op, v in checks if col in table.partition and op == '='}
+            ck_checks = [(col, op, v) for col, op, v in checks if col not in table.partition]
+            if len(pk_checks) == len(table.partition):
+                pk = tuple(pk_checks[c] for c in table.partition)
+                parts = [(pk, table.partitions[pk])] if pk in table.partitions else []
+            else:
+                parts = list(table.partitions.items())
+
+            matched = []
+            for pk, part in parts:
+                base = dict(zip(table.partition, pk), **part['static'])
+                if distinct:
+                    matched.append(base)
+                    continue
+                found = False
+                for ck in part['keys']:
+                    row = dict(base, **dict(zip(table.clustering, ck)), **part['rows'][ck])
+                    if all(compare(row.get(c), op, v) for c, op, v in ck_checks):
+                        matched.append(row)
+                        found = True
+                if not found and not ck_checks and part['static'] and not aggregate:
+                    matched.append(dict(base))
+
+            def field(row, expr):
+                if expr == '*':
+                    return 1
+                col, _, sub = expr.partition('.')
+                value = row.get(col)
+                if sub:
+                    return value.get(sub) if value else None
+                return self._load(table, col, value)
+
+            if aggregate:
+                out = []
+                for fn, expr in parsed:
+                    values = [v for v in (field(r, expr) for r in matched) if v is not None]
+                    if fn == 'COUNT':
+                        out.append(len(values))
+                    elif fn == 'SUM':
+                        out.append(sum(values))
+                    elif fn == 'MAX':
+                        out.append(max(values) if values else None)
+                    elif fn == 'MIN':
+                        out.append(min(values) if values else None)
+                    else:
+                        out.append(values[0] if values else None)
+                rows = [tuple(out)]
+            elif selectors == ['*']:
+                names = table.partition + table.clustering + sorted(c for c in table.columns if c not in table.partition + table.clustering)
+                rows = [tuple(self._load(table, c, r.get(c)) for c in names) for r in matched]
+            else:
+                rows = [tuple(field(r, expr) for fn, expr in parsed) for r in matched]
+            if limit:
+                rows = rows[:int(limit)]
+            return self._result(names if selectors == ['*'] else selectors, rows)
+        return select
+
+def compare(a, op, b):
+    if b is None:
+        # IF column = null
+        return (a is None) == (op == '=')
+    if a is None:
+        return False
+    return {'=': a == b, '!=': a != b, '<': a < b, '>': a > b, '<=': a <= b, '>=': a >= b}[op]
+
+class MemoryCluster:
+    def __init__(self, session):
+        self.session = session
+
+    def register_user_type(self, keyspace, user_type, klass):
+        self.session.user_types[user_type] = klass
+
+    def shutdown(self):
+        pass
+
+class MemoryBackend(StorageBackend):
+    # in-process stand-in for the p6-db-* cluster, for profiling and load testing the
+    # gRPC side without Cassandra. Every call (and every page) completes after latency
+    # seconds, to model the network and the replicas
+    def __init__(self, latency=0.0, schema=NOTEBOOK_SCHEMA):
+        self.latency = latency
+        self.clock = Clock() if latency else None
+        self.session = MemorySession(self)
+        for statement in schema:
+            self.session.execute(statement)
+
+    def connect(self, keyspace=None, **options):
+        return MemoryCluster(self.session), self.session
+
+    def batch(self):
+        return MemoryBatch()
@@ -0,0 +1,248 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import contextvars
+import inspect
+import threading
+import time
+import grpc
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+# the RPC being served on this thread / task, so Cassandra spans and errors can be
+# attributed to it without threading a name through every call
+CURRENT_RPC = contextvars.ContextVar('rpc', default='')
+
+class Histogram:
+    # log-linear buckets like HdrHistogram: each power of two of microseconds is split
+    # into 2**SUB_BITS linear buckets, so a recorded value is off by at most 1/2**SUB_BITS.
+    # scale=1 records plain counts (like rows per batch) instead of seconds
+    SUB_BITS = 5
+
+    def __init__(self, scale=1e6):
+        self.scale = scale
+        self.counts = {}
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        us = max(1, int(seconds * self.scale))
+        shift = max(0, us.bit_length() - 1 - self.SUB_BITS)
+        key = (us >> shift) << shift
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for key in sorted(self.counts):
+            seen += self.counts[key]
+            if seen >= rank:
+                return key / self.scale
+        return self.max
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.collectors = []
+
+    def observe(self, name, labels, seconds, scale=1e6):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(scale)
+            histogram.record(seconds)
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_gauge(self, name, labels, delta):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + delta
+
+    def count_error(self, e):
+        self.inc('station_errors_total', {'method': CURRENT_RPC.get(), 'error': type(e).__name__})
+
+    def collect(self, fn):
+        # fn() -> {metric name: value} (or {name: {method: value}}), read at scrape time
+        self.collectors.append(fn)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for (name, labels), h in sorted(self.histograms.items()):
+                base = ','.join('%s="%s"' % kv for kv in labels)
+                for q in QUANTILES:
+                    lines.append('%s{%s%squantile="%s"} %.6f' % (name, base, ',' if base else '', q, h.quantile(q)))
+                lines.append('%s_max{%s} %.6f' % (name, base, h.max))
+                lines.append('%s_sum{%s} %.6f' % (name, base, h.sum))
+                lines.append('%s_count{%s} %d' % (name, base, h.count))
+            for (name, labels), v in sorted(list(self.counters.items()) + list(self.gauges.items())):
+                lines.append('%s{%s} %s' % (name, ','.join('%s="%s"' % kv for kv in labels), v))
+        for fn in self.collectors:
+            for name, value in sorted(fn().items()):
+                if isinstance(value, dict):
+                    lines.extend('%s{method="%s"} %s' % (name, k, v) for k, v in sorted(value.items()))
+                else:
+                    lines.append('%s %s' % (name, value))
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Metrics()
+
+class InstrumentedSession:
+    # wraps a driver session so each query gets its own span, separate from the RPC's
+    # total time; everything else passes straight through. listeners are also called with
+    # (seconds, error) for every query, error being None when it succeeded
+    def __init__(self, session, metrics=REGISTRY, listeners=()):
+        self.session = session
+        self.metrics = metrics
+        self.listeners = list(listeners)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def execute(self, statement, parameters=None, **kwargs):
+        return self.execute_async(statement, parameters, **kwargs).result()
+
+    def execute_async(self, statement, parameters=None, **kwargs):
+        labels = {'method': CURRENT_RPC.get()}
+        start = time.perf_counter()
+        future = self.session.execute_async(statement, parameters, **kwargs)
+        timed = []
+
+        def done(_, error=None):
+            # paged queries call back once per page; the span covers the first one
+            if not timed:
+                timed.append(True)
+                elapsed = time.perf_counter() - start
+                if self.metrics:
+                    self.metrics.observe('station_cassandra_seconds', labels, elapsed)
+                for listener in self.listeners:
+                    listener(elapsed, error)
+
+        future.add_callbacks(done, lambda e: done(None, e))
+        return future
+
+class _Span:
+    def __init__(self, metrics, method, context=None):
+        self.metrics = metrics
+        self.method = method
+        self.context = context
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.token = CURRENT_RPC.set(self.method)
+        self.metrics.add_gauge('station_rpc_in_flight', {'method': self.method}, 1)
+        return self
+
+    def __exit__(self, kind, e, tb):
+        CURRENT_RPC.reset(self.token)
+        self.metrics.add_gauge('station_rpc_in_flight', {'method': self.method}, -1)
+        self.metrics.observe('station_rpc_seconds', {'method': self.method}, time.perf_counter() - self.start)
+        if e is not None:
+            self.metrics.inc('station_errors_total', {'method': self.method, 'error': self.error_label(e)})
+
+    def error_label(self, e):
+        # context.abort raises a bare Exception (AbortError under aio), which says nothing;
+        # the status code it set, e.g. RESOURCE_EXHAUSTED from the limiter, does
+        code = self.context.code() if self.context is not None else None
+        if isinstance(code, grpc.StatusCode) and code != grpc.StatusCode.OK:
+            return code.name
+        return type(e).__name__
+
+def method_name(details):
+    return details.method.rsplit('/', 1)[-1]
+
+def wrap_handler(handler, wrap_unary, wrap_stream):
+    if handler is None:
+        return None
+    if handler.unary_unary:
+        return grpc.unary_unary_rpc_method_handler(wrap_unary(handler.unary_unary),
+            handler.request_deserializer, handler.response_serializer)
+    if handler.stream_unary:
+        return grpc.stream_unary_rpc_method_handler(wrap_unary(handler.stream_unary),
+            handler.request_deserializer, handler.response_serializer)
+    if handler.unary_stream:
+        return grpc.unary_stream_rpc_method_handler(wrap_stream(handler.unary_stream),
+            handler.request_deserializer, handler.response_serializer)
+    return grpc.stream_stream_rpc_method_handler(wrap_stream(handler.stream_stream),
+        handler.request_deserializer, handler.response_serializer)
+
+class MetricsInterceptor(grpc.ServerInterceptor):
+    # per-method latency histogram, in-flight gauge and error counters for grpc.server
+    def __init__(self, metrics=REGISTRY):
+        self.metrics = metrics
+
+    def intercept_service(self, continuation, handler_call_details):
+        method = method_name(handler_call_details)
+
+        def wrap_unary(behavior):
+            def timed(request, context):
+                with _Span(self.metrics, method, context):
+                    return behavior(request, context)
+            return timed
+
+        def wrap_stream(behavior):
+            def timed(request, context):
+                with _Span(self.metrics, method, context):
+                    yield from behavior(request, context)
+            return timed
+
+        return wrap_handler(continuation(handler_call_details), wrap_unary, wrap_stream)
+
+class AsyncMetricsInterceptor(grpc.aio.ServerInterceptor):
+    # the same for grpc.aio.server, where a handler may still be a plain function run on
+    # the migration thread pool
+    def __init__(self, metrics=REGISTRY):
+        self.metrics = metrics
+
+    async def intercept_service(self, continuation, handler_call_details):
+        method = method_name(handler_call_details)
+
+        def wrap_unary(behavior):
+            async def timed(request, context):
+                with _Span(self.metrics, method, context):
+                    reply = behavior(request, context)
+                    return await reply if inspect.isawaitable(reply) else reply
+            return timed
+
+        def wrap_stream(behavior):
+            async def timed(request, context):
+                with _Span(self.metrics, method, context):
+                    replies = behavior(request, context)
+                    if inspect.isasyncgen(replies):
+                        async for reply in replies:
+                            yield reply
+                    else:
+                        for reply in replies:
+                            yield reply
+            return timed
+
+        return wrap_handler(await continuation(handler_call_details), wrap_unary, wrap_stream)
+
+def serve_metrics(port, metrics=REGISTRY):
+    # plain-text exposition on http://localhost:port/metrics, from a daemon thread
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
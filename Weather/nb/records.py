@@ -0,0 +1,58 @@
+import datetime
+import glob
+import os
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+RECORDS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'records.parquet')
+EPOCH = datetime.date(1970, 1, 1)
+COLUMNS = ['station', 'date', 'element', 'value']
+
+def part_files(path=RECORDS):
+    # only the top-level parts; records.parquet/records.parquet is a stale nested copy
+    # and reading the directory recursively would count every reading twice
+    return sorted(glob.glob(os.path.join(path, 'part-*.parquet')))
+
+def row_groups(path=RECORDS):
+    # one row group at a time, so memory follows the largest group rather than the dataset
+    for f in part_files(path):
+        parquet = pq.ParquetFile(f)
+        for i in range(parquet.num_row_groups):
+            yield parquet.read_row_group(i, columns=COLUMNS)
+
+def spread(table):
+    # TMAX/TMIN readings -> (station, date, tmax, tmin) with the other element null
+    table = table.filter(pc.is_in(table['element'], pa.array(['TMAX', 'TMIN'])))
+    is_tmax = pc.equal(table['element'], 'TMAX')
+    return pa.table({
+        'station': table['station'],
+        'date': table['date'],
+        'tmax': pc.if_else(is_tmax, table['value'], None),
+        'tmin': pc.if_else(is_tmax, None, table['value']),
+    })
+
+def combine(table):
+    # max ignores nulls, so grouping lines up a station-day's TMAX and TMIN whichever
+    # row group each came from; partial results can be combined again the same way
+    grouped = table.group_by(['station', 'date']).aggregate([('tmax', 'max'), ('tmin', 'max')])
+    return grouped.rename_columns([{'tmax_max': 'tmax', 'tmin_max': 'tmin'}.get(c, c) for c in grouped.column_names])
+
+def pivot(partials):
+    # one (station, days, tmin, tmax) row per station-day that has both readings, days
+    # counted from 1970-01-01, ordered by station then day
+    table = combine(pa.concat_tables(partials))
+    table = table.filter(pc.and_(pc.is_valid(table['tmax']), pc.is_valid(table['tmin'])))
+    dates = pc.cast(pc.strptime(table['date'], format='%Y%m%d', unit='s'), pa.date32())
+    return pa.table({
+        'station': table['station'],
+        'days': pc.cast(dates, pa.int32()),
+        'tmin': pc.cast(table['tmin'], pa.int32()),
+        'tmax': pc.cast(table['tmax'], pa.int32()),
+    }).sort_by([('station', 'ascending'), ('days', 'ascending')])
+
+def temperature_table(path=RECORDS):
+    return pivot(combine(spread(group)) for group in row_groups(path))
+
+def date_string(days):
+    return (EPOCH + datetime.timedelta(days=days)).isoformat()
@@ -0,0 +1,121 @@
+from collections import OrderedDict
+import threading
+import time
+import numpy as np
+from max_cache import MISS
+
+# rough per-entry cost besides the arrays: the Series object, its key and the LRU links
+ENTRY_OVERHEAD = 256
+INT16 = np.iinfo(np.int16)
+
+def narrow(values):
+    # int16 when every value fits, which tenths of a degree always do
+    if not len(values) or (values.min() >= INT16.min and values.max() <= INT16.max):
+        return values.astype(np.int16)
+    return values
+
+class Series:
+    # one station's readings as columns in date order: days since 1970-01-01 (int32)
+    # and tmin/tmax (int16)
+    def __init__(self, days, tmin, tmax):
+        self.days = days
+        self.tmin = tmin
+        self.tmax = tmax
+
+    @classmethod
+    def from_rows(cls, rows):
+        # (date, tmin, tmax) rows as the driver returns them; a row missing either
+        # reading can't be sent by StationRange anyway, so it is left out
+        rows = [r for r in rows if r[1] is not None and r[2] is not None]
+        n = len(rows)
+        days = np.fromiter((r[0].days_from_epoch for r in rows), np.int32, n)
+        tmin = np.fromiter((r[1] for r in rows), np.int32, n)
+        tmax = np.fromiter((r[2] for r in rows), np.int32, n)
+        order = np.argsort(days, kind='stable')
+        return cls(days[order], narrow(tmin[order]), narrow(tmax[order]))
+
+    @property
+    def nbytes(self):
+        return self.days.nbytes + self.tmin.nbytes + self.tmax.nbytes + ENTRY_OVERHEAD
+
+    def between(self, first, last):
+        # the index range of days first..last, inclusive; None leaves that side open
+        lo = 0 if first is None else int(np.searchsorted(self.days, first, 'left'))
+        hi = len(self.days) if last is None else int(np.searchsorted(self.days, last, 'right'))
+        return lo, hi
+
+    def spread_stats(self):
+        # (count, mean spread, min spread, max spread), as aggregates.scan_stats
+        if not len(self.days):
+            return (0, 0.0, 0, 0)
+        spread = self.tmax.astype(np.int32) - self.tmin
+        return (len(spread), float(spread.mean()), int(spread.min()), int(spread.max()))
+
+    def quantiles(self, element, quantiles):
+        # the same ranks as sketch.exact_quantiles, from one sort
+        values = self.tmin if element == "tmin" else self.tmax
+        if not len(values):
+            return [None for q in quantiles], 0
+        ordered = np.sort(values)
+        ranks = (np.asarray(quantiles) * (len(ordered) - 1)).astype(np.int64)
+        return ordered[ranks].astype(float).tolist(), len(ordered)
+
+class SeriesCache:
+    # LRU of station -> Series, bounded by bytes rather than entries, with a TTL for
+    # writes made by other processes. Writes through this process invalidate the
+    # station. A read that began before such a write carries the old version, and
+    # put() turns it away, so a stale series isn't cached over the write
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, station):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(station)
+            if entry is None or entry[1] < now:
+                self.misses += 1
+                return MISS
+            self.entries.move_to_end(station)
+            self.hits += 1
+            return entry[0]
+
+    def version(self, station):
+        with self.lock:
+            return self.versions.get(station, 0)
+
+    def put(self, station, series, version):
+        size = series.nbytes
+        with self.lock:
+            if self.versions.get(station, 0) != version or size > self.max_bytes:
+                return
+            old = self.entries.pop(station, None)
+            if old:
+                self.bytes -= old[0].nbytes
+            self.entries[station] = (series, time.monotonic() + self.ttl)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (evicted, _) = self.entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def invalidate(self, station):
+        with self.lock:
+            self.versions[station] = self.versions.get(station, 0) + 1
+            old = self.entries.pop(station, None)
+            if old:
+                self.bytes -= old[0].nbytes
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0}
@@ -1,62 +1,1155 @@
 import station_pb2_grpc
 import grpc
 import station_pb2
+from backends import CassandraBackend, Writer, BATCH_ROWS, MAX_IN_FLIGHT
+from memory_backend import MemoryBackend
+from cassandra_session import HedgeMetrics
+from limiter import LimitInterceptor, AsyncLimitInterceptor, GradientLimiter
+from buckets import BucketedLayout, year_of, year_runs, day_number, day_string
+from layouts import record
+from sketch import StationSketches, exact_quantiles, PERSIST_INTERVAL
+from top_stations import HottestStations, DEFAULT_K, REFRESH_INTERVAL
+from spool import Spool, MAX_BYTES as SPOOL_BYTES
+from write_behind import WriteBehind, BufferFull
+from metrics import REGISTRY, CURRENT_RPC, InstrumentedSession, MetricsInterceptor, AsyncMetricsInterceptor, serve_metrics
+from aggregates import StationAggregates, summarize, merge, spread_stats, scan_stats
+from max_cache import MaxCache, MISS
+from series_cache import SeriesCache, Series
 from cassandra import ConsistencyLevel
-from cassandra.cluster import Cluster
+from cassandra.cqltypes import SimpleDateType
+from collections import deque
 from concurrent import futures
 import cassandra
+import argparse
+import asyncio
+import contextvars
+import heapq
+import signal
+import socket
 import traceback
 import time
 
-class record:
-    def __init__(self,tmin,tmax):
-        self.tmin = tmin
-        self.tmax = tmax
-       
+# rows per page for StationRange unless the request asks for another size
+RANGE_FETCH_SIZE = 1000
+# StationQuantiles answers these unless the request names others
+DEFAULT_QUANTILES = (0.05, 0.5, 0.95)
+# seconds a write-behind RecordTemps waits for room in a full queue before giving up
+WRITE_BLOCK = 1.0
+# Cassandra errors meaning the replicas aren't there; with a spool those writes wait in it
+SPOOLED = (cassandra.Unavailable, cassandra.cluster.NoHostAvailable)
+# a row that would have queued behind a full spool; writing it directly instead would let
+# the older spooled rows overwrite it when they are replayed
+SPOOL_FULL = "write spool is full, retry later"
+# seconds in-flight RPCs get to finish after SIGTERM
+GRACE = 5.0
+# open ends of a StationRange, as the driver's offset day numbers
+FIRST_DAY = 0
+LAST_DAY = 2**32 - 1
+
+def format_error(e):
+    # counted here, once, as the error the RPC failed with
+    REGISTRY.count_error(e)
+    return error_message(e)
+
+def error_message(e):
+    if isinstance(e, cassandra.Unavailable):
+        return 'need '+ str(e.required_replicas) +' replicas, but only have '+str(e.alive_replicas)
+    if isinstance(e, cassandra.cluster.NoHostAvailable):
+        for node, error in e.errors.items():
+            if isinstance(error, cassandra.Unavailable):
+                return error_message(error)
+    if isinstance(e, BufferFull):
+        return str(e)
+    return "".join(traceback.format_exception(type(e), e, e.__traceback__))
+
+def columns_match(request):
+    n = len(request.days)
+    return len(request.tmin) == n and len(request.tmax) == n
+
+def columns_mismatch_reply():
+    return station_pb2.RecordTempsBatchReply(errors = [station_pb2.RecordError(
+        index=-1, error='days, tmin and tmax must have the same length')])
+
+def add_reply(reply, part, offset):
+    # part, a RecordTempsBatchReply for rows counted from offset, into reply
+    reply.written += part.written
+    for e in part.errors:
+        reply.errors.add(index = e.index + offset if e.index >= 0 else e.index, error = e.error)
+
+def range_page(rows):
+    return station_pb2.StationRangeReply(days = [r[0].days_from_epoch for r in rows],
+                                         tmin = [r[1] for r in rows], tmax = [r[2] for r in rows])
+
+def max_value(rows):
+    return rows[0][0] if rows else None
+
+def stats_reply(stats):
+    count, mean, lo, hi = stats
+    return station_pb2.StationStatsReply(count = count, mean_spread = mean, min_spread = lo, max_spread = hi)
+
+def quantiles_asked(request):
+    quantiles = list(request.quantiles) or list(DEFAULT_QUANTILES)
+    if any(not 0 <= q <= 1 for q in quantiles):
+        raise ValueError("quantiles must be between 0 and 1")
+    if request.element not in ("", "tmax", "tmin"):
+        raise ValueError("element must be tmax or tmin")
+    return quantiles
+
+def quantiles_reply(values, count):
+    return station_pb2.StationQuantilesReply(values = values if count else [], count = count)
+
+def top_k(request):
+    if request.k < 0:
+        raise ValueError("k must not be negative")
+    return request.k or DEFAULT_K
+
+def ranked(pairs, k):
+    # the k (station, tmax) pairs with the highest tmax
+    return heapq.nlargest(k, ((s, t) for s, t in pairs if t is not None), key=lambda pair: pair[1])
+
+def top_reply(pairs):
+    return station_pb2.TopStationsReply(stations = [s for s, t in pairs], tmax = [t for s, t in pairs])
+
+def series_pages(series, request, fetch_size):
+    # StationRange pages cut from a cached series instead of read from Cassandra
+    lo, hi = series.between(day_number(request.start) if request.start else None,
+                            day_number(request.end) if request.end else None)
+    if lo >= hi:
+        yield station_pb2.StationRangeReply()
+    for start in range(lo, hi, fetch_size):
+        end = min(start + fetch_size, hi)
+        yield station_pb2.StationRangeReply(days = series.days[start:end].tolist(), tmin = series.tmin[start:end].tolist(),
+                                            tmax = series.tmax[start:end].tolist())
+
+def pages_asyncio(response_future):
+    # like as_asyncio, but for a paged query: the driver calls the same callbacks once per
+    # page, so every page (or the error) lands on one queue
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    response_future.add_callbacks(
+        lambda rows: loop.call_soon_threadsafe(queue.put_nowait, (rows, None)),
+        lambda e: loop.call_soon_threadsafe(queue.put_nowait, (None, e)))
+    return queue
+
+def as_asyncio(response_future):
+    # the driver completes futures on its own event thread; hop back onto the loop
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+
+    def resolve(result):
+        if not fut.done():
+            fut.set_result(result)
+
+    def reject(e):
+        if not fut.done():
+            fut.set_exception(e)
+
+    response_future.add_callbacks(
+        lambda rows: loop.call_soon_threadsafe(resolve, rows),
+        lambda e: loop.call_soon_threadsafe(reject, e))
+    return fut
+
 class StationServicer(station_pb2_grpc.StationServicer):
-    def __init__(self):
-        cluster = Cluster(['p6-db-1', 'p6-db-2', 'p6-db-3'])
+    def __init__(self, backend=None, aggregates=False, cache_entries=0, cache_ttl=30.0, fetch_size=RANGE_FETCH_SIZE,
+                 latency_aware=False, hedge_delay=None, hedge_attempts=1, metrics=None,
+                 write_behind=0, write_ack="flush", write_linger=0.002, limiter=None,
+                 sketches=False, sketch_interval=PERSIST_INTERVAL, layout="flat", top_stations=0,
+                 top_refresh=REFRESH_INTERVAL, spool=None, spool_bytes=SPOOL_BYTES, series_cache=0, series_ttl=30.0,
+                 worker_index=0):
+        # backend is where the statements run: the p6-db-* cluster unless a test or
+        # benchmark hands in something else, like memory_backend.MemoryBackend
+        self.backend = backend or CassandraBackend(latency_aware=latency_aware,
+                                                   hedge_delay=hedge_delay, hedge_attempts=hedge_attempts)
+        cluster, self.cass = self.backend.connect('weather')
+        if metrics or limiter:
+            # the limiter learns from the latency of every Cassandra query
+            self.cass = InstrumentedSession(self.cass, metrics, [limiter.sample] if limiter else [])
         cluster.register_user_type('weather', 'station_record', record)
-        self.cass = cluster.connect()
-        self.cass.execute("use weather")
         self.insert_statement = self.cass.prepare("""INSERT INTO stations (id, date, record) VALUES(?,?,?) """)
         self.insert_statement.consistency_level = ConsistencyLevel.ONE
+        self.insert_columns_statement = self.cass.prepare("""INSERT INTO stations (id, date, record) VALUES(?,?,{tmin: ?, tmax: ?}) """)
+        self.insert_columns_statement.consistency_level = ConsistencyLevel.ONE
         self.max_statement = self.cass.prepare("""SELECT MAX(record.tmax) FROM stations WHERE id = ? """)
         self.max_statement.consistency_level = ConsistencyLevel.THREE
+        self.range_statement = self.cass.prepare("""SELECT date, record.tmin, record.tmax FROM stations WHERE id = ? AND date >= ? AND date <= ? """)
+        self.range_statement.consistency_level = ConsistencyLevel.ONE
+        self.spread_statement = self.cass.prepare("""SELECT record.tmin, record.tmax FROM stations WHERE id = ? """)
+        self.spread_statement.consistency_level = ConsistencyLevel.ONE
+        self.series_statement = self.cass.prepare("""SELECT date, record.tmin, record.tmax FROM stations WHERE id = ? """)
+        self.series_statement.consistency_level = ConsistencyLevel.ONE
+        self.series_statement.is_idempotent = True
+        # reads are safe to send twice, which is what lets the driver hedge them
+        self.max_statement.is_idempotent = True
+        self.range_statement.is_idempotent = True
+        self.spread_statement.is_idempotent = True
+        self.hedges = HedgeMetrics() if hedge_delay is not None else None
+        # layout="bucketed" keeps readings in stations_by_year, one partition per station
+        # and year, so reads fan out over a station's years instead of one growing partition
+        self.buckets = BucketedLayout(self.cass) if layout == "bucketed" else None
+        self.fetch_size = fetch_size
+        # with aggregates on, writes also maintain station_aggregates and StationMax
+        # reads that single row instead of scanning the whole partition
+        self.aggregates = StationAggregates(self.cass) if aggregates else None
+        self.max_cache = MaxCache(cache_entries, cache_ttl) if cache_entries else None
+        # per-station tmin/tmax quantile sketches, persisted to station_sketches
+        self.sketches = StationSketches(self.cass, interval=sketch_interval,
+                                        writer="%s-%d" % (socket.gethostname(), worker_index)) if sketches else None
+        if self.sketches and metrics:
+            metrics.collect(lambda: {"station_sketch_" + k: v for k, v in self.sketches.stats().items()})
+        # with top_stations, the hottest that many stations are kept in memory for
+        # TopStations, raised on every write and loaded from station_aggregates at
+        # startup (and every top_refresh seconds, for other processes' writes)
+        if top_stations and not self.aggregates:
+            raise ValueError("top_stations needs aggregates")
+        self.top = HottestStations(top_stations, self._station_tmaxes, top_refresh) if top_stations else None
+        # with series_cache (a byte budget), the whole series read for StationRange and
+        # for the StationStats/StationQuantiles scans is kept as int16 columns and
+        # answered with numpy; writes through this process invalidate their station
+        self.series = SeriesCache(series_cache, series_ttl) if series_cache else None
+        # per-station summaries of written rows are only worth building if something consumes them
+        self.tracking = bool(self.aggregates or self.max_cache or self.sketches or self.top or self.series)
+        # with write_behind, RecordTemps queues up to that many rows for a background
+        # flusher that coalesces them into per-station batches. write_ack="flush" replies
+        # once the row is written; "enqueue" replies as soon as it is queued, so a later
+        # write error only shows up in the metrics
+        self.write_ack = write_ack
+        self.write_behind = WriteBehind(self._flush, max_rows=write_behind, max_flush=BATCH_ROWS * MAX_IN_FLIGHT,
+                                        linger=write_linger, metrics=metrics) if write_behind else None
+        # with spool (a directory), RecordTemps rows Cassandra turns away for want of
+        # replicas are written to a local spool and acknowledged, and a background
+        # replayer writes them out once the replicas are back. While the spool holds rows,
+        # new ones are spooled behind them, so an older reading never lands after a newer one
+        self.spool = Spool(spool, self._replay, max_bytes=spool_bytes) if spool else None
+        if metrics:
+            metrics.collect(self.stats)
+
+    def close(self):
+        # writes out whatever is still buffered in memory; called on shutdown. The spool
+        # keeps what it hasn't replayed for the next start
+        if self.write_behind:
+            self.write_behind.close()
+        if self.spool:
+            self.spool.close()
+        if self.sketches:
+            self.sketches.close()
+        if self.top:
+            self.top.close()
+
     def RecordTemps(self, request, context):
+        if self.write_behind:
+            try:
+                waiter = self.write_behind.submit(request, WRITE_BLOCK)
+                err = waiter.result() if self.write_ack == "flush" else ""
+            except BufferFull as e:
+                err = format_error(e)
+            return station_pb2.RecordTempsReply(error = err)
+        if self.spool and self.spool.depth:
+            stored = self.spool.append([request.SerializeToString()])
+            return station_pb2.RecordTempsReply(error = "" if stored else SPOOL_FULL)
         try:
-            self.cass.execute(self.insert_statement,(request.station, request.date, record(request.tmin,request.tmax)))
+            self.cass.execute(*self._single_write(request))
+            if self.tracking:
+                summary = summarize([request.tmin], [request.tmax])
+                self._observe(request.station, summary)
+                self._observe_rows(request.station, [request.tmin], [request.tmax])
+                if self.aggregates:
+                    self.aggregates.update(request.station, summary, [(request.date, request.tmin, request.tmax)])
             err = ""
-        except cassandra.Unavailable as e:
-             err = 'need '+ str(e.required_replicas) +' replicas, but only have '+str(e.alive_replicas)
-        except cassandra.cluster.NoHostAvailable as e:
-            for node, error in e.errors.items():
-                if isinstance(e, cassandra.Unavailable):
-                     err = 'need '+ str(e.required_replicas) +' replicas, but only have '+str(e.alive_replicas)
-        except:
-            err= traceback.format_exc()
+        except Exception as e:
+            err = format_error(e)
+            if self.spool and isinstance(e, SPOOLED) and self.spool.append([request.SerializeToString()]):
+                err = ""
         return station_pb2.RecordTempsReply(error = err)
-       
+
+    def stats(self):
+        stats = {}
+        if self.max_cache:
+            stats.update({"station_max_cache_" + k: v for k, v in self.max_cache.stats().items()})
+        if self.write_behind:
+            stats.update({"station_write_behind_" + k: v for k, v in self.write_behind.stats().items()})
+        if self.top:
+            stats.update({"station_top_" + k: v for k, v in self.top.stats().items()})
+        if self.series:
+            stats.update({"station_series_cache_" + k: v for k, v in self.series.stats().items()})
+        if self.spool:
+            stats.update({"station_spool_" + k: v for k, v in self.spool.stats().items()})
+        if self.hedges:
+            for rpc, counts in self.hedges.stats().items():
+                for k, v in counts.items():
+                    stats.setdefault("station_hedge_" + k, {})[rpc] = v
+        return stats
+
+    def _flush(self, requests):
+        # runs on the write-behind thread: the queued rows go out as single-partition
+        # batches, the same path as RecordTempsStream. With a spool, rows Cassandra turned
+        # away for want of replicas are spooled, as are all rows while it holds some
+        token = CURRENT_RPC.set("WriteBehind")
+        try:
+            reply = self._spool_records(requests) if self.spool else self._write_batches(self._record_batches(requests, 0))
+        finally:
+            CURRENT_RPC.reset(token)
+        return {e.index: e.error for e in reply.errors if e.index >= 0}
+
+    def _write_or_spool(self, n, payload, batches):
+        # writes rows 0..n-1 with a spool: while it holds rows these queue behind them (and
+        # are refused if it is full), and rows Cassandra turns away for want of replicas
+        # join them there. payload(i) is row i as a serialized RecordTempsRequest, batches()
+        # the batches for all n rows
+        if self.spool.depth:
+            stored = self.spool.append([payload(i) for i in range(n)])
+            return station_pb2.RecordTempsBatchReply(written = stored, errors = [
+                station_pb2.RecordError(index = i, error = SPOOL_FULL) for i in range(stored, n)])
+        unavailable = {}
+        reply = self._write_batches(batches(), unavailable)
+        if unavailable:
+            indexes = sorted(unavailable)
+            stored = self.spool.append([payload(i) for i in indexes])
+            reply.written += stored
+            reply.errors.extend(station_pb2.RecordError(index=i, error=unavailable[i]) for i in indexes[stored:])
+        return reply
+
+    def _spool_records(self, records):
+        return self._write_or_spool(len(records), lambda i: records[i].SerializeToString(),
+                                    lambda: self._record_batches(records, 0))
+
+    def _spool_columns(self, request):
+        days, tmin, tmax = request.days, request.tmin, request.tmax
+        payload = lambda i: station_pb2.RecordTempsRequest(station = request.station, date = day_string(days[i]),
+                                                           tmin = tmin[i], tmax = tmax[i]).SerializeToString()
+        return self._write_or_spool(len(days), payload, lambda: self._column_batches(request))
+
+    def _replay(self, payloads):
+        # runs on the spool's replayer thread. Rows turned away for want of replicas again
+        # are handed back for later; any other error would only repeat, so the row is dropped
+        requests = [station_pb2.RecordTempsRequest.FromString(p) for p in payloads]
+        token = CURRENT_RPC.set("SpoolReplay")
+        try:
+            unavailable = {}
+            reply = self._write_batches(self._record_batches(requests, 0), unavailable)
+        finally:
+            CURRENT_RPC.reset(token)
+        return sorted(unavailable), len({e.index for e in reply.errors if e.index >= 0})
+
+    def _single_write(self, request):
+        # (statement, params) for one RecordTemps row
+        if not self.buckets:
+            return self.insert_statement, (request.station, request.date, record(request.tmin, request.tmax))
+        year = year_of(request.date)
+        batch = self.backend.batch()
+        self.buckets.mark(batch, request.station, year)
+        batch.add(self.buckets.insert_statement, (request.station, year, request.date, record(request.tmin, request.tmax)))
+        return batch, None
+
+    def _station_tmaxes(self):
+        # (station, tmax) from station_aggregates, with the readings answering for any
+        # station whose stored tmax is unknown (see _max_from). HottestStations calls this
+        # from its refresh thread under either servicer, so it only blocks
+        rows = list(self._read("TopStations", self.aggregates.tmaxes_statement).result())
+        unknown = [r.id for r in rows if r.tmax is None]
+        if self.buckets:
+            maxes = self._gather_many("TopStations", [self.buckets.max_steps(station) for station in unknown])
+        else:
+            futures = [self._read("TopStations", self.max_statement, (station,)) for station in unknown]
+            maxes = [max_value(f.result().current_rows) for f in futures]
+        for tmax in maxes:
+            if isinstance(tmax, Exception):
+                raise tmax
+        maxes = dict(zip(unknown, maxes))
+        return [(r.id, maxes[r.id] if r.tmax is None else r.tmax) for r in rows]
+
+    def _read(self, rpc, statement, params=None):
+        future = self.cass.execute_async(statement, params)
+        if self.hedges:
+            self.hedges.watch(rpc, future)
+        return future
+
+    def _max_query(self):
+        if self.aggregates:
+            return self.aggregates.max_statement
+        return self.max_statement
+
+    def _fans_out(self):
+        # the aggregates row answers StationMax whatever the layout
+        return self.buckets and not self.aggregates
+
+    def _max(self, rpc, station):
+        if self._fans_out():
+            return self._gather(rpc, self.buckets.max_steps(station))
+        return self._max_from(rpc, station, self._read(rpc, self._max_query(), (station,)).result().current_rows)
+
+    def _max_from(self, rpc, station, rows):
+        # a station_aggregates tmax that is null has been unknown since a reading was
+        # overwritten (see aggregates.py); the readings answer instead
+        if self.aggregates and rows and rows[0][0] is None:
+            return self._readings_max(rpc, station)
+        return max_value(rows)
+
+    def _readings_max(self, rpc, station):
+        if self.buckets:
+            return self._gather(rpc, self.buckets.max_steps(station))
+        return max_value(self._read(rpc, self.max_statement, (station,)).result().current_rows)
+
+    def _gather(self, rpc, steps):
+        # one set of steps, whose failure is raised like any other read's
+        result = self._gather_many(rpc, [steps])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _gather_many(self, rpc, all_steps):
+        # runs read steps (see buckets.py) side by side: each round, the queries of every
+        # one still going are sent together. returns each one's answer, or the exception
+        # that stopped it
+        results = [None] * len(all_steps)
+        waiting = {i: (steps, None) for i, steps in enumerate(all_steps)}
+        while waiting:
+            issued = []
+            for i, (steps, rows) in waiting.items():
+                try:
+                    queries = steps.send(rows)
+                except StopIteration as done:
+                    results[i] = done.value
+                    continue
+                except Exception as e:
+                    results[i] = e
+                    continue
+                issued.append((i, steps, [self._read(rpc, statement, params) for statement, params in queries]))
+            waiting = {}
+            for i, steps, futures in issued:
+                try:
+                    waiting[i] = (steps, [list(f.result()) for f in futures])
+                except Exception as e:
+                    results[i] = e
+        return results
+
+    def _scan(self, rpc, station):
+        # every (tmin, tmax) of a station
+        if self.buckets:
+            return self._gather(rpc, self.buckets.scan_steps(station))
+        return self._read(rpc, self.spread_statement, (station,)).result()
+
+    def _series(self, rpc, station):
+        # the station's whole series, from the cache or read (every bucket of it) and cached
+        series = self.series.get(station)
+        if series is MISS:
+            version = self.series.version(station)
+            if self.buckets:
+                rows = self._gather(rpc, self.buckets.series_steps(station))
+            else:
+                rows = self._read(rpc, self.series_statement, (station,)).result()
+            series = Series.from_rows(rows)
+            self.series.put(station, series, version)
+        return series
+
+    def _range_query(self, request):
+        # the clustering order on date makes this one sequential slice of the partition;
+        # fetch_size turns it into driver pages we can forward as they arrive
+        bound = self.range_statement.bind((request.station, request.start or FIRST_DAY, request.end or LAST_DAY))
+        bound.fetch_size = request.fetch_size or self.fetch_size
+        return bound
+
+    def _range_queries(self, request, years):
+        # the same slice of each year bucket that overlaps the range, in date order
+        return self.buckets.range_queries(request.station, years, request.start or FIRST_DAY,
+                                          request.end or LAST_DAY, request.fetch_size or self.fetch_size)
+
+    def _summary(self, station, dates, tmins, tmaxs):
+        return (station, summarize(tmins, tmaxs), tmins, tmaxs, dates) if self.tracking else None
+
+    def _merge_summary(self, summaries, readings, summary):
+        # a written batch's summary into the per-station totals; the aggregates also
+        # need the readings themselves, to count each station-day only once
+        station = summary[0]
+        summaries[station] = merge(summaries.get(station), summary[1])
+        if self.aggregates:
+            readings.setdefault(station, []).extend(zip(summary[4], summary[2], summary[3]))
+        self._observe_rows(station, summary[2], summary[3])
+
+    def _observe(self, station, summary):
+        # in-memory bookkeeping after rows for station were written
+        if self.max_cache:
+            self.max_cache.raise_to(station, summary[1])
+        if self.top:
+            self.top.update(station, summary[1])
+        if self.series:
+            self.series.invalidate(station)
+
+    def _observe_rows(self, station, tmins, tmaxs):
+        # the same for bookkeeping that needs every reading, not just the summary
+        if self.sketches:
+            self.sketches.add(station, tmins, tmaxs)
+
+    def _write_batches(self, batches, unavailable=None):
+        # batches yields (BatchStatement, record indexes, summary); at most MAX_IN_FLIGHT
+        # run at once, and the aggregates are updated once per station at the end. A row
+        # that couldn't be bound comes as (exception, [index], None) instead. Given
+        # an unavailable dict, rows whose batch failed for want of replicas go there as
+        # {index: error} instead of into the reply
+        errors = []
+        summaries = {}
+        readings = {}
+
+        def done(tag, e):
+            indexes, summary = tag
+            if e is None:
+                if summary:
+                    self._merge_summary(summaries, readings, summary)
+                return
+            err = format_error(e)
+            if unavailable is not None and isinstance(e, SPOOLED):
+                unavailable.update(dict.fromkeys(indexes, err))
+            else:
+                errors.extend(station_pb2.RecordError(index=i, error=err) for i in indexes)
+
+        writer = Writer(self.cass, MAX_IN_FLIGHT, done)
+        for batch, indexes, summary in batches:
+            if isinstance(batch, Exception):
+                errors.extend(station_pb2.RecordError(index=i, error=format_error(batch)) for i in indexes)
+                continue
+            writer.send(batch, rows=len(indexes), tag=(indexes, summary))
+        writer.drain()
+        for station, summary in summaries.items():
+            self._observe(station, summary)
+            if not self.aggregates:
+                continue
+            try:
+                self.aggregates.update(station, summary, readings[station])
+            except Exception as e:
+                errors.append(station_pb2.RecordError(index=-1, error=format_error(e)))
+        return station_pb2.RecordTempsBatchReply(written = writer.written, errors = errors)
+
+    def _record_batches(self, records, offset):
+        # a batch only stays cheap when every row lands in the same partition; with year
+        # buckets that is a station and year, plus the row listing the bucket
+        partitions = {}
+        for i, r in enumerate(records):
+            key = (r.station, year_of(r.date)) if self.buckets else (r.station, None)
+            partitions.setdefault(key, []).append((offset + i, r))
+
+        for (station, year), rows in partitions.items():
+            for start in range(0, len(rows), BATCH_ROWS):
+                batch = self.backend.batch()
+                if self.buckets:
+                    self.buckets.mark(batch, station, year)
+                # the driver binds each row as it is added, so a malformed date fails
+                # here; that row is reported on its own and the rest still go out
+                chunk = []
+                for i, r in rows[start:start + BATCH_ROWS]:
+                    try:
+                        if self.buckets:
+                            batch.add(self.buckets.insert_statement, (station, year, r.date, record(r.tmin, r.tmax)))
+                        else:
+                            batch.add(self.insert_statement, (r.station, r.date, record(r.tmin, r.tmax)))
+                        chunk.append((i, r))
+                    except Exception as e:
+                        yield e, [i], None
+                if chunk:
+                    yield batch, [i for i, r in chunk], self._summary(station, [r.date for i, r in chunk], [r.tmin for i, r in chunk], [r.tmax for i, r in chunk])
+
+    def _column_batches(self, request):
+        # bind the packed columns straight into the statement; dates go in as the
+        # driver's offset day number so nothing is parsed or boxed per row
+        station = request.station
+        days, tmin, tmax = request.days, request.tmin, request.tmax
+        runs = year_runs(days) if self.buckets else [(None, 0, len(days))]
+        for year, first, last in runs:
+            for start in range(first, last, BATCH_ROWS):
+                end = min(start + BATCH_ROWS, last)
+                batch = self.backend.batch()
+                if self.buckets:
+                    self.buckets.mark(batch, station, year)
+                # as in _record_batches, a row the driver can't bind is reported on its own
+                indexes = []
+                for i in range(start, end):
+                    try:
+                        if self.buckets:
+                            batch.add(self.buckets.insert_columns_statement, (station, year, days[i] + SimpleDateType.EPOCH_OFFSET_DAYS, tmin[i], tmax[i]))
+                        else:
+                            batch.add(self.insert_columns_statement, (station, days[i] + SimpleDateType.EPOCH_OFFSET_DAYS, tmin[i], tmax[i]))
+                        indexes.append(i)
+                    except Exception as e:
+                        yield e, [i], None
+                if indexes:
+                    yield batch, indexes, self._summary(station, [days[i] + SimpleDateType.EPOCH_OFFSET_DAYS for i in indexes],
+                                                        [tmin[i] for i in indexes], [tmax[i] for i in indexes])
+
+    def RecordTempsStream(self, request_iterator, context):
+        if self.spool:
+            # a message at a time, so each sees whether the spool holds rows by then
+            reply, offset = station_pb2.RecordTempsBatchReply(), 0
+            for request in request_iterator:
+                add_reply(reply, self._spool_records(request.records), offset)
+                offset += len(request.records)
+            return reply
+
+        def batches():
+            offset = 0
+            for request in request_iterator:
+                yield from self._record_batches(request.records, offset)
+                offset += len(request.records)
+        return self._write_batches(batches())
+
+    def RecordTempsColumnar(self, request, context):
+        if not columns_match(request):
+            return columns_mismatch_reply()
+        if self.spool:
+            return self._spool_columns(request)
+        return self._write_batches(self._column_batches(request))
+
     def StationMax(self, request, context):
         tmaxres =0
         try:
-            tmaxres = self.cass.execute(self.max_statement, (request.station,)).one()[0]
+            cached = self.max_cache.get(request.station) if self.max_cache else MISS
+            version = self.max_cache.version(request.station) if self.max_cache else 0
+            if cached is MISS:
+                tmaxres = self._max("StationMax", request.station)
+                if self.max_cache:
+                    self.max_cache.put(request.station, tmaxres, version)
+            else:
+                tmaxres = cached
             err = ""
-        except cassandra.Unavailable as e:
-            err = 'need '+ str(e.required_replicas) +' replicas, but only have '+str(e.alive_replicas)
-        except cassandra.cluster.NoHostAvailable as e:
-            for node, error in e.errors.items():
-                if isinstance(e, cassandra.Unavailable):
-                    err ='need '+ str(e.required_replicas) +' replicas, but only have '+str(e.alive_replicas)
-        except:
+        except Exception as e:
             print("Failed")
-            err= "Failed" + str(traceback.format_exc())
+            err = format_error(e)
         return station_pb2.StationMaxReply(tmax = tmaxres, error = err)
-           
-if __name__ == "__main__":
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4), options=(('grpc.so_reuseport', 0),))
-    station_pb2_grpc.add_StationServicer_to_server(StationServicer(), server)
+
+    def _cached_maxes(self, stations, reply):
+        # fills reply from the cache and returns the stations that still need a read,
+        # with the cache versions their reads have to be put back under
+        stations = list(dict.fromkeys(stations))
+        if not self.max_cache:
+            return stations, {}
+        misses, versions = [], {}
+        for station in stations:
+            tmax = self.max_cache.get(station)
+            if tmax is MISS:
+                misses.append(station)
+                versions[station] = self.max_cache.version(station)
+            elif tmax is not None:
+                reply.tmax[station] = tmax
+        return misses, versions
+
+    def _store_max(self, reply, station, tmax, version):
+        if isinstance(tmax, Exception):
+            reply.errors[station] = format_error(tmax)
+            return
+        if self.max_cache:
+            self.max_cache.put(station, tmax, version)
+        if tmax is not None:
+            reply.tmax[station] = tmax
+
+    def StationMaxMany(self, request, context):
+        reply = station_pb2.StationMaxManyReply()
+        misses, versions = self._cached_maxes(request.stations, reply)
+        if self._fans_out():
+            # every station's bucket reads go out together, MAX_IN_FLIGHT stations at a time
+            for start in range(0, len(misses), MAX_IN_FLIGHT):
+                chunk = misses[start:start + MAX_IN_FLIGHT]
+                results = self._gather_many("StationMaxMany", [self.buckets.max_steps(station) for station in chunk])
+                for station, tmax in zip(chunk, results):
+                    self._store_max(reply, station, tmax, versions.get(station))
+            return reply
+        # one partition read per station, all in flight together up to MAX_IN_FLIGHT
+        pending = deque()
+
+        def drain(limit):
+            while len(pending) > limit:
+                station, future = pending.popleft()
+                try:
+                    self._store_max(reply, station, self._max_from("StationMaxMany", station, future.result().current_rows), versions.get(station))
+                except Exception as e:
+                    self._store_max(reply, station, e, None)
+
+        for station in misses:
+            pending.append((station, self._read("StationMaxMany", self._max_query(), (station,))))
+            drain(MAX_IN_FLIGHT)
+        drain(0)
+        return reply
+
+    def _range_reads(self, request):
+        if not self.buckets:
+            return [self._read("StationRange", self._range_query(request))]
+        years = [r[0] for r in self._read("StationRange", self.buckets.years(request.station)).result()]
+        # every bucket's first page is requested up front; they are sent on in date order
+        return [self._read("StationRange", query) for query in self._range_queries(request, years)]
+
+    def StationRange(self, request, context):
+        try:
+            if self.series:
+                yield from series_pages(self._series("StationRange", request.station), request, request.fetch_size or self.fetch_size)
+                return
+            futures = self._range_reads(request)
+            if not futures:
+                yield range_page([])
+            for future in futures:
+                rows = future.result()
+                while True:
+                    yield range_page(rows.current_rows)
+                    if not rows.has_more_pages:
+                        break
+                    rows.fetch_next_page()
+        except Exception as e:
+            yield station_pb2.StationRangeReply(error = format_error(e))
+
+    def StationStats(self, request, context):
+        # two single-row reads with aggregates on; otherwise, or while the station's spread
+        # bounds predate the spread columns, the station's rows are scanned
+        try:
+            stats = None
+            if self.aggregates:
+                extremes = self._read("StationStats", self.aggregates.extremes_statement, (request.station,))
+                totals = self._read("StationStats", self.aggregates.totals_statement, (request.station,))
+                stats = spread_stats(extremes.result().one(), totals.result().one())
+            if stats is None and self.series:
+                stats = self._series("StationStats", request.station).spread_stats()
+            elif stats is None:
+                stats = scan_stats(self._scan("StationStats", request.station))
+            return stats_reply(stats)
+        except Exception as e:
+            return station_pb2.StationStatsReply(error = format_error(e))
+
+    def _sketch_quantiles(self, request, quantiles, rows):
+        tmin, tmax = self.sketches.merged(request.station, rows)
+        sketch = tmin if request.element == "tmin" else tmax
+        return quantiles_reply([sketch.quantile(q) for q in quantiles], sketch.count)
+
+    def _scan_quantiles(self, request, quantiles, rows):
+        column = 0 if request.element == "tmin" else 1
+        values = [r[column] for r in rows if r[column] is not None]
+        return quantiles_reply(exact_quantiles(values, quantiles), len(values))
+
+    def StationQuantiles(self, request, context):
+        # with sketches on, one small partition of per-process sketches is read and
+        # merged; otherwise the station's partition is scanned for exact answers
+        try:
+            quantiles = quantiles_asked(request)
+            if self.sketches:
+                rows = self._read("StationQuantiles", self.sketches.load_statement, (request.station,)).result()
+                return self._sketch_quantiles(request, quantiles, rows)
+            if self.series:
+                return quantiles_reply(*self._series("StationQuantiles", request.station).quantiles(request.element, quantiles))
+            rows = self._scan("StationQuantiles", request.station)
+            return self._scan_quantiles(request, quantiles, rows)
+        except Exception as e:
+            return station_pb2.StationQuantilesReply(error = format_error(e))
+
+    def TopStations(self, request, context):
+        # from the in-memory index when there is one; otherwise station_aggregates, a row
+        # per station, is read whole and ranked. Neither touches the readings
+        try:
+            k = top_k(request)
+            if self.top:
+                return top_reply(self.top.top(k))
+            if not self.aggregates:
+                raise ValueError("TopStations needs the server started with --aggregates")
+            return top_reply(ranked(self._station_tmaxes(), k))
+        except Exception as e:
+            return station_pb2.TopStationsReply(error = format_error(e))
+
+class AsyncStationServicer(StationServicer):
+    # same statements as StationServicer, but every Cassandra call is awaited instead of
+    # parking a worker thread, so one event loop can keep thousands of RPCs in flight
+    async def RecordTemps(self, request, context):
+        if self.write_behind:
+            try:
+                try:
+                    waiter = self.write_behind.submit(request, 0, count=False)
+                except BufferFull:
+                    # wait for room off the event loop
+                    waiter = await asyncio.get_running_loop().run_in_executor(
+                        None, self.write_behind.submit, request, WRITE_BLOCK)
+                err = await asyncio.wrap_future(waiter) if self.write_ack == "flush" else ""
+            except BufferFull as e:
+                err = format_error(e)
+            return station_pb2.RecordTempsReply(error = err)
+        if self.spool and self.spool.depth:
+            stored = await self._spool_async(request)
+            return station_pb2.RecordTempsReply(error = "" if stored else SPOOL_FULL)
+        try:
+            await as_asyncio(self.cass.execute_async(*self._single_write(request)))
+            if self.tracking:
+                summary = summarize([request.tmin], [request.tmax])
+                self._observe(request.station, summary)
+                self._observe_rows(request.station, [request.tmin], [request.tmax])
+                if self.aggregates:
+                    await self._run_steps(self.aggregates.merge_steps(request.station, summary, [(request.date, request.tmin, request.tmax)]))
+            err = ""
+        except Exception as e:
+            err = format_error(e)
+            if self.spool and isinstance(e, SPOOLED) and await self._spool_async(request):
+                err = ""
+        return station_pb2.RecordTempsReply(error = err)
+
+    async def _spool_async(self, request):
+        # the append waits for the disk, so it runs off the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, self.spool.append, [request.SerializeToString()])
+
+    async def _run_steps(self, steps):
+        try:
+            queries = next(steps)
+            while True:
+                queries = steps.send(await asyncio.gather(*(as_asyncio(self.cass.execute_async(statement, params))
+                                                            for statement, params in queries)))
+        except StopIteration:
+            pass
+
+    async def _write_batches_async(self, batches):
+        written = 0
+        errors = []
+        pending = deque()
+        summaries = {}
+        readings = {}
+
+        async def drain(limit):
+            nonlocal written
+            while len(pending) > limit:
+                future, indexes, summary = pending.popleft()
+                try:
+                    await future
+                    written += len(indexes)
+                    if summary:
+                        self._merge_summary(summaries, readings, summary)
+                except Exception as e:
+                    err = format_error(e)
+                    errors.extend(station_pb2.RecordError(index=i, error=err) for i in indexes)
+
+        async for batch, indexes, summary in batches:
+            if isinstance(batch, Exception):
+                errors.extend(station_pb2.RecordError(index=i, error=format_error(batch)) for i in indexes)
+                continue
+            pending.append((as_asyncio(self.cass.execute_async(batch)), indexes, summary))
+            await drain(MAX_IN_FLIGHT)
+        await drain(0)
+        for station, summary in summaries.items():
+            self._observe(station, summary)
+        results = await asyncio.gather(*(self._run_steps(self.aggregates.merge_steps(station, summary, readings[station]))
+                                         for station, summary in summaries.items() if self.aggregates), return_exceptions=True)
+        errors.extend(station_pb2.RecordError(index=-1, error=format_error(e))
+                      for e in results if isinstance(e, Exception))
+        return station_pb2.RecordTempsBatchReply(written = written, errors = errors)
+
+    async def _in_executor(self, fn, *args):
+        # a blocking write path (spool appends wait for the disk) off the event loop,
+        # still labelled with this RPC in the metrics
+        return await asyncio.get_running_loop().run_in_executor(None, contextvars.copy_context().run, fn, *args)
+
+    async def RecordTempsStream(self, request_iterator, context):
+        if self.spool:
+            reply, offset = station_pb2.RecordTempsBatchReply(), 0
+            async for request in request_iterator:
+                add_reply(reply, await self._in_executor(self._spool_records, request.records), offset)
+                offset += len(request.records)
+            return reply
+
+        async def batches():
+            offset = 0
+            async for request in request_iterator:
+                for batch in self._record_batches(request.records, offset):
+                    yield batch
+                offset += len(request.records)
+        return await self._write_batches_async(batches())
+
+    async def RecordTempsColumnar(self, request, context):
+        if not columns_match(request):
+            return columns_mismatch_reply()
+        if self.spool:
+            return await self._in_executor(self._spool_columns, request)
+
+        async def batches():
+            for batch in self._column_batches(request):
+                yield batch
+        return await self._write_batches_async(batches())
+
+    async def StationMax(self, request, context):
+        tmaxres =0
+        try:
+            cached = self.max_cache.get(request.station) if self.max_cache else MISS
+            version = self.max_cache.version(request.station) if self.max_cache else 0
+            if cached is MISS:
+                tmaxres = await self._max("StationMax", request.station)
+                if self.max_cache:
+                    self.max_cache.put(request.station, tmaxres, version)
+            else:
+                tmaxres = cached
+            err = ""
+        except Exception as e:
+            err = format_error(e)
+        return station_pb2.StationMaxReply(tmax = tmaxres, error = err)
+
+    async def StationMaxMany(self, request, context):
+        reply = station_pb2.StationMaxManyReply()
+        misses, versions = self._cached_maxes(request.stations, reply)
+        window = asyncio.Semaphore(MAX_IN_FLIGHT)
+
+        async def read(station):
+            async with window:
+                return await self._max("StationMaxMany", station)
+
+        results = await asyncio.gather(*(read(s) for s in misses), return_exceptions=True)
+        for station, result in zip(misses, results):
+            self._store_max(reply, station, result, versions.get(station))
+        return reply
+
+    async def _max(self, rpc, station):
+        if self._fans_out():
+            return await self._gather(rpc, self.buckets.max_steps(station))
+        return await self._max_from(rpc, station, await as_asyncio(self._read(rpc, self._max_query(), (station,))))
+
+    async def _max_from(self, rpc, station, rows):
+        if self.aggregates and rows and rows[0][0] is None:
+            return await self._readings_max(rpc, station)
+        return max_value(rows)
+
+    async def _readings_max(self, rpc, station):
+        if self.buckets:
+            return await self._gather(rpc, self.buckets.max_steps(station))
+        return max_value(await as_asyncio(self._read(rpc, self.max_statement, (station,))))
+
+    async def _gather(self, rpc, steps):
+        try:
+            queries = next(steps)
+            while True:
+                queries = steps.send(await asyncio.gather(*(self._fetch_all(rpc, statement, params) for statement, params in queries)))
+        except StopIteration as done:
+            return done.value
+
+    async def _scan(self, rpc, station):
+        if self.buckets:
+            return await self._gather(rpc, self.buckets.scan_steps(station))
+        return await self._fetch_all(rpc, self.spread_statement, (station,))
+
+    async def _series(self, rpc, station):
+        series = self.series.get(station)
+        if series is MISS:
+            version = self.series.version(station)
+            if self.buckets:
+                rows = await self._gather(rpc, self.buckets.series_steps(station))
+            else:
+                rows = await self._fetch_all(rpc, self.series_statement, (station,))
+            series = Series.from_rows(rows)
+            self.series.put(station, series, version)
+        return series
+
+    async def StationRange(self, request, context):
+        try:
+            if self.series:
+                for page in series_pages(await self._series("StationRange", request.station), request, request.fetch_size or self.fetch_size):
+                    yield page
+                return
+            if self.buckets:
+                years = [r[0] for r in await self._fetch_all("StationRange", self.buckets.years(request.station), None)]
+                futures = [self._read("StationRange", query) for query in self._range_queries(request, years)]
+            else:
+                futures = [self._read("StationRange", self._range_query(request))]
+            if not futures:
+                yield range_page([])
+            queues = [pages_asyncio(future) for future in futures]
+            for future, pages in zip(futures, queues):
+                while True:
+                    rows, e = await pages.get()
+                    if e is not None:
+                        raise e
+                    more = future.has_more_pages
+                    if more:
+                        # overlap the next page's read with sending this one
+                        future.start_fetching_next_page()
+                    yield range_page(rows)
+                    if not more:
+                        break
+        except Exception as e:
+            yield station_pb2.StationRangeReply(error = format_error(e))
+
+    async def StationStats(self, request, context):
+        try:
+            stats = None
+            if self.aggregates:
+                extremes, totals = await asyncio.gather(
+                    as_asyncio(self._read("StationStats", self.aggregates.extremes_statement, (request.station,))),
+                    as_asyncio(self._read("StationStats", self.aggregates.totals_statement, (request.station,))))
+                stats = spread_stats(extremes[0] if extremes else None, totals[0] if totals else None)
+            if stats is None and self.series:
+                stats = (await self._series("StationStats", request.station)).spread_stats()
+            elif stats is None:
+                stats = scan_stats(await self._scan("StationStats", request.station))
+            return stats_reply(stats)
+        except Exception as e:
+            return station_pb2.StationStatsReply(error = format_error(e))
+
+    async def _fetch_all(self, rpc, statement, params):
+        # every page of a query, as one list
+        future = self._read(rpc, statement, params)
+        pages = pages_asyncio(future)
+        rows = []
+        while True:
+            page, e = await pages.get()
+            if e is not None:
+                raise e
+            rows.extend(page)
+            if not future.has_more_pages:
+                return rows
+            future.start_fetching_next_page()
+
+    async def StationQuantiles(self, request, context):
+        try:
+            quantiles = quantiles_asked(request)
+            if self.sketches:
+                rows = await self._fetch_all("StationQuantiles", self.sketches.load_statement, (request.station,))
+                return self._sketch_quantiles(request, quantiles, rows)
+            if self.series:
+                return quantiles_reply(*(await self._series("StationQuantiles", request.station)).quantiles(request.element, quantiles))
+            rows = await self._scan("StationQuantiles", request.station)
+            return self._scan_quantiles(request, quantiles, rows)
+        except Exception as e:
+            return station_pb2.StationQuantilesReply(error = format_error(e))
+
+    async def TopStations(self, request, context):
+        if self.top or not self.aggregates:
+            # nothing to wait for
+            return super().TopStations(request, context)
+        try:
+            rows = await self._fetch_all("TopStations", self.aggregates.tmaxes_statement, None)
+            unknown = [r.id for r in rows if r.tmax is None]
+            maxes = dict(zip(unknown, await asyncio.gather(*(self._readings_max("TopStations", s) for s in unknown))))
+            return top_reply(ranked([(r.id, maxes[r.id] if r.tmax is None else r.tmax) for r in rows], top_k(request)))
+        except Exception as e:
+            return station_pb2.TopStationsReply(error = format_error(e))
+
+def serve(metrics_port=0, reuseport=False, grace=GRACE, **options):
+    interceptors = []
+    limiter = options.get("limiter")
+    if metrics_port:
+        serve_metrics(metrics_port)
+        interceptors.append(MetricsInterceptor())
+        options["metrics"] = REGISTRY
+        if limiter:
+            REGISTRY.collect(limiter.stats)
+    workers = 4
+    if limiter:
+        # the limiter decides how many run at once and is the only thing that rejects
+        # calls; gRPC has no cap of its own, since what it turned away would never reach
+        # the limiter or its metrics. The pool has room past the limit's ceiling for the
+        # calls being turned away, which take no time
+        interceptors.append(LimitInterceptor(limiter))
+        workers = 2 * limiter.max_limit
+    # reuseport lets several processes listen on 5440 at once (see supervisor.py)
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers), interceptors=interceptors,
+                         options=(('grpc.so_reuseport', int(reuseport)),))
+    servicer = StationServicer(**options)
+    station_pb2_grpc.add_StationServicer_to_server(servicer, server)
     server.add_insecure_port('0.0.0.0:5440')
+    # SIGTERM stops taking new calls and lets the ones in flight finish
+    signal.signal(signal.SIGTERM, lambda *_: server.stop(grace))
     print("Started", flush = True)
     server.start()
-    server.wait_for_termination()
\ No newline at end of file
+    server.wait_for_termination()
+    servicer.close()
+
+async def serve_aio(metrics_port=0, reuseport=False, grace=GRACE, **options):
+    interceptors = []
+    limiter = options.get("limiter")
+    if metrics_port:
+        serve_metrics(metrics_port)
+        interceptors.append(AsyncMetricsInterceptor())
+        options["metrics"] = REGISTRY
+        if limiter:
+            REGISTRY.collect(limiter.stats)
+    if limiter:
+        interceptors.append(AsyncLimitInterceptor(limiter))
+    server = grpc.aio.server(interceptors=interceptors, options=(('grpc.so_reuseport', int(reuseport)),))
+    servicer = AsyncStationServicer(**options)
+    station_pb2_grpc.add_StationServicer_to_server(servicer, server)
+    server.add_insecure_port('0.0.0.0:5440')
+    await server.start()
+    stopping = []  # holds the stop task so it isn't collected before it finishes
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: stopping.append(asyncio.ensure_future(server.stop(grace))))
+    print("Started", flush = True)
+    await server.wait_for_termination()
+    servicer.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["thread", "aio"], default="thread",
+                        help="thread: blocking servicer on a worker pool; aio: grpc.aio on one event loop")
+    parser.add_argument("--aggregates", action="store_true",
+                        help="maintain station_aggregates on write and serve StationMax from it")
+    parser.add_argument("--backfill-aggregates", action="store_true",
+                        help="rebuild station_aggregates from the stations table, then exit")
+    parser.add_argument("--cache-entries", type=int, default=0,
+                        help="cache StationMax for up to this many stations (0 disables the cache)")
+    parser.add_argument("--cache-ttl", type=float, default=30.0,
+                        help="seconds a cached StationMax stays valid")
+    parser.add_argument("--fetch-size", type=int, default=RANGE_FETCH_SIZE,
+                        help="rows per driver page for StationRange")
+    parser.add_argument("--latency-aware", action="store_true",
+                        help="prefer the faster replicas on top of token-aware routing")
+    parser.add_argument("--hedge-delay", type=float, default=None,
+                        help="seconds before an idempotent read is also sent to another coordinator (off by default); "
+                             "it can't hide a slow replica from StationMax, which reads at THREE")
+    parser.add_argument("--hedge-attempts", type=int, default=1,
+                        help="extra copies of a read the hedge may send")
+    parser.add_argument("--backend", choices=["cassandra", "memory"], default="cassandra",
+                        help="memory runs against an in-process stand-in instead of the p6-db-* cluster")
+    parser.add_argument("--backend-latency", type=float, default=0.0,
+                        help="seconds each memory backend call takes")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="serve per-RPC latency, in-flight and error metrics on http://localhost:PORT/metrics")
+    parser.add_argument("--write-behind", type=int, default=0,
+                        help="queue up to this many RecordTemps rows and write them in background batches (0 writes inline)")
+    parser.add_argument("--write-ack", choices=["flush", "enqueue"], default="flush",
+                        help="with --write-behind, reply once the row is written or as soon as it is queued")
+    parser.add_argument("--write-linger", type=float, default=0.002,
+                        help="seconds the write-behind flusher waits for more rows before writing")
+    parser.add_argument("--adaptive-limit", action="store_true",
+                        help="cap RPCs in flight by observed Cassandra latency and reject the excess with RESOURCE_EXHAUSTED")
+    parser.add_argument("--limit-initial", type=int, default=16, help="starting in-flight limit")
+    parser.add_argument("--limit-min", type=int, default=4, help="the limit never drops below this")
+    parser.add_argument("--limit-max", type=int, default=256, help="the limit never grows past this")
+    parser.add_argument("--sketches", action="store_true",
+                        help="keep per-station quantile sketches on write and serve StationQuantiles from them "
+                             "(they cover writes from then on; existing readings aren't backfilled)")
+    parser.add_argument("--sketch-interval", type=float, default=PERSIST_INTERVAL,
+                        help="seconds between writes of this process's sketches to station_sketches")
+    parser.add_argument("--worker-index", type=int, default=0,
+                        help="this process's index among supervisor.py's workers (set by it); keys its station_sketches row")
+    parser.add_argument("--reuseport", action="store_true",
+                        help="share port 5440 with other server processes (set by supervisor.py)")
+    parser.add_argument("--grace", type=float, default=GRACE,
+                        help="seconds in-flight RPCs get to finish after SIGTERM")
+    parser.add_argument("--layout", choices=["flat", "bucketed"], default="flat",
+                        help="bucketed stores readings in stations_by_year, one partition per station and year (copy old data with buckets.py)")
+    parser.add_argument("--top-stations", type=int, default=0,
+                        help="keep the hottest this many stations in memory for TopStations (needs --aggregates)")
+    parser.add_argument("--top-refresh", type=float, default=REFRESH_INTERVAL,
+                        help="seconds between reloads of the top stations from station_aggregates")
+    parser.add_argument("--spool", default=None, metavar="DIR",
+                        help="spool RecordTemps rows Cassandra rejects as Unavailable in DIR and replay them later")
+    parser.add_argument("--spool-bytes", type=int, default=SPOOL_BYTES, help="disk the spool may use")
+    parser.add_argument("--series-cache-mb", type=float, default=0,
+                        help="keep recently read station series in this much memory for StationRange/Stats/Quantiles")
+    parser.add_argument("--series-ttl", type=float, default=30.0,
+                        help="seconds a cached series may miss other processes' writes")
+    args = parser.parse_args()
+    if args.top_stations and not args.aggregates:
+        parser.error("--top-stations needs --aggregates")
+    if args.backend == "memory":
+        backend = MemoryBackend(latency=args.backend_latency)
+    else:
+        backend = None
+    options = dict(backend=backend, aggregates=args.aggregates, cache_entries=args.cache_entries, cache_ttl=args.cache_ttl,
+                   fetch_size=args.fetch_size, latency_aware=args.latency_aware,
+                   hedge_delay=args.hedge_delay, hedge_attempts=args.hedge_attempts,
+                   write_behind=args.write_behind, write_ack=args.write_ack, write_linger=args.write_linger,
+                   sketches=args.sketches, sketch_interval=args.sketch_interval, layout=args.layout,
+                   top_stations=args.top_stations, top_refresh=args.top_refresh,
+                   spool=args.spool, spool_bytes=args.spool_bytes,
+                   series_cache=int(args.series_cache_mb * 1024 * 1024), series_ttl=args.series_ttl, worker_index=args.worker_index,
+                   limiter=GradientLimiter(args.limit_initial, args.limit_min, args.limit_max) if args.adaptive_limit else None)
+    serve_options = dict(options, metrics_port=args.metrics_port, reuseport=args.reuseport, grace=args.grace)
+    if args.backfill_aggregates:
+        n = StationServicer(**dict(options, aggregates=True)).aggregates.backfill()
+        print("Backfilled", n, "stations", flush = True)
+    elif args.mode == "aio":
+        asyncio.run(serve_aio(**serve_options))
+    else:
+        serve(**serve_options)
+
@@ -0,0 +1,186 @@
+from cassandra import ConsistencyLevel
+import math
+import socket
+import struct
+import threading
+
+CREATE_SKETCHES = """CREATE TABLE IF NOT EXISTS station_sketches (id text, writer text, tmin blob, tmax blob, PRIMARY KEY (id, writer))"""
+RELATIVE_ACCURACY = 0.01
+PERSIST_INTERVAL = 5.0
+
+class DDSketch:
+    # quantile sketch with bounded relative error (Masson et al., DDSketch, VLDB 2019).
+    # |x| goes in bucket k where gamma**(k-1) < |x| <= gamma**k, gamma = (1+a)/(1-a), and a
+    # bucket reads back as the value within a of everything in it. Negatives mirror the
+    # positives and zeros get their own count. Two sketches with the same accuracy merge
+    # by adding bucket counts, so the result is the sketch of both inputs together
+    def __init__(self, alpha=RELATIVE_ACCURACY):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero = 0
+        self.count = 0
+
+    def key(self, x):
+        return math.ceil(math.log(x) / self.log_gamma)
+
+    def value(self, k):
+        return 2 * self.gamma ** k / (self.gamma + 1)
+
+    def add(self, x, n=1):
+        if x > 0:
+            k = self.key(x)
+            self.positive[k] = self.positive.get(k, 0) + n
+        elif x < 0:
+            k = self.key(-x)
+            self.negative[k] = self.negative.get(k, 0) + n
+        else:
+            self.zero += n
+        self.count += n
+
+    def merge(self, other):
+        if other.alpha != self.alpha:
+            raise ValueError("can't merge sketches with relative accuracy %s and %s" % (self.alpha, other.alpha))
+        for mine, theirs in ((self.positive, other.positive), (self.negative, other.negative)):
+            for k, n in theirs.items():
+                mine[k] = mine.get(k, 0) + n
+        self.zero += other.zero
+        self.count += other.count
+        return self
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        # walk from the most negative bucket up to the most positive
+        for k in sorted(self.negative, reverse=True):
+            seen += self.negative[k]
+            if seen > rank:
+                return -self.value(k)
+        seen += self.zero
+        if seen > rank:
+            return 0.0
+        for k in sorted(self.positive):
+            seen += self.positive[k]
+            if seen > rank:
+                return self.value(k)
+        return self.value(max(self.positive))
+
+    def to_bytes(self):
+        # alpha, zero count and bucket counts, then each store's keys and counts
+        parts = [struct.pack('<dQII', self.alpha, self.zero, len(self.positive), len(self.negative))]
+        for store in (self.positive, self.negative):
+            keys = sorted(store)
+            parts.append(struct.pack('<%di%dQ' % (len(keys), len(keys)), *keys, *(store[k] for k in keys)))
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        alpha, zero, npos, nneg = struct.unpack_from('<dQII', data)
+        sketch = cls(alpha)
+        offset = struct.calcsize('<dQII')
+        for store, n in ((sketch.positive, npos), (sketch.negative, nneg)):
+            fields = struct.unpack_from('<%di%dQ' % (n, n), data, offset)
+            store.update(zip(fields[:n], fields[n:]))
+            offset += struct.calcsize('<%di%dQ' % (n, n))
+        sketch.zero = zero
+        sketch.count = zero + sum(sketch.positive.values()) + sum(sketch.negative.values())
+        return sketch
+
+def exact_quantiles(values, quantiles):
+    # the same rank convention as DDSketch.quantile, for answering from a full scan
+    ordered = sorted(values)
+    if not ordered:
+        return [None for q in quantiles]
+    return [float(ordered[int(q * (len(ordered) - 1))]) for q in quantiles]
+
+class StationSketches:
+    # a tmin and a tmax sketch per station, fed by this process's writes. Every process
+    # writes its own sketches as one row of station_sketches, so nobody overwrites anyone
+    # else; readers merge all the writers' rows. writer is stable across restarts (the
+    # host, plus the worker index under supervisor.py), and a process starts from what
+    # its writer saved last, so restarts don't add rows. Rows are written every interval
+    # seconds from a background thread, so a crash loses at most that much of this
+    # process's sketch. Only writes made with sketches on are counted: readings already
+    # in the stations table aren't in any sketch
+    def __init__(self, cass, alpha=RELATIVE_ACCURACY, interval=PERSIST_INTERVAL, writer=None):
+        self.cass = cass
+        self.alpha = alpha
+        self.interval = interval
+        self.writer = writer or socket.gethostname()
+        cass.execute(CREATE_SKETCHES)
+        self.save_statement = cass.prepare("""INSERT INTO station_sketches (id, writer, tmin, tmax) VALUES(?,?,?,?)""")
+        self.save_statement.consistency_level = ConsistencyLevel.ONE
+        self.load_statement = cass.prepare("""SELECT writer, tmin, tmax FROM station_sketches WHERE id = ?""")
+        self.load_statement.consistency_level = ConsistencyLevel.ONE
+        self.load_statement.is_idempotent = True
+        self.lock = threading.Lock()
+        self.sketches = {}
+        self.dirty = set()
+        # writer is a clustering column, so finding its rows means reading them all; that
+        # happens once, here
+        for row in cass.execute("""SELECT id, writer, tmin, tmax FROM station_sketches"""):
+            if row.writer == self.writer:
+                self.sketches[row.id] = (DDSketch.from_bytes(row.tmin) if row.tmin else DDSketch(alpha),
+                                         DDSketch.from_bytes(row.tmax) if row.tmax else DDSketch(alpha))
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="sketch-persist", daemon=True)
+        self.thread.start()
+
+    def add(self, station, tmins, tmaxs):
+        with self.lock:
+            pair = self.sketches.get(station)
+            if pair is None:
+                pair = self.sketches[station] = (DDSketch(self.alpha), DDSketch(self.alpha))
+            for v in tmins:
+                pair[0].add(v)
+            for v in tmaxs:
+                pair[1].add(v)
+            self.dirty.add(station)
+
+    def merged(self, station, rows):
+        # this process's sketch plus every other writer's persisted row; our own row is
+        # older than what we hold in memory, so it is skipped
+        tmin, tmax = DDSketch(self.alpha), DDSketch(self.alpha)
+        with self.lock:
+            pair = self.sketches.get(station)
+            if pair:
+                tmin.merge(pair[0])
+                tmax.merge(pair[1])
+        for row in rows:
+            if row.writer == self.writer:
+                continue
+            if row.tmin:
+                tmin.merge(DDSketch.from_bytes(row.tmin))
+            if row.tmax:
+                tmax.merge(DDSketch.from_bytes(row.tmax))
+        return tmin, tmax
+
+    def persist(self):
+        with self.lock:
+            stations, self.dirty = self.dirty, set()
+            blobs = [(s, self.writer, self.sketches[s][0].to_bytes(), self.sketches[s][1].to_bytes()) for s in stations]
+        futures = [(params[0], self.cass.execute_async(self.save_statement, params)) for params in blobs]
+        for station, future in futures:
+            try:
+                future.result()
+            except Exception:
+                # try again next round
+                with self.lock:
+                    self.dirty.add(station)
+        return len(blobs)
+
+    def run(self):
+        while not self.stop.wait(self.interval):
+            self.persist()
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+        self.persist()
+
+    def stats(self):
+        return {"stations": len(self.sketches), "dirty": len(self.dirty)}
@@ -0,0 +1,268 @@
+from itertools import islice
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+SEGMENT_BYTES = 64 * 1024 * 1024
+MAX_BYTES = 1024 * 1024 * 1024
+REPLAY_ROWS = 500
+RETRY_DELAY = 0.1
+MAX_RETRY_DELAY = 5.0
+# each entry is (payload length, crc32 of payload) then the payload. A zero length is
+# the unwritten rest of a segment, and a bad crc a write the process died in the middle of
+HEADER = struct.Struct('<II')
+CURSOR = 'cursor'
+LOCK = 'lock'
+
+def segment_name(seq):
+    return '%016d.spool' % seq
+
+def entries(buf, offset, end):
+    # (payload, offset after it) for each intact entry of buf[offset:end]
+    while offset + HEADER.size <= end:
+        length, crc = HEADER.unpack_from(buf, offset)
+        start = offset + HEADER.size
+        if length == 0 or start + length > end:
+            return
+        payload = bytes(buf[start:start + length])
+        if zlib.crc32(payload) != crc:
+            return
+        offset = start + length
+        yield payload, offset
+
+class Segment:
+    # one spool file, mapped whole; size preallocates a new one. end is how far this
+    # process has appended to it
+    def __init__(self, path, size=0):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        if size:
+            os.ftruncate(self.fd, size)
+            os.fsync(self.fd)
+        self.size = os.fstat(self.fd).st_size
+        # a file the process died creating may still be empty, and mmap can't map that
+        self.map = mmap.mmap(self.fd, self.size) if self.size else b''
+        self.end = 0
+
+    def flush(self):
+        if self.size:
+            self.map.flush()
+
+    def close(self):
+        if self.size:
+            self.map.close()
+        os.close(self.fd)
+
+class Spool:
+    # append-only local log of writes Cassandra couldn't take.
+    # append() copies payloads into the current mmap'd segment and returns once they are
+    # on disk. One msync covers every append made before it started (group commit), so
+    # a burst of appends shares a single flush.
+    # A replayer thread reads entries oldest first, replay_rows at a time, and passes
+    # them to write(payloads). write returns (indexes to try again later, number of rows
+    # dropped for good). Retries back off up to MAX_RETRY_DELAY, so the replayer adds
+    # little load to a cluster that is still short of replicas.
+    # The cursor file records how far replay has got. Segments behind it are deleted,
+    # and a restart resumes from it
+    def __init__(self, directory, write, segment_bytes=SEGMENT_BYTES, max_bytes=MAX_BYTES, replay_rows=REPLAY_ROWS):
+        self.directory = directory
+        self.write = write
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.replay_rows = replay_rows
+        os.makedirs(directory, exist_ok=True)
+        # two processes appending to one spool would corrupt it
+        self.lock_file = open(os.path.join(directory, LOCK), 'w')
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self.lock_file.close()
+            raise RuntimeError("spool %s is in use by another process" % directory)
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.sync_lock = threading.Lock()
+        self.appended = 0
+        self.synced = 0
+        self.replayed = 0
+        self.dropped = 0
+        self.retries = 0
+        self.rejected = 0
+        self.closed = False
+
+        # segments left by an earlier run are only read now; appends get a new one
+        self.sequence = sorted(int(name.split('.')[0]) for name in os.listdir(directory) if name.endswith('.spool'))
+        self.cursor = self.load_cursor()
+        self.depth = 0
+        for seq in self.sequence:
+            if seq >= self.cursor[0]:
+                segment = Segment(self.path(seq))
+                start = self.cursor[1] if seq == self.cursor[0] else 0
+                self.depth += sum(1 for _ in entries(segment.map, start, segment.size))
+                segment.close()
+        self.current = None
+        # segments appends have moved on from, left for the next sync to flush and close
+        self.retired = []
+        self.roll()
+
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="spool-replay", daemon=True)
+        self.thread.start()
+
+    def path(self, seq):
+        return os.path.join(self.directory, segment_name(seq))
+
+    def load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, CURSOR)) as f:
+                seq, offset = f.read().split()
+                return int(seq), int(offset)
+        except (OSError, ValueError):
+            return (self.sequence[0] if self.sequence else 0, 0)
+
+    def save_cursor(self, seq, offset):
+        path = os.path.join(self.directory, CURSOR)
+        with open(path + '.tmp', 'w') as f:
+            f.write('%d %d' % (seq, offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def roll(self):
+        # starts a new segment for appends; called with the lock held, or from __init__
+        if self.current:
+            self.retired.append(self.current)
+        seq = self.sequence[-1] + 1 if self.sequence else 1
+        self.current = Segment(self.path(seq), self.segment_bytes)
+        self.sequence.append(seq)
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def append(self, payloads):
+        # returns how many of payloads (from the front) are now on disk; the rest didn't
+        # fit under max_bytes, or the spool is closed
+        stored = 0
+        with self.lock:
+            for payload in payloads:
+                size = HEADER.size + len(payload)
+                if self.closed or size > self.segment_bytes:
+                    break
+                if self.current.end + size > self.current.size:
+                    # segments are preallocated, so this is what the spool takes on disk
+                    if (len(self.sequence) + 1) * self.segment_bytes > self.max_bytes:
+                        break
+                    self.roll()
+                segment, offset = self.current, self.current.end
+                segment.map[offset + HEADER.size:offset + size] = payload
+                HEADER.pack_into(segment.map, offset, len(payload), zlib.crc32(payload))
+                segment.end += size
+                stored += 1
+            self.appended += stored
+            self.depth += stored
+            self.rejected += len(payloads) - stored
+            ticket = self.appended
+            if stored:
+                self.not_empty.notify()
+        if stored:
+            self.sync(ticket)
+        return stored
+
+    def sync(self, ticket):
+        # whoever holds sync_lock flushes everything appended so far. The appends that
+        # queued behind it find their ticket covered and return without flushing again
+        with self.sync_lock:
+            if self.synced >= ticket:
+                return
+            with self.lock:
+                upto = self.appended
+                segments, self.retired = self.retired + [self.current], []
+            for segment in segments:
+                segment.flush()
+            for segment in segments[:-1]:
+                segment.close()
+            self.synced = upto
+
+    def read(self):
+        # up to replay_rows payloads from the cursor, and where the cursor goes after them
+        seq, offset = self.cursor
+        with self.lock:
+            if seq == self.sequence[-1]:
+                # the segment appends go to: only what has been written so far
+                batch = list(islice(entries(self.current.map, offset, self.current.end), self.replay_rows))
+                return [p for p, o in batch], ((seq, batch[-1][1]) if batch else self.cursor)
+            following = min(s for s in self.sequence if s > seq)
+            if seq not in self.sequence:
+                return [], (following, 0)
+        segment = Segment(self.path(seq))
+        try:
+            batch = list(islice(entries(segment.map, offset, segment.size), self.replay_rows))
+        finally:
+            segment.close()
+        if len(batch) < self.replay_rows:
+            # that was the rest of a finished segment
+            return [p for p, o in batch], (following, 0)
+        return [p for p, o in batch], (seq, batch[-1][1])
+
+    def advance(self, cursor, rows):
+        # replay got to cursor: record it, then delete the segments wholly behind it
+        self.save_cursor(*cursor)
+        with self.lock:
+            self.cursor = cursor
+            self.depth -= rows
+            self.replayed += rows
+            done = [s for s in self.sequence if s < cursor[0]]
+            self.sequence = [s for s in self.sequence if s >= cursor[0]]
+        for seq in done:
+            os.remove(self.path(seq))
+
+    def run(self):
+        delay = RETRY_DELAY
+        while not self.stop.is_set():
+            with self.lock:
+                # nothing to replay, but the cursor may still have segments to move past
+                while not self.depth and self.cursor[0] == self.sequence[-1] and not self.stop.is_set():
+                    self.not_empty.wait(1.0)
+            payloads, cursor = self.read()
+            if not payloads:
+                if cursor != self.cursor:
+                    self.advance(cursor, 0)
+                continue
+            todo = list(range(len(payloads)))
+            while todo and not self.stop.is_set():
+                try:
+                    retry, dropped = self.write([payloads[i] for i in todo])
+                except Exception:
+                    retry, dropped = range(len(todo)), 0
+                self.dropped += dropped
+                todo = [todo[i] for i in retry]
+                if todo:
+                    self.retries += 1
+                    self.stop.wait(delay)
+                    delay = min(delay * 2, MAX_RETRY_DELAY)
+            if not todo:
+                delay = RETRY_DELAY
+                self.advance(cursor, len(payloads))
+
+    def close(self):
+        # stops replaying; whatever is left stays on disk for the next start
+        with self.lock:
+            self.closed = True
+            self.stop.set()
+            self.not_empty.notify_all()
+        self.thread.join()
+        with self.sync_lock, self.lock:
+            for segment in self.retired + [self.current]:
+                segment.flush()
+                segment.close()
+            self.retired = []
+        self.lock_file.close()
+
+    def stats(self):
+        return {"depth": self.depth, "segments": len(self.sequence), "appended": self.appended,
+                "replayed": self.replayed, "dropped": self.dropped, "retries": self.retries,
+                "rejected": self.rejected}
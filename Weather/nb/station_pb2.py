@@ -13,7 +13,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\rstation.proto\"O\n\x12RecordTempsRequest\x12\x0f\n\x07station\x18\x01 \x01(\t\x12\x0c\n\x04\x64\x61te\x18\x02 \x01(\t\x12\x0c\n\x04tmin\x18\x03 \x01(\x05\x12\x0c\n\x04tmax\x18\x04 \x01(\x05\"!\n\x10RecordTempsReply\x12\r\n\x05\x65rror\x18\x01 \x01(\t\"$\n\x11StationMaxRequest\x12\x0f\n\x07station\x18\x01 \x01(\t\".\n\x0fStationMaxReply\x12\x0c\n\x04tmax\x18\x01 \x01(\x05\x12\r\n\x05\x65rror\x18\x02 \x01(\t2x\n\x07Station\x12\x37\n\x0bRecordTemps\x12\x13.RecordTempsRequest\x1a\x11.RecordTempsReply\"\x00\x12\x34\n\nStationMax\x12\x12.StationMaxRequest\x1a\x10.StationMaxReply\"\x00\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\rstation.proto\"O\n\x12RecordTempsRequest\x12\x0f\n\x07station\x18\x01 \x01(\t\x12\x0c\n\x04\x64\x61te\x18\x02 \x01(\t\x12\x0c\n\x04tmin\x18\x03 \x01(\x05\x12\x0c\n\x04tmax\x18\x04 \x01(\x05\"!\n\x10RecordTempsReply\x12\r\n\x05\x65rror\x18\x01 \x01(\t\"8\n\x10RecordTempsBatch\x12$\n\x07records\x18\x01 \x03(\x0b\x32\x13.RecordTempsRequest\"O\n\x12RecordTempsColumns\x12\x0f\n\x07station\x18\x01 \x01(\t\x12\x0c\n\x04\x64\x61ys\x18\x02 \x03(\x11\x12\x0c\n\x04tmin\x18\x03 \x03(\x11\x12\x0c\n\x04tmax\x18\x04 \x03(\x11\"+\n\x0bRecordError\x12\r\n\x05index\x18\x01 \x01(\x05\x12\r\n\x05\x65rror\x18\x02 \x01(\t\"F\n\x15RecordTempsBatchReply\x12\x0f\n\x07written\x18\x01 \x01(\x05\x12\x1c\n\x06\x65rrors\x18\x02 \x03(\x0b\x32\x0c.RecordError\"$\n\x11StationMaxRequest\x12\x0f\n\x07station\x18\x01 \x01(\t\".\n\x0fStationMaxReply\x12\x0c\n\x04tmax\x18\x01 \x01(\x05\x12\r\n\x05\x65rror\x18\x02 \x01(\t\")\n\x15StationMaxManyRequest\x12\x10\n\x08stations\x18\x01 \x03(\t\"\xd1\x01\n\x13StationMaxManyReply\x12,\n\x04tmax\x18\x01 \x03(\x0b\x32\x1e.StationMaxManyReply.TmaxEntry\x12\x30\n\x06\x65rrors\x18\x02 \x03(\x0b\x32 .StationMaxManyReply.ErrorsEntry\x1a+\n\tTmaxEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\x05:\x02\x38\x01\x1a-\n\x0b\x45rrorsEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\t:\x02\x38\x01\"V\n\x13StationRangeRequest\x12\x0f\n\x07station\x18\x01 \x01(\t\x12\r\n\x05start\x18\x02 \x01(\t\x12\x0b\n\x03\x65nd\x18\x03 \x01(\t\x12\x12\n\nfetch_size\x18\x04 \x01(\x05\"L\n\x11StationRangeReply\x12\x0c\n\x04\x64\x61ys\x18\x01 \x03(\x11\x12\x0c\n\x04tmin\x18\x02 \x03(\x11\x12\x0c\n\x04tmax\x18\x03 \x03(\x11\x12\r\n\x05\x65rror\x18\x04 \x01(\t\"&\n\x13StationStatsRequest\x12\x0f\n\x07station\x18\x01 \x01(\t\"n\n\x11StationStatsReply\x12\r\n\x05\x63ount\x18\x01 \x01(\x05\x12\x13\n\x0bmean_spread\x18\x02 \x01(\x01\x12\x12\n\nmin_spread\x18\x03 \x01(\x05\x12\x12\n\nmax_spread\x18\x04 \x01(\x05\x12\r\n\x05\x65rror\x18\x05 \x01(\t\"N\n\x17StationQuantilesRequest\x12\x0f\n\x07station\x18\x01 \x01(\t\x12\x0f\n\x07\x65lement\x18\x02 \x01(\t\x12\x11\n\tquantiles\x18\x03 \x03(\x01\"E\n\x15StationQuantilesReply\x12\x0e\n\x06values\x18\x01 \x03(\x01\x12\r\n\x05\x63ount\x18\x02 \x01(\x03\x12\r\n\x05\x65rror\x18\x03 \x01(\t\"\x1f\n\x12TopStationsRequest\x12\t\n\x01k\x18\x01 \x01(\x05\"A\n\x10TopStationsReply\x12\x10\n\x08stations\x18\x01 \x03(\t\x12\x0c\n\x04tmax\x18\x02 \x03(\x05\x12\r\n\x05\x65rror\x18\x03 \x01(\t2\xbf\x04\n\x07Station\x12\x37\n\x0bRecordTemps\x12\x13.RecordTempsRequest\x1a\x11.RecordTempsReply\"\x00\x12\x42\n\x11RecordTempsStream\x12\x11.RecordTempsBatch\x1a\x16.RecordTempsBatchReply\"\x00(\x01\x12\x44\n\x13RecordTempsColumnar\x12\x13.RecordTempsColumns\x1a\x16.RecordTempsBatchReply\"\x00\x12\x34\n\nStationMax\x12\x12.StationMaxRequest\x1a\x10.StationMaxReply\"\x00\x12@\n\x0eStationMaxMany\x12\x16.StationMaxManyRequest\x1a\x14.StationMaxManyReply\"\x00\x12<\n\x0cStationRange\x12\x14.StationRangeRequest\x1a\x12.StationRangeReply\"\x00\x30\x01\x12:\n\x0cStationStats\x12\x14.StationStatsRequest\x1a\x12.StationStatsReply\"\x00\x12\x46\n\x10StationQuantiles\x12\x18.StationQuantilesRequest\x1a\x16.StationQuantilesReply\"\x00\x12\x37\n\x0bTopStations\x12\x13.TopStationsRequest\x1a\x11.TopStationsReply\"\x00\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -21,14 +21,50 @@ _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'station_pb2', _globals)
 if _descriptor._USE_C_DESCRIPTORS == False:
 
   DESCRIPTOR._options = None
+  _STATIONMAXMANYREPLY_TMAXENTRY._options = None
+  _STATIONMAXMANYREPLY_TMAXENTRY._serialized_options = b'8\001'
+  _STATIONMAXMANYREPLY_ERRORSENTRY._options = None
+  _STATIONMAXMANYREPLY_ERRORSENTRY._serialized_options = b'8\001'
   _globals['_RECORDTEMPSREQUEST']._serialized_start=17
   _globals['_RECORDTEMPSREQUEST']._serialized_end=96
   _globals['_RECORDTEMPSREPLY']._serialized_start=98
   _globals['_RECORDTEMPSREPLY']._serialized_end=131
-  _globals['_STATIONMAXREQUEST']._serialized_start=133
-  _globals['_STATIONMAXREQUEST']._serialized_end=169
-  _globals['_STATIONMAXREPLY']._serialized_start=171
-  _globals['_STATIONMAXREPLY']._serialized_end=217
-  _globals['_STATION']._serialized_start=219
-  _globals['_STATION']._serialized_end=339
+  _globals['_RECORDTEMPSBATCH']._serialized_start=133
+  _globals['_RECORDTEMPSBATCH']._serialized_end=189
+  _globals['_RECORDTEMPSCOLUMNS']._serialized_start=191
+  _globals['_RECORDTEMPSCOLUMNS']._serialized_end=270
+  _globals['_RECORDERROR']._serialized_start=272
+  _globals['_RECORDERROR']._serialized_end=315
+  _globals['_RECORDTEMPSBATCHREPLY']._serialized_start=317
+  _globals['_RECORDTEMPSBATCHREPLY']._serialized_end=387
+  _globals['_STATIONMAXREQUEST']._serialized_start=389
+  _globals['_STATIONMAXREQUEST']._serialized_end=425
+  _globals['_STATIONMAXREPLY']._serialized_start=427
+  _globals['_STATIONMAXREPLY']._serialized_end=473
+  _globals['_STATIONMAXMANYREQUEST']._serialized_start=475
+  _globals['_STATIONMAXMANYREQUEST']._serialized_end=516
+  _globals['_STATIONMAXMANYREPLY']._serialized_start=519
+  _globals['_STATIONMAXMANYREPLY']._serialized_end=728
+  _globals['_STATIONMAXMANYREPLY_TMAXENTRY']._serialized_start=638
+  _globals['_STATIONMAXMANYREPLY_TMAXENTRY']._serialized_end=681
+  _globals['_STATIONMAXMANYREPLY_ERRORSENTRY']._serialized_start=683
+  _globals['_STATIONMAXMANYREPLY_ERRORSENTRY']._serialized_end=728
+  _globals['_STATIONRANGEREQUEST']._serialized_start=730
+  _globals['_STATIONRANGEREQUEST']._serialized_end=816
+  _globals['_STATIONRANGEREPLY']._serialized_start=818
+  _globals['_STATIONRANGEREPLY']._serialized_end=894
+  _globals['_STATIONSTATSREQUEST']._serialized_start=896
+  _globals['_STATIONSTATSREQUEST']._serialized_end=934
+  _globals['_STATIONSTATSREPLY']._serialized_start=936
+  _globals['_STATIONSTATSREPLY']._serialized_end=1046
+  _globals['_STATIONQUANTILESREQUEST']._serialized_start=1048
+  _globals['_STATIONQUANTILESREQUEST']._serialized_end=1126
+  _globals['_STATIONQUANTILESREPLY']._serialized_start=1128
+  _globals['_STATIONQUANTILESREPLY']._serialized_end=1197
+  _globals['_TOPSTATIONSREQUEST']._serialized_start=1199
+  _globals['_TOPSTATIONSREQUEST']._serialized_end=1230
+  _globals['_TOPSTATIONSREPLY']._serialized_start=1232
+  _globals['_TOPSTATIONSREPLY']._serialized_end=1297
+  _globals['_STATION']._serialized_start=1300
+  _globals['_STATION']._serialized_end=1875
 # @@protoc_insertion_point(module_scope)
@@ -19,11 +19,46 @@ class StationStub(object):
                 request_serializer=station__pb2.RecordTempsRequest.SerializeToString,
                 response_deserializer=station__pb2.RecordTempsReply.FromString,
                 )
+        self.RecordTempsStream = channel.stream_unary(
+                '/Station/RecordTempsStream',
+                request_serializer=station__pb2.RecordTempsBatch.SerializeToString,
+                response_deserializer=station__pb2.RecordTempsBatchReply.FromString,
+                )
+        self.RecordTempsColumnar = channel.unary_unary(
+                '/Station/RecordTempsColumnar',
+                request_serializer=station__pb2.RecordTempsColumns.SerializeToString,
+                response_deserializer=station__pb2.RecordTempsBatchReply.FromString,
+                )
         self.StationMax = channel.unary_unary(
                 '/Station/StationMax',
                 request_serializer=station__pb2.StationMaxRequest.SerializeToString,
                 response_deserializer=station__pb2.StationMaxReply.FromString,
                 )
+        self.StationMaxMany = channel.unary_unary(
+                '/Station/StationMaxMany',
+                request_serializer=station__pb2.StationMaxManyRequest.SerializeToString,
+                response_deserializer=station__pb2.StationMaxManyReply.FromString,
+                )
+        self.StationRange = channel.unary_stream(
+                '/Station/StationRange',
+                request_serializer=station__pb2.StationRangeRequest.SerializeToString,
+                response_deserializer=station__pb2.StationRangeReply.FromString,
+                )
+        self.StationStats = channel.unary_unary(
+                '/Station/StationStats',
+                request_serializer=station__pb2.StationStatsRequest.SerializeToString,
+                response_deserializer=station__pb2.StationStatsReply.FromString,
+                )
+        self.StationQuantiles = channel.unary_unary(
+                '/Station/StationQuantiles',
+                request_serializer=station__pb2.StationQuantilesRequest.SerializeToString,
+                response_deserializer=station__pb2.StationQuantilesReply.FromString,
+                )
+        self.TopStations = channel.unary_unary(
+                '/Station/TopStations',
+                request_serializer=station__pb2.TopStationsRequest.SerializeToString,
+                response_deserializer=station__pb2.TopStationsReply.FromString,
+                )
 
 
 class StationServicer(object):
@@ -35,12 +70,54 @@ class StationServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def RecordTempsStream(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def RecordTempsColumnar(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def StationMax(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def StationMaxMany(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def StationRange(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def StationStats(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def StationQuantiles(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def TopStations(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_StationServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -49,11 +126,46 @@ def add_StationServicer_to_server(servicer, server):
                     request_deserializer=station__pb2.RecordTempsRequest.FromString,
                     response_serializer=station__pb2.RecordTempsReply.SerializeToString,
             ),
+            'RecordTempsStream': grpc.stream_unary_rpc_method_handler(
+                    servicer.RecordTempsStream,
+                    request_deserializer=station__pb2.RecordTempsBatch.FromString,
+                    response_serializer=station__pb2.RecordTempsBatchReply.SerializeToString,
+            ),
+            'RecordTempsColumnar': grpc.unary_unary_rpc_method_handler(
+                    servicer.RecordTempsColumnar,
+                    request_deserializer=station__pb2.RecordTempsColumns.FromString,
+                    response_serializer=station__pb2.RecordTempsBatchReply.SerializeToString,
+            ),
             'StationMax': grpc.unary_unary_rpc_method_handler(
                     servicer.StationMax,
                     request_deserializer=station__pb2.StationMaxRequest.FromString,
                     response_serializer=station__pb2.StationMaxReply.SerializeToString,
             ),
+            'StationMaxMany': grpc.unary_unary_rpc_method_handler(
+                    servicer.StationMaxMany,
+                    request_deserializer=station__pb2.StationMaxManyRequest.FromString,
+                    response_serializer=station__pb2.StationMaxManyReply.SerializeToString,
+            ),
+            'StationRange': grpc.unary_stream_rpc_method_handler(
+                    servicer.StationRange,
+                    request_deserializer=station__pb2.StationRangeRequest.FromString,
+                    response_serializer=station__pb2.StationRangeReply.SerializeToString,
+            ),
+            'StationStats': grpc.unary_unary_rpc_method_handler(
+                    servicer.StationStats,
+                    request_deserializer=station__pb2.StationStatsRequest.FromString,
+                    response_serializer=station__pb2.StationStatsReply.SerializeToString,
+            ),
+            'StationQuantiles': grpc.unary_unary_rpc_method_handler(
+                    servicer.StationQuantiles,
+                    request_deserializer=station__pb2.StationQuantilesRequest.FromString,
+                    response_serializer=station__pb2.StationQuantilesReply.SerializeToString,
+            ),
+            'TopStations': grpc.unary_unary_rpc_method_handler(
+                    servicer.TopStations,
+                    request_deserializer=station__pb2.TopStationsRequest.FromString,
+                    response_serializer=station__pb2.TopStationsReply.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'Station', rpc_method_handlers)
@@ -81,6 +193,40 @@ class Station(object):
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
 
+    @staticmethod
+    def RecordTempsStream(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(request_iterator, target, '/Station/RecordTempsStream',
+            station__pb2.RecordTempsBatch.SerializeToString,
+            station__pb2.RecordTempsBatchReply.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def RecordTempsColumnar(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/Station/RecordTempsColumnar',
+            station__pb2.RecordTempsColumns.SerializeToString,
+            station__pb2.RecordTempsBatchReply.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
     @staticmethod
     def StationMax(request,
             target,
@@ -97,3 +243,88 @@ class Station(object):
             station__pb2.StationMaxReply.FromString,
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def StationMaxMany(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/Station/StationMaxMany',
+            station__pb2.StationMaxManyRequest.SerializeToString,
+            station__pb2.StationMaxManyReply.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def StationRange(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(request, target, '/Station/StationRange',
+            station__pb2.StationRangeRequest.SerializeToString,
+            station__pb2.StationRangeReply.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def StationStats(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/Station/StationStats',
+            station__pb2.StationStatsRequest.SerializeToString,
+            station__pb2.StationStatsReply.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def StationQuantiles(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/Station/StationQuantiles',
+            station__pb2.StationQuantilesRequest.SerializeToString,
+            station__pb2.StationQuantilesReply.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def TopStations(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/Station/TopStations',
+            station__pb2.TopStationsRequest.SerializeToString,
+            station__pb2.TopStationsReply.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
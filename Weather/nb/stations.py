@@ -0,0 +1,78 @@
+from cassandra import ConsistencyLevel
+import argparse
+import mmap
+import numpy as np
+import os
+import time
+from backends import CassandraBackend, Writer, MAX_IN_FLIGHT as BATCHES_IN_FLIGHT
+from memory_backend import MemoryBackend
+
+STATIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ghcnd-stations.txt')
+# single-row writes, so more of them in flight than the batch loaders keep
+MAX_IN_FLIGHT = 2 * BATCHES_IN_FLIGHT
+
+# 0-based [start, end) byte columns of the fixed-width ghcnd-stations.txt layout
+ID = (0, 11)
+STATE = (38, 40)
+NAME = (41, 71)
+
+def column(rows, span):
+    # one fixed-width field of every line as a NumPy bytes array, without splitting lines
+    start, end = span
+    return np.ascontiguousarray(rows[:, start:end]).view('S%d' % (end - start)).ravel()
+
+def read_stations(path=STATIONS, state=None):
+    # memory-maps the file and views it as a (lines, width) byte matrix; every line in
+    # ghcnd-stations.txt has the same width, so columns are plain slices. names keep their
+    # padding to 30 characters, the same values the notebook's substring() wrote
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    width = data.find(b'\n') + 1
+    if width <= 0 or len(data) % width not in (0, width - 1):
+        data.close()
+        raise ValueError(path + " is not fixed-width")
+    if len(data) % width:
+        # last line without a trailing newline
+        raw = np.frombuffer(data[:] + b'\n', dtype=np.uint8)
+    else:
+        raw = np.frombuffer(data, dtype=np.uint8)
+    rows = raw.reshape(-1, width)
+    if state:
+        code = np.frombuffer(state.encode().ljust(2), dtype=np.uint8)
+        rows = rows[(rows[:, STATE[0]] == code[0]) & (rows[:, STATE[0] + 1] == code[1])]
+    ids = [s.decode() for s in column(rows, ID)]
+    names = [s.decode() for s in column(rows, NAME)]
+    # the views have to go before the map can be closed
+    del raw, rows
+    data.close()
+    return ids, names
+
+def load_names(backend, ids, names, in_flight=MAX_IN_FLIGHT):
+    # name is a static column, so each station is its own partition write; they go out
+    # concurrently with at most in_flight outstanding
+    cluster, cass = backend.connect('weather')
+    insert = cass.prepare("""INSERT INTO stations (id, name) VALUES(?,?) """)
+    insert.consistency_level = ConsistencyLevel.ONE
+    writer = Writer(cass, in_flight)
+    for station in zip(ids, names):
+        writer.send(insert, station)
+    writer.drain()
+    return writer.written, writer.errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="load station names from ghcnd-stations.txt without Spark")
+    parser.add_argument("--stations", default=STATIONS, help="path to ghcnd-stations.txt")
+    parser.add_argument("--state", default="WI", help="two-letter state to keep (empty for all)")
+    parser.add_argument("--backend", choices=["cassandra", "memory"], default="cassandra")
+    parser.add_argument("--in-flight", type=int, default=MAX_IN_FLIGHT, help="writes outstanding at once")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    ids, names = read_stations(args.stations, args.state)
+    parsed = time.perf_counter() - start
+    backend = MemoryBackend() if args.backend == "memory" else CassandraBackend()
+    written, errors = load_names(backend, ids, names, args.in_flight)
+    print("parsed %d stations in %.3fs, wrote %d in %.3fs total, %d failed"
+          % (len(ids), parsed, written, time.perf_counter() - start, len(errors)), flush = True)
+    for e in errors[:5]:
+        print(e)
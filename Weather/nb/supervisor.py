@@ -0,0 +1,196 @@
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from metrics import serve_metrics
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+# seconds a new worker gets to print "Started" before a rolling restart gives up on it
+READY_TIMEOUT = 60.0
+# a worker that dies sooner than this after starting is restarted only after a pause
+MIN_UPTIME = 5.0
+
+def with_worker_label(text, index):
+    # adds worker="index" to every sample line of a worker's /metrics page
+    lines = []
+    for line in text.splitlines():
+        name, _, value = line.rpartition(' ')
+        if not name:
+            continue
+        if '{' in name:
+            head, _, rest = name.partition('{')
+            name = '%s{worker="%d"%s%s' % (head, index, '' if rest == '}' else ',', rest)
+        else:
+            name = '%s{worker="%d"}' % (name, index)
+        lines.append('%s %s' % (name, value))
+    return lines
+
+def keeps_state(argv):
+    # workers whose spool or sketches row is keyed on their index; two processes with
+    # the same index mustn't run at once
+    return any(arg in ('--spool', '--sketches') or arg.startswith('--spool=') for arg in argv)
+
+def worker_argv(argv, index):
+    # a spool directory can only have one process in it, so every worker gets its own
+    # under the --spool given. It is keyed on the index alone, so whatever a worker left
+    # spooled is replayed by the one that replaces it
+    argv = list(argv)
+    for i, arg in enumerate(argv):
+        if arg == '--spool' and i + 1 < len(argv):
+            argv[i + 1] = os.path.join(argv[i + 1], 'worker-%d' % index)
+        elif arg.startswith('--spool='):
+            argv[i] = '--spool=' + os.path.join(arg[len('--spool='):], 'worker-%d' % index)
+    return argv
+
+class Worker:
+    # one server.py process sharing port 5440 through SO_REUSEPORT, with its own
+    # Cassandra session; its output is passed through with a [worker N] prefix
+    def __init__(self, index, argv, metrics_port):
+        self.index = index
+        self.metrics_port = metrics_port
+        command = [sys.executable, '-u', SERVER, *argv, '--reuseport', '--worker-index', str(index)]
+        if metrics_port:
+            command += ['--metrics-port', str(metrics_port)]
+        self.ready = threading.Event()
+        self.started = time.monotonic()
+        self.proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        threading.Thread(target=self.pump, daemon=True).start()
+
+    def pump(self):
+        for line in self.proc.stdout:
+            if line.strip() == "Started":
+                self.ready.set()
+            print("[worker %d] %s" % (self.index, line), end='', flush=True)
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def stop(self, grace):
+        # SIGTERM lets the worker drain its in-flight RPCs; kill it if that takes too long
+        if not self.alive():
+            return
+        self.proc.send_signal(signal.SIGTERM)
+        try:
+            self.proc.wait(grace + 5)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+    def metrics(self):
+        if not self.metrics_port:
+            return []
+        try:
+            with urllib.request.urlopen('http://127.0.0.1:%d/metrics' % self.metrics_port, timeout=1) as r:
+                return with_worker_label(r.read().decode(), self.index)
+        except OSError:
+            return []
+
+class Supervisor:
+    # keeps n workers running: restarts any that die, replaces them one at a time on
+    # SIGHUP (the new worker is up before the old one is told to stop, so the port never
+    # goes quiet; with --spool or --sketches the old one has to go first) and stops them
+    # all gracefully on SIGTERM or Ctrl-C
+    def __init__(self, n, argv, metrics_port=0, grace=5.0):
+        self.n = n
+        self.argv = argv
+        self.metrics_port = metrics_port
+        self.grace = grace
+        self.workers = [None] * n
+        self.generation = [0] * n
+        self.restarts = 0
+        self.restart_requested = False
+        self.stopping = False
+
+    def worker_port(self, index):
+        # each worker's own metrics port; a replacement alternates between two slots so
+        # it can bind while the worker it replaces still holds the other
+        if not self.metrics_port:
+            return 0
+        return self.metrics_port + 1 + index + (self.generation[index] % 2) * self.n
+
+    def spawn(self, index):
+        self.generation[index] += 1
+        return Worker(index, worker_argv(self.argv, index), self.worker_port(index))
+
+    def wait_ready(self, worker):
+        # True once worker has printed "Started"; gives up early if it exits first or the
+        # supervisor is told to stop, rather than sitting out READY_TIMEOUT
+        deadline = time.monotonic() + READY_TIMEOUT
+        while not worker.ready.wait(0.2):
+            if not worker.alive() or self.stopping or time.monotonic() > deadline:
+                return False
+        return worker.alive()
+
+    def rolling_restart(self):
+        for index, old in enumerate(self.workers):
+            if self.stopping:
+                return
+            if keeps_state(self.argv):
+                # the replacement can only take over the spool and sketches once the old
+                # worker has let go of them, so here the old one stops first and the
+                # other workers cover the port. One that doesn't come up is left to run()
+                old.stop(self.grace)
+                self.workers[index] = self.spawn(index)
+                self.restarts += 1
+                if not self.wait_ready(self.workers[index]) and not self.stopping:
+                    print("supervisor: worker %d replacement didn't start" % index, flush=True)
+                continue
+            new = self.spawn(index)
+            if not self.wait_ready(new):
+                if not self.stopping:
+                    print("supervisor: worker %d replacement didn't start, keeping the old one" % index, flush=True)
+                new.stop(0)
+                continue
+            self.workers[index] = new
+            old.stop(self.grace)
+            self.restarts += 1
+
+    def render(self):
+        lines = ['station_supervisor_workers %d' % sum(w.alive() for w in self.workers),
+                 'station_supervisor_restarts %d' % self.restarts]
+        for worker in list(self.workers):
+            lines.extend(worker.metrics())
+        return '\n'.join(lines) + '\n'
+
+    def run(self):
+        signal.signal(signal.SIGHUP, lambda *_: setattr(self, 'restart_requested', True))
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, 'stopping', True))
+        signal.signal(signal.SIGINT, lambda *_: setattr(self, 'stopping', True))
+        # worker 0 creates or migrates the tables (in StationServicer.__init__) before the
+        # others start, so a fresh cluster doesn't get the same schema changes from every
+        # worker at once
+        self.workers = [self.spawn(0)]
+        self.wait_ready(self.workers[0])
+        self.workers += [self.spawn(i) for i in range(1, self.n)]
+        if self.metrics_port:
+            serve_metrics(self.metrics_port, self)
+        print("supervisor: %d workers, pid %d (SIGHUP restarts them one by one)" % (self.n, os.getpid()), flush=True)
+        while not self.stopping:
+            if self.restart_requested:
+                self.restart_requested = False
+                self.rolling_restart()
+            for index, worker in enumerate(self.workers):
+                if not worker.alive() and not self.stopping:
+                    print("supervisor: worker %d exited with %s, restarting" % (index, worker.proc.returncode), flush=True)
+                    if time.monotonic() - worker.started < MIN_UPTIME:
+                        time.sleep(1.0)
+                    self.workers[index] = self.spawn(index)
+                    self.restarts += 1
+            time.sleep(0.2)
+        for worker in self.workers:
+            worker.proc.send_signal(signal.SIGTERM)
+        for worker in self.workers:
+            worker.stop(self.grace)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run several server.py workers on port 5440; other flags are passed to every worker")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="serve all workers' metrics, labelled by worker, on http://localhost:PORT/metrics")
+    parser.add_argument("--grace", type=float, default=5.0, help="seconds a stopping worker gets to finish its RPCs")
+    args, argv = parser.parse_known_args()
+    Supervisor(args.workers, argv + ['--grace', str(args.grace)], args.metrics_port, args.grace).run()
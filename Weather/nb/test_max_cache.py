@@ -0,0 +1,13 @@
+from max_cache import MaxCache, MISS
+
+def test_read_from_before_a_write_is_not_cached():
+    cache = MaxCache(10, 60)
+    assert cache.get("A") is MISS
+    version = cache.version("A")
+    # a RecordTemps lands while the read is out; the read comes back with the old max
+    cache.raise_to("A", 20)
+    cache.put("A", 10, version)
+    assert cache.get("A") is MISS
+    cache.put("A", 20, cache.version("A"))
+    cache.raise_to("A", 30)
+    assert cache.get("A") == 30
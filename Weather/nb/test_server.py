@@ -0,0 +1,242 @@
+from functools import partial
+import asyncio
+import threading
+import time
+import cassandra
+import cassandra.cluster
+import server
+import station_pb2
+from buckets import day_number
+from memory_backend import MemoryBackend, MemoryFuture
+from server import StationServicer, AsyncStationServicer, SPOOL_FULL
+from spool import Spool
+
+UNAVAILABLE = "need 3 replicas, but only have 2"
+
+class FailingBackend(MemoryBackend):
+    # the in-memory cluster, except that while down every statement fails with
+    # Unavailable, the way a real one does with a replica missing. down_for limits that
+    # to statements run from the thread of that name
+    def __init__(self):
+        super().__init__()
+        self.down = False
+        self.down_for = None
+
+    def failing(self):
+        return self.down and (self.down_for is None or threading.current_thread().name == self.down_for)
+
+    def connect(self, keyspace=None, **options):
+        cluster, session = super().connect(keyspace)
+        execute_async = session.execute_async
+
+        def failing(statement, parameters=None, **kwargs):
+            if not self.failing():
+                return execute_async(statement, parameters, **kwargs)
+            future = MemoryFuture(session, error=cassandra.Unavailable("down", consistency=3, required_replicas=3, alive_replicas=2))
+            session.finish(future)
+            return future
+        session.execute_async = failing
+        session.execute = lambda statement, parameters=None, **kwargs: failing(statement, parameters, **kwargs).result()
+        return cluster, session
+
+def call(servicer, method, request):
+    reply = getattr(servicer, method)(request, None)
+    return asyncio.run(reply) if asyncio.iscoroutine(reply) else reply
+
+def servicers(**options):
+    for kind in (StationServicer, AsyncStationServicer):
+        backend = FailingBackend()
+        yield backend, kind(backend=backend, **options)
+
+def record(servicer, station, day, tmin, tmax):
+    reply = call(servicer, "RecordTemps", station_pb2.RecordTempsRequest(station=station, date="2021-01-%02d" % day, tmin=tmin, tmax=tmax))
+    assert reply.error == ""
+
+def test_station_max_failure_is_reported():
+    for options in ({}, {"cache_entries": 100}):
+        for backend, servicer in servicers(**options):
+            record(servicer, "A", 1, 0, 10)
+            backend.down = True
+            reply = call(servicer, "StationMax", station_pb2.StationMaxRequest(station="A"))
+            assert (reply.tmax, reply.error) == (0, UNAVAILABLE)
+            backend.down = False
+            reply = call(servicer, "StationMax", station_pb2.StationMaxRequest(station="A"))
+            assert (reply.tmax, reply.error) == (10, "")
+            servicer.close()
+
+def test_bucketed_reads_report_failures():
+    for options in ({"layout": "bucketed"}, {"layout": "bucketed", "cache_entries": 100}, {"layout": "bucketed", "series_cache": 1 << 20}):
+        for backend, servicer in servicers(**options):
+            record(servicer, "A", 1, 0, 10)
+            backend.down = True
+            reply = call(servicer, "StationMax", station_pb2.StationMaxRequest(station="A"))
+            assert (reply.tmax, reply.error) == (0, UNAVAILABLE)
+            reply = call(servicer, "StationStats", station_pb2.StationStatsRequest(station="A"))
+            assert (reply.count, reply.error) == (0, UNAVAILABLE)
+            reply = call(servicer, "StationQuantiles", station_pb2.StationQuantilesRequest(station="A"))
+            assert (list(reply.values), reply.error) == ([], UNAVAILABLE)
+            reply = call(servicer, "StationMaxMany", station_pb2.StationMaxManyRequest(stations=["A"]))
+            assert (dict(reply.tmax), dict(reply.errors)) == ({}, {"A": UNAVAILABLE})
+            # nothing from the failed reads was cached
+            backend.down = False
+            reply = call(servicer, "StationMax", station_pb2.StationMaxRequest(station="A"))
+            assert (reply.tmax, reply.error) == (10, "")
+            reply = call(servicer, "StationStats", station_pb2.StationStatsRequest(station="A"))
+            assert (reply.count, reply.max_spread, reply.error) == (1, 10, "")
+            servicer.close()
+
+def wait_for(condition):
+    for _ in range(100):
+        if condition():
+            return
+        time.sleep(0.05)
+    assert condition()
+
+def test_full_spool_refuses_rows_it_would_have_queued(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "Spool", partial(Spool, segment_bytes=4096))
+    for kind in (StationServicer, AsyncStationServicer):
+        backend = FailingBackend()
+        servicer = kind(backend=backend, spool=str(tmp_path / kind.__name__), spool_bytes=8192)
+        backend.down = True
+        day = 1
+        while call(servicer, "RecordTemps", station_pb2.RecordTempsRequest(station="A", date="2021-01-01", tmin=0, tmax=day)).error == "":
+            day += 1
+        # the replicas are back but the spool hasn't been replayed yet: a newer reading
+        # written directly now would be overwritten by the older spooled ones
+        backend.down_for = "spool-replay"
+        reply = call(servicer, "RecordTemps", station_pb2.RecordTempsRequest(station="A", date="2021-01-01", tmin=0, tmax=1000))
+        assert reply.error == SPOOL_FULL
+        reply = call(servicer, "RecordTempsColumnar", station_pb2.RecordTempsColumns(station="A", days=[18628], tmin=[0], tmax=[1000]))
+        assert (reply.written, [e.error for e in reply.errors]) == (0, [SPOOL_FULL])
+        backend.down = False
+        wait_for(lambda: servicer.spool.depth == 0)
+        reply = call(servicer, "StationMax", station_pb2.StationMaxRequest(station="A"))
+        assert (reply.tmax, reply.error) == (day - 1, "")
+        servicer.close()
+
+def test_format_error_counts_once():
+    from metrics import REGISTRY
+    before = dict(REGISTRY.counters)
+    unavailable = cassandra.Unavailable("down", consistency=3, required_replicas=3, alive_replicas=2)
+    assert server.format_error(cassandra.cluster.NoHostAvailable("no host", {"10.0.0.1": unavailable})) == UNAVAILABLE
+    counted = {key: n - before.get(key, 0) for key, n in REGISTRY.counters.items() if n != before.get(key, 0)}
+    assert [dict(labels)["error"] for (name, labels) in counted] == ["NoHostAvailable"]
+    assert list(counted.values()) == [1]
+
+def test_aggregates_follow_overwritten_readings():
+    for options in ({"aggregates": True}, {"aggregates": True, "layout": "bucketed"}):
+        for backend, servicer in servicers(**options):
+            record(servicer, "A", 1, 1, 10)
+            record(servicer, "A", 1, 0, 49)
+            reply = call(servicer, "StationStats", station_pb2.StationStatsRequest(station="A"))
+            assert (reply.count, reply.mean_spread, reply.min_spread, reply.max_spread) == (1, 49.0, 49, 49)
+            record(servicer, "A", 2, 0, 80)
+            record(servicer, "A", 2, 0, 20)
+            record(servicer, "B", 1, 0, 30)
+            assert call(servicer, "StationMax", station_pb2.StationMaxRequest(station="A")).tmax == 49
+            reply = call(servicer, "StationMaxMany", station_pb2.StationMaxManyRequest(stations=["A", "B"]))
+            assert dict(reply.tmax) == {"A": 49, "B": 30}
+            reply = call(servicer, "TopStations", station_pb2.TopStationsRequest(k=2))
+            assert (list(reply.stations), list(reply.tmax)) == (["A", "B"], [49, 30])
+            reply = call(servicer, "StationStats", station_pb2.StationStatsRequest(station="A"))
+            assert (reply.count, reply.mean_spread, reply.min_spread, reply.max_spread) == (2, 34.5, 20, 49)
+            # a reading that doesn't overwrite the extremes keeps the stored ones in use
+            record(servicer, "B", 2, 0, 10)
+            record(servicer, "B", 2, 0, 20)
+            cluster, session = backend.connect()
+            assert session.execute("SELECT tmax FROM station_aggregates WHERE id = 'B'").one().tmax == 30
+            servicer.close()
+
+def test_paged_read_counts_as_one_hedge_read():
+    servicer = StationServicer(backend=MemoryBackend(), hedge_delay=0.01)
+    for day in range(1, 31):
+        record(servicer, "A", day, 0, day)
+    pages = list(servicer.StationRange(station_pb2.StationRangeRequest(station="A", fetch_size=5), None))
+    assert len(pages) == 6
+    wait_for(lambda: servicer.stats().get("station_hedge_reads", {}).get("StationRange") == 1)
+    time.sleep(0.1)
+    assert servicer.stats()["station_hedge_reads"]["StationRange"] == 1
+    servicer.close()
+
+def test_spooled_rows_replay_after_an_outage(tmp_path):
+    for name, kind, options in (("sync", StationServicer, {}), ("write_behind", StationServicer, {"write_behind": 1000}),
+                                ("aio", AsyncStationServicer, {})):
+        backend = FailingBackend()
+        servicer = kind(backend=backend, aggregates=True, spool=str(tmp_path / name), **options)
+        backend.down = True
+        for day in range(1, 11):
+            record(servicer, "A", day, 0, day)
+        # a newer reading for a day already spooled lands after it
+        record(servicer, "A", 1, 0, 100)
+        assert servicer.spool.depth == 11
+        backend.down = False
+        wait_for(lambda: servicer.spool.depth == 0)
+        reply = call(servicer, "StationMax", station_pb2.StationMaxRequest(station="A"))
+        assert (reply.tmax, reply.error) == (100, "")
+        reply = call(servicer, "StationStats", station_pb2.StationStatsRequest(station="A"))
+        assert reply.count == 10
+        servicer.close()
+
+def test_spool_outlives_a_restart(tmp_path):
+    backend = FailingBackend()
+    servicer = StationServicer(backend=backend, spool=str(tmp_path))
+    backend.down = True
+    record(servicer, "A", 1, 0, 10)
+    record(servicer, "A", 2, 0, 20)
+    servicer.close()
+    backend.down = False
+    servicer = StationServicer(backend=backend, spool=str(tmp_path))
+    wait_for(lambda: servicer.spool.depth == 0)
+    reply = call(servicer, "StationMax", station_pb2.StationMaxRequest(station="A"))
+    assert (reply.tmax, reply.error) == (20, "")
+    servicer.close()
+
+def range_days(servicer, station, start="", end="", fetch_size=0):
+    request = station_pb2.StationRangeRequest(station=station, start=start, end=end, fetch_size=fetch_size)
+    replies = servicer.StationRange(request, None)
+    if hasattr(replies, "__aiter__"):
+        async def collect():
+            return [reply async for reply in replies]
+        replies = asyncio.run(collect())
+    pages = list(replies)
+    assert all(page.error == "" for page in pages)
+    return [(d, t) for page in pages for d, t in zip(page.days, page.tmax)]
+
+def test_bucketed_layout_reads_across_years():
+    readings = [(day_number(d), t) for d, t in [("2019-12-30", 5), ("2019-12-31", 40), ("2020-01-01", 7),
+                                                ("2020-06-01", 35), ("2021-01-02", 3)]]
+    for options in ({}, {"layout": "bucketed"}, {"layout": "bucketed", "aggregates": True}):
+        for backend, servicer in servicers(**options):
+            # written out of order, and into more than one bucket at once
+            reply = call(servicer, "RecordTempsColumnar", station_pb2.RecordTempsColumns(
+                station="A", days=[d for d, t in reversed(readings)],
+                tmin=[0] * len(readings), tmax=[t for d, t in reversed(readings)]))
+            assert (reply.written, list(reply.errors)) == (len(readings), [])
+            assert call(servicer, "StationMax", station_pb2.StationMaxRequest(station="A")).tmax == 40
+            assert range_days(servicer, "A", fetch_size=2) == readings
+            assert range_days(servicer, "A", "2019-12-31", "2020-06-01") == readings[1:4]
+            reply = call(servicer, "StationStats", station_pb2.StationStatsRequest(station="A"))
+            assert (reply.count, reply.min_spread, reply.max_spread) == (5, 3, 40)
+            servicer.close()
+
+def test_top_stations_from_the_index_and_from_aggregates():
+    for options in ({"aggregates": True}, {"aggregates": True, "top_stations": 2}):
+        backend = FailingBackend()
+        servicer = StationServicer(backend=backend, **options)
+        for station, day, tmax in (("A", 1, 10), ("B", 1, 30), ("C", 1, 20), ("A", 2, 25)):
+            record(servicer, station, day, 0, tmax)
+        reply = call(servicer, "TopStations", station_pb2.TopStationsRequest(k=2))
+        assert (list(reply.stations), list(reply.tmax)) == (["B", "A"], [30, 25])
+        reply = call(servicer, "TopStations", station_pb2.TopStationsRequest())
+        assert len(reply.stations) == (2 if "top_stations" in options else 3)
+        servicer.close()
+        # a new process starts from station_aggregates, not the readings
+        servicer = StationServicer(backend=backend, **options)
+        reply = call(servicer, "TopStations", station_pb2.TopStationsRequest(k=1))
+        assert (list(reply.stations), list(reply.tmax)) == (["B"], [30])
+        servicer.close()
+
+def test_top_stations_needs_aggregates():
+    servicer = StationServicer(backend=MemoryBackend())
+    assert "--aggregates" in call(servicer, "TopStations", station_pb2.TopStationsRequest()).error
+    servicer.close()
@@ -0,0 +1,57 @@
+import threading
+import time
+import supervisor
+from supervisor import Supervisor
+
+class FakeWorker:
+    def __init__(self, exits_after=None, ready_after=None):
+        self.ready = threading.Event()
+        self.born = time.monotonic()
+        self.exits_after = exits_after
+        if ready_after is not None:
+            threading.Timer(ready_after, self.ready.set).start()
+
+    def alive(self):
+        return self.exits_after is None or time.monotonic() - self.born < self.exits_after
+
+def waited(supervisor, worker):
+    start = time.monotonic()
+    return supervisor.wait_ready(worker), time.monotonic() - start
+
+def test_wait_ready_gives_up_on_a_replacement_that_exits():
+    ready, seconds = waited(Supervisor(1, []), FakeWorker(exits_after=0.3))
+    assert not ready and seconds < 2
+
+def test_wait_ready_gives_up_when_stopping():
+    s = Supervisor(1, [])
+    threading.Timer(0.3, setattr, (s, 'stopping', True)).start()
+    ready, seconds = waited(s, FakeWorker())
+    assert not ready and seconds < 2
+
+def test_wait_ready_times_out(monkeypatch):
+    monkeypatch.setattr(supervisor, 'READY_TIMEOUT', 0.5)
+    ready, seconds = waited(Supervisor(1, []), FakeWorker())
+    assert not ready and seconds < 2
+    assert waited(Supervisor(1, []), FakeWorker(ready_after=0.3))[0]
+
+def test_other_workers_start_after_worker_0_is_ready(monkeypatch):
+    s = Supervisor(3, [])
+    spawned = []
+
+    def spawn(index):
+        # worker 0 sets up the schema, which takes a moment; by the time the others are
+        # spawned it must have finished
+        spawned.append((index, [w.ready.is_set() for w in spawned_workers]))
+        worker = FakeWorker(ready_after=0.3 if index == 0 else 0)
+        worker.stop = lambda grace: None
+        worker.proc = type('Proc', (), {'send_signal': lambda self, sig: None})()
+        spawned_workers.append(worker)
+        if len(spawned) == s.n:
+            s.stopping = True
+        return worker
+    spawned_workers = []
+    monkeypatch.setattr(s, 'spawn', spawn)
+    monkeypatch.setattr(supervisor.signal, 'signal', lambda *args: None)
+    s.run()
+    assert [index for index, _ in spawned] == [0, 1, 2]
+    assert all(ready[0] for _, ready in spawned[1:])
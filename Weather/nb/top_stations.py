@@ -0,0 +1,86 @@
+import heapq
+import threading
+
+DEFAULT_K = 10
+REFRESH_INTERVAL = 60.0
+
+class HottestStations:
+    # the capacity stations with the highest tmax seen: a dict of station -> tmax, and a
+    # min-heap of (tmax, station) whose top is the entry to evict next. Raising a
+    # station's tmax pushes a new heap entry and leaves the old one behind; stale entries
+    # (their tmax no longer matches the dict) are dropped when they reach the top, and
+    # the heap is rebuilt once they make up half of it.
+    # A station outside the index never had a tmax above the smallest one in it, so the
+    # first reading that beats that smallest tmax is also the station's real max. That is
+    # why a reading alone is enough to admit a station.
+    # load() returns (station, tmax) pairs from station_aggregates. It runs once at
+    # startup and then every interval seconds, to pick up other processes' writes
+    def __init__(self, capacity, load=None, interval=REFRESH_INTERVAL):
+        self.capacity = capacity
+        self.load = load
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.tmax = {}
+        self.heap = []
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.stop = threading.Event()
+        self.thread = None
+        if load:
+            self.refresh()
+            if interval:
+                self.thread = threading.Thread(target=self.run, name="top-stations-refresh", daemon=True)
+                self.thread.start()
+
+    def _smallest(self):
+        # the heap top once stale entries are off it; called with the lock held
+        while self.heap and self.tmax.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0] if self.heap else None
+
+    def update(self, station, tmax):
+        if tmax is None:
+            return
+        with self.lock:
+            current = self.tmax.get(station)
+            if current is not None:
+                if tmax <= current:
+                    return
+            elif len(self.tmax) >= self.capacity:
+                smallest = self._smallest()
+                if smallest is None or tmax <= smallest[0]:
+                    return
+                heapq.heappop(self.heap)
+                del self.tmax[smallest[1]]
+            self.tmax[station] = tmax
+            heapq.heappush(self.heap, (tmax, station))
+            if len(self.heap) > 2 * max(self.capacity, 1):
+                self.heap = [(t, s) for s, t in self.tmax.items()]
+                heapq.heapify(self.heap)
+
+    def top(self, k=DEFAULT_K):
+        # (station, tmax) pairs, hottest first
+        with self.lock:
+            return heapq.nlargest(min(k, self.capacity), self.tmax.items(), key=lambda item: item[1])
+
+    def refresh(self):
+        for station, tmax in self.load():
+            self.update(station, tmax)
+        self.refreshes += 1
+
+    def run(self):
+        while not self.stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception:
+                # the next round tries again; what the index holds is still good
+                self.refresh_errors += 1
+
+    def close(self):
+        self.stop.set()
+        if self.thread:
+            self.thread.join()
+
+    def stats(self):
+        return {"entries": len(self.tmax), "capacity": self.capacity, "refreshes": self.refreshes,
+                "refresh_errors": self.refresh_errors}
@@ -0,0 +1,96 @@
+from concurrent.futures import Future
+from collections import deque
+import threading
+import time
+
+class BufferFull(Exception):
+    pass
+
+class WriteBehind:
+    # bounded queue of single-row writes drained by one background thread. flush(items)
+    # writes a list of items however it likes (the servicer batches them per partition)
+    # and returns {index in items: error}; each submit's future resolves to its error, or
+    # "" once its row is written
+    def __init__(self, flush, max_rows=10000, max_flush=3200, linger=0.002, metrics=None):
+        self.flush = flush
+        self.max_rows = max_rows
+        self.max_flush = max_flush
+        self.linger = linger
+        self.metrics = metrics
+        self.items = deque()
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+        self.closed = False
+        self.flushes = 0
+        self.flushed = 0
+        self.rejected = 0
+        self.thread = threading.Thread(target=self.run, name="write-behind", daemon=True)
+        self.thread.start()
+
+    def submit(self, item, timeout=None, count=True):
+        # blocks while the queue is full, which is the backpressure: callers slow down to
+        # the flusher's pace. gives up with BufferFull after timeout seconds; count=False
+        # leaves that out of rejected, for a caller that will try again with a wait
+        waiter = Future()
+        with self.lock:
+            if len(self.items) >= self.max_rows:
+                deadline = None if timeout is None else time.monotonic() + timeout
+                while len(self.items) >= self.max_rows and not self.closed:
+                    left = None if deadline is None else deadline - time.monotonic()
+                    if left is not None and left <= 0:
+                        if count:
+                            self.rejected += 1
+                        raise BufferFull("write-behind queue full")
+                    self.not_full.wait(left)
+            if self.closed:
+                raise BufferFull("write-behind queue closed")
+            self.items.append((item, waiter))
+            self.not_empty.notify()
+        return waiter
+
+    def take(self):
+        with self.lock:
+            while not self.items and not self.closed:
+                self.not_empty.wait()
+            if not self.items:
+                return None
+        # let a burst accumulate so rows for the same station end up in one batch
+        if self.linger:
+            time.sleep(self.linger)
+        with self.lock:
+            n = min(len(self.items), self.max_flush)
+            taken = [self.items.popleft() for _ in range(n)]
+            self.not_full.notify_all()
+        return taken
+
+    def run(self):
+        while True:
+            taken = self.take()
+            if taken is None:
+                return
+            start = time.perf_counter()
+            try:
+                errors = self.flush([item for item, waiter in taken])
+            except Exception as e:
+                errors = dict.fromkeys(range(len(taken)), str(e))
+            elapsed = time.perf_counter() - start
+            for i, (item, waiter) in enumerate(taken):
+                waiter.set_result(errors.get(i, ""))
+            self.flushes += 1
+            self.flushed += len(taken)
+            if self.metrics:
+                self.metrics.observe('station_write_behind_flush_seconds', {}, elapsed)
+                self.metrics.observe('station_write_behind_flush_rows', {}, len(taken), scale=1)
+
+    def close(self):
+        # stops taking new rows and waits for the ones already queued to be written
+        with self.lock:
+            self.closed = True
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+        self.thread.join()
+
+    def stats(self):
+        return {"depth": len(self.items), "max_rows": self.max_rows, "flushes": self.flushes,
+                "flushed_rows": self.flushed, "rejected": self.rejected}